@@ -0,0 +1,197 @@
+import os
+import json
+import mmap
+import time
+import errno
+import fcntl
+import struct
+import logging
+import threading
+
+from serial_data_codec import get_codec
+
+LOGGER = logging.getLogger(__name__)
+
+# Capture file, all fields big-endian:
+#
+#   4 bytes  magic 'SCAP'
+#   1 byte   version
+#   2 bytes  size of the metadata
+#   ...      metadata, JSON with codec, port, device and started
+#
+# followed by one record per read from the serial port:
+#
+#   8 bytes  read time in microseconds since 1970
+#   4 bytes  size of the data
+#   ...      raw bytes as read
+HEADER = struct.Struct('>4sBH')
+RECORD = struct.Struct('>QI')
+MAGIC = b'SCAP'
+VERSION = 1
+SUFFIX = '.scap'
+
+def get_capture_path(directory, device_id):
+    return os.path.join(directory, '%s-%s%s' % (device_id, time.strftime('%Y%m%dT%H%M%S'), SUFFIX))
+
+def read_capture(data):
+    # Returns (metadata, offset of the first record) of a capture in data
+    if len(data) < HEADER.size:
+        raise ValueError('Capture is too short for a header')
+    magic, version, metadata_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version %i capture' % VERSION)
+    offset = HEADER.size + metadata_size
+    return json.loads(data[HEADER.size:offset]), offset
+
+def iter_records(data, offset):
+    # (read time in microseconds, raw bytes, offset of the next record),
+    # stops at a record that was cut short by a crash
+    while offset + RECORD.size <= len(data):
+        microseconds, size = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + size
+        if end > len(data):
+            LOGGER.warning('Capture ends with a truncated record at offset %i', offset)
+            return
+        yield microseconds, data[offset + RECORD.size:end], end
+        offset = end
+
+class SerialCaptureWriter(object):
+
+    # Appends everything read from a serial port. Writes are buffered by
+    # the file object, a crash loses at most the tail of the capture.
+
+    def __init__(self, path, codec_name, port, device_id):
+        self.path = path
+        metadata = json.dumps({'codec': codec_name, 'port': port, 'device': device_id,
+                               'started': time.time()})
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(metadata)) + metadata)
+        self.bytes_written = 0
+        LOGGER.info('Capturing port %s to %s', port, path)
+
+    def write(self, data, read_time):
+        if data:
+            self._file.write(RECORD.pack(int(read_time * 1000000), len(data)) + data)
+            self.bytes_written += len(data)
+
+    def close(self):
+        self._file.close()
+
+class SerialCaptureReplay(object):
+
+    # Replays a capture in place of a SerialPortReader. fileno is the read
+    # end of a wake pipe: a timer thread makes it readable when the next
+    # record is due, at speed times the captured pace. Speed 0 replays as
+    # fast as the reader keeps up, read_frames then re-arms the pipe itself.
+
+    MAX_READ = 65536
+
+    def __init__(self, path, speed=1.0, loop=False, device_id=None):
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        metadata, self._start_offset = read_capture(self._data)
+        self.serial_port_name = path
+        self.device_id = device_id or metadata['device']
+        self.codec = get_codec(metadata['codec'])
+        self.scanner = self.codec.new_scanner()
+        self.last_read_time = None
+        self.speed = float(speed)
+        self.loop = loop
+        self.finished = False
+        self._records = iter_records(self._data, self._start_offset)
+        self._next = next(self._records, None)
+        self._capture_start = self._next[0] if self._next else 0
+        self._replay_start = None
+        self._wake_read, self._wake_write = os.pipe()
+        for fd in (self._wake_read, self._wake_write):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._wake_at = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._timer = threading.Thread(target=self._run_timer, name='SerialCaptureReplay')
+        self._timer.daemon = True
+        self._timer.start()
+        LOGGER.info('Replaying %s (device %s, %s codec) at %s speed', path, self.device_id,
+                    self.codec.name, '%gx' % self.speed if self.speed else 'max')
+        self._wake()
+
+    def fileno(self):
+        return self._wake_read
+
+    def _due_time(self, microseconds):
+        if not self.speed:
+            return 0
+        return self._replay_start + (microseconds - self._capture_start) / 1000000.0 / self.speed
+
+    def read_frames(self):
+        try:
+            while os.read(self._wake_read, 4096):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+        now = time.time()
+        if self._replay_start is None:
+            self._replay_start = now
+        chunks = []
+        size = 0
+        while self._next is not None and size < self.MAX_READ:
+            microseconds, data, _ = self._next
+            if self._due_time(microseconds) > now:
+                break
+            chunks.append(data)
+            size += len(data)
+            self._next = next(self._records, None)
+            if self._next is None and self.loop:
+                self._records = iter_records(self._data, self._start_offset)
+                self._next = next(self._records, None)
+                self._replay_start += (microseconds - self._capture_start) / 1000000.0 / (self.speed or 1)
+        if self._next is None:
+            if not self.finished:
+                LOGGER.info('Replay of %s finished', self.serial_port_name)
+            self.finished = True
+        else:
+            self._schedule_wake(self._due_time(self._next[0]))
+        self.last_read_time = now
+        return self.scanner.feed(b''.join(chunks))
+
+    def _schedule_wake(self, wake_at):
+        if wake_at <= time.time():
+            self._wake()
+            return
+        with self._condition:
+            self._wake_at = wake_at
+            self._condition.notify()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b'x')
+        except OSError as error:
+            # A full pipe is readable already
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def _run_timer(self):
+        with self._condition:
+            while not self._closed:
+                if self._wake_at is None:
+                    self._condition.wait()
+                    continue
+                delay = self._wake_at - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                self._wake_at = None
+                self._wake()
+
+    def get_counters(self):
+        return self.scanner.get_counters()
+
+    def stop(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._timer.join()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+        self._data.close()
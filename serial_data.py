@@ -1,11 +1,31 @@
-import csv, io, json, logging
+import csv, imp, io, logging, importlib
 
-LOGGER = logging.getLogger(__name__)
+from collections import OrderedDict
+
+class _LazyModule(object):
+
+    # Imports the module on first use, numpy only serves batch decoding and
+    # costs the consumer and publisher most of their start up otherwise
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+try:
+    imp.find_module('numpy')
+    numpy = _LazyModule('numpy')
+except ImportError:
+    numpy = None
 
-class JsonObject(object):
-    def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__,
-            sort_keys=False, indent=0, separators=(',',':'))
+from serial_data_codec import get_codec
+from serial_data_schema import SerialDataSchemaCache, SCHEMA_MARKER, DATA_MARKER
+
+LOGGER = logging.getLogger(__name__)
 
 class SerialData(object):
 
@@ -13,11 +33,26 @@ class SerialData(object):
         self.message = ''
         self.batch = []
         self.batch_full = False
+        self.batch_overflow = None
+        self.batch_max_count = 0 # no limit
         self.message_max_size = 10240 # default 10KB
         self.message_max_size_limit = 131072 # 128KB
+        self._batch_buffer = bytearray(self.message_max_size)
+        self._batch_size = 2 # enclosing brackets
+        self.schemas = SerialDataSchemaCache()
+        # Schema id of the last parsed line when its schema was not seen yet
+        self.unknown_schema = None
+        # Why the last parsed line was dropped, like a line with more values
+        # than its schema has fields
+        self.parse_error = None
 
     def set_message(self, message):
         self.message = message
+        self.unknown_schema = None
+        self.parse_error = None
+
+    def set_field_types(self, field_types):
+        self.schemas.set_field_types(field_types)
 
     def set_message_max_size(self, message_max_size):
         message_max_size = int(message_max_size)
@@ -25,28 +60,70 @@ class SerialData(object):
             self.message_max_size = message_max_size
         else:
             self.message_max_size = self.message_max_size_limit
+        self._reserve_batch_buffer(self.message_max_size)
+
+    def set_batch_max_count(self, batch_max_count):
+        self.batch_max_count = int(batch_max_count)
 
     def set_batch(self):
-        if self.get_batch_size() + len(self.message) <= self.message_max_size:
-            self.batch.append(self.message)
+        message = self.message
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        batch_size = self._batch_size + len(message) + (1 if self.batch else 0)
+        if batch_size <= self.message_max_size or not self.batch:
+            self._append_to_batch(message, batch_size)
+            if batch_size > self.message_max_size:
+                LOGGER.warning('Message of %i bytes exceeds max batch size', len(message))
+                self.batch_full = True
+            if self.batch_max_count and len(self.batch) >= self.batch_max_count:
+                self.batch_full = True
         else:
+            # Keep the message that did not fit, clear_batch starts the next batch with it
+            self.batch_overflow = message
             self.batch_full = True
-        LOGGER.debug("Batch size: %s", self.get_batch_size())
+        LOGGER.debug("Batch size: %s", self._batch_size)
         return self
 
     def get_batch(self):
-        return self._parse_array_to_string(self.batch)
+        end = self._batch_size - 1
+        self._batch_buffer[0] = ord('[')
+        self._batch_buffer[end] = ord(']')
+        return bytes(self._batch_buffer[:end + 1])
 
     def get_batch_size(self):
-        return len(self._parse_array_to_string(self.batch))
+        return self._batch_size
 
     def clear_batch(self):
+        overflow = self.batch_overflow
         self.batch = []
         self.batch_full = False
+        self.batch_overflow = None
+        self._batch_size = 2
+        if overflow is not None:
+            message = self.message
+            self.message = overflow
+            self.set_batch()
+            self.message = message
+
+    def _reserve_batch_buffer(self, size):
+        if len(self._batch_buffer) < size:
+            self._batch_buffer.extend(bytearray(size - len(self._batch_buffer)))
+
+    def _append_to_batch(self, message, batch_size):
+        self._reserve_batch_buffer(batch_size)
+        offset = self._batch_size - 1
+        if self.batch:
+            self._batch_buffer[offset] = ord(',')
+            offset += 1
+        self._batch_buffer[offset:offset + len(message)] = message
+        self._batch_size = batch_size
+        self.batch.append(message)
 
     def parse_ascii_to_string(self):
-        input_list = self.message.split(' ')
-        self.message = ''.join(unichr(int(ascii)) for ascii in input_list if ascii).replace('\n','')
+        return self.parse_wire_to_string(get_codec('ascii'))
+
+    def parse_wire_to_string(self, codec):
+        self.message = codec.decode(self.message).replace('\n','')
         return self
 
     def parse_string_to_json(self):
@@ -54,11 +131,116 @@ class SerialData(object):
         f = io.StringIO(self.message.decode('utf-8'))
         reader = csv.reader(f, delimiter=',')
         for row in reader:
-            json_object = self._build_json_object(row)
-            json_string = json_object.toJSON()
-        self.message = json_string.replace('\n','')
+            json_string = self._parse_row_to_json(row)
+        self.message = json_string
         return self
 
+    def _parse_row_to_json(self, row):
+        # Schema rows only update the cache and leave an empty message
+        if row and row[0].startswith(SCHEMA_MARKER):
+            self.schemas.add(row[0][1:], row[1:])
+            return ''
+        if row and row[0].startswith(DATA_MARKER):
+            schema = self.schemas.get(row[0][1:])
+            if schema is None:
+                LOGGER.debug('Line with unknown schema %s', row[0][1:])
+                self.unknown_schema = row[0][1:]
+                return ''
+            return self._schema_to_json(schema, row[1:])
+        half = len(row) // 2
+        return self._schema_to_json(self.schemas.get_legacy(row[:half]), row[half:])
+
+    def _schema_to_json(self, schema, values):
+        json_string = schema.to_json(values)
+        if json_string is None:
+            self.parse_error = 'Schema %s has %i fields, got %i values' % (
+                schema.schema_id, len(schema.fields), len(values))
+            LOGGER.debug('Line does not match its schema: %s', self.parse_error)
+            return ''
+        return json_string
+
+    def decode_batch(self, bodies):
+        # Vectorized parse_ascii_to_string().parse_string_to_json() for many
+        # ASCII-decimal bodies, returns one JSON string per body
+        return [self._parse_row_to_json(row) for row in self._decode_batch_rows(bodies)]
+
+    def decode_batch_columns(self, bodies):
+        columns = None
+        for row in self._decode_batch_rows(bodies):
+            fields, values = self._split_row(row)
+            if fields is None:
+                continue
+            if columns is None:
+                columns = OrderedDict((field, []) for field in fields)
+            elif list(columns) != fields:
+                raise ValueError('Batch mixes different field layouts')
+            for column, value in zip(columns.values(), values):
+                column.append(value)
+        return OrderedDict((field, numpy.array(values))
+                           for field, values in (columns or {}).items())
+
+    def _split_row(self, row):
+        if row and row[0].startswith(SCHEMA_MARKER):
+            self.schemas.add(row[0][1:], row[1:])
+            return None, None
+        if row and row[0].startswith(DATA_MARKER):
+            schema = self.schemas.get(row[0][1:])
+            if schema is None:
+                return None, None
+            return schema.fields, row[1:]
+        half = len(row) // 2
+        return row[:half], row[half:]
+
+    def _decode_batch_rows(self, bodies):
+        if numpy is None:
+            raise ImportError('numpy is required for batch decoding')
+        if not bodies:
+            return []
+        # Bodies are joined with a NUL code so rows can be split after decoding
+        data = numpy.frombuffer(b' 0 '.join(bodies), dtype=numpy.uint8)
+        digits = (data >= 48) & (data <= 57)
+        edges = numpy.diff(numpy.concatenate(([0], digits.view(numpy.int8), [0])))
+        token_starts = numpy.flatnonzero(edges == 1)
+        token_ends = numpy.flatnonzero(edges == -1)
+        digit_index = numpy.flatnonzero(digits)
+        token_id = numpy.cumsum(edges[:-1] == 1)[digit_index] - 1
+        exponents = token_ends[token_id] - digit_index - 1
+        codes = numpy.bincount(token_id,
+                               weights=(data[digit_index] - 48) * 10.0 ** exponents,
+                               minlength=len(token_starts)).astype(numpy.int64)
+        if len(codes) and codes.max() > 255:
+            return [self._decode_scalar_row(body) for body in bodies]
+
+        text = codes.astype(numpy.uint8)
+        text = text[text != 10]
+        text = text[~((text == 13) & (numpy.append(text[1:], 0) == 0))]
+        # Quote parity restarts with every row, so a stray quote in one body
+        # does not swallow the delimiters of the bodies after it
+        quotes = numpy.cumsum(text == 34)
+        row_quotes = numpy.concatenate(([0], quotes[text == 0]))
+        quoted = ((quotes - row_quotes[numpy.cumsum(text == 0)]) & 1).astype(bool)
+        delimiters = numpy.flatnonzero(((text == 44) & ~quoted) | (text == 0))
+        starts = numpy.concatenate(([0], delimiters + 1))
+        ends = numpy.append(delimiters, len(text))
+        row_ids = numpy.concatenate(([0], numpy.cumsum(text[delimiters] == 0)))
+        has_quotes = (text[numpy.minimum(starts, len(text) - 1)] == 34) & (ends - starts >= 2)
+        starts = starts + has_quotes
+        ends = ends - has_quotes
+
+        buf = text.tobytes()
+        rows = [[] for _ in range(len(bodies))]
+        for row_id, start, end in zip(row_ids.tolist(), starts.tolist(), ends.tolist()):
+            field = buf[start:end]
+            if b'""' in field:
+                field = field.replace(b'""', b'"')
+            rows[row_id].append(field)
+        return rows
+
+    def _decode_scalar_row(self, body):
+        # Leaves message alone, batch decoding must not change the parser state
+        text = get_codec('ascii').decode(body).replace('\n', '')
+        return next(csv.reader(io.StringIO(text.decode('utf-8')), delimiter=','), [])
+
     def parse_csv_to_string(self):
         stream_input = io.BytesIO()
         writer = csv.writer(stream_input)
@@ -67,23 +249,14 @@ class SerialData(object):
         return self
 
     def parse_string_to_ascii(self):
-        asciiChars = [];
-        for ch in self.message:
-            asciiChars.append(str(ord(ch)))
-        asciiString = ' '.join(asciiChars)
-        LOGGER.debug('ASCII printing: %s', asciiString)
-        self.message = asciiString
+        return self.parse_string_to_wire(get_codec('ascii'))
+
+    def parse_string_to_wire(self, codec):
+        self.message = codec.encode(self.message)
+        LOGGER.debug('%s printing: %r', codec.name, self.message)
         return self
 
     def _parse_array_to_string(self, array):
         json_array = ''
         json_array += "[" + ",".join(element for element in array) + "]"
         return json_array
-
-    def _build_json_object(self, params):
-        obj = JsonObject()
-        attributes = params[:8]
-        values = params[8:]
-        for i in range(len(attributes)):
-            setattr(obj, attributes[i], values[i])
-        return obj
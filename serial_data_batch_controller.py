@@ -0,0 +1,85 @@
+import time
+import logging
+
+from collections import deque, OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+class SerialDataBatchController(object):
+
+    # Picks batch size and linger of the consumer from the RabbitMQ queue
+    # depth and the PUBACK latency since the last update. A backlog doubles
+    # both, up to the max, so fewer and larger publishes drain it. An empty
+    # queue with PUBACKs within the target latency shrinks both by a
+    # quarter, down to the min, so messages wait less for a batch to fill.
+    # Anything in between keeps the current values.
+
+    GROW_FACTOR = 2.0
+    SHRINK_FACTOR = 0.75
+    LOW_BACKLOG_FRACTION = 0.1
+    MAX_DECISIONS = 1000
+
+    def __init__(self, batch_bytes, linger, min_bytes=1024, max_bytes=131072,
+                 min_linger=0.05, max_linger=2.0, target_latency=0.5, backlog=1000,
+                 metrics=None):
+        self.min_bytes = int(min_bytes)
+        self.max_bytes = int(max_bytes)
+        self.min_linger = float(min_linger)
+        self.max_linger = float(max_linger)
+        self.target_latency = float(target_latency)
+        self.backlog = int(backlog)
+        if self.min_bytes > self.max_bytes or self.min_linger > self.max_linger:
+            raise ValueError('Batch control min must not be above max')
+        self.batch_bytes = min(max(int(batch_bytes), self.min_bytes), self.max_bytes)
+        self.linger = min(max(float(linger), self.min_linger), self.max_linger)
+        # Most recent decisions, oldest first
+        self.decisions = deque(maxlen=self.MAX_DECISIONS)
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add_gauge('batch_bytes', lambda: self.batch_bytes)
+            metrics.add_gauge('batch_linger', lambda: self.linger)
+
+    def observe_puback(self, seconds):
+        self._latency_sum += seconds
+        self._latency_count += 1
+
+    def update(self, queue_depth):
+        # Returns True when batch_bytes or linger changed
+        latency = None
+        if self._latency_count:
+            latency = self._latency_sum / self._latency_count
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+        if queue_depth > self.backlog:
+            action = 'grow'
+            batch_bytes = min(int(self.batch_bytes * self.GROW_FACTOR), self.max_bytes)
+            linger = min(self.linger * self.GROW_FACTOR, self.max_linger)
+        elif (queue_depth <= self.backlog * self.LOW_BACKLOG_FRACTION and
+              (latency is None or latency <= self.target_latency)):
+            action = 'shrink'
+            batch_bytes = max(int(self.batch_bytes * self.SHRINK_FACTOR), self.min_bytes)
+            linger = max(self.linger * self.SHRINK_FACTOR, self.min_linger)
+        else:
+            action = 'hold'
+            batch_bytes, linger = self.batch_bytes, self.linger
+        changed = (batch_bytes, linger) != (self.batch_bytes, self.linger)
+        if not changed:
+            action = 'hold'
+        self.batch_bytes, self.linger = batch_bytes, linger
+
+        self.decisions.append(OrderedDict([('time', time.time()),
+                                           ('queue_depth', queue_depth),
+                                           ('puback_latency', latency),
+                                           ('action', action),
+                                           ('batch_bytes', batch_bytes),
+                                           ('linger', linger)]))
+        if self._metrics is not None:
+            self._metrics.inc('batch_control_%s' % action)
+        if changed:
+            LOGGER.info('Batch control: %s to %i bytes and %0.2f s linger (queue depth %i, PUBACK latency %s)',
+                        action, batch_bytes, linger, queue_depth,
+                        'n/a' if latency is None else '%0.3f s' % latency)
+        return changed
@@ -0,0 +1,49 @@
+import struct
+import logging
+
+from serial_frame_scanner import SerialFrameScanner, LengthPrefixedFrameScanner
+
+LOGGER = logging.getLogger(__name__)
+
+class AsciiDecimalCodec(object):
+
+    name = 'ascii'
+
+    def encode(self, message):
+        return ' '.join(str(ord(ch)) for ch in message)
+
+    def decode(self, body):
+        return ''.join(unichr(int(ascii)) for ascii in body.split(' ') if ascii)
+
+    def new_scanner(self):
+        return SerialFrameScanner()
+
+class LengthPrefixedCodec(object):
+
+    name = 'binary'
+
+    def encode(self, message):
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        return (LengthPrefixedFrameScanner.MAGIC +
+                struct.pack('>H', len(message)) + message)
+
+    def decode(self, body):
+        # Frame header is stripped by the scanner, body is the raw line
+        return body
+
+    def new_scanner(self):
+        return LengthPrefixedFrameScanner()
+
+CODECS = {
+    AsciiDecimalCodec.name: AsciiDecimalCodec(),
+    LengthPrefixedCodec.name: LengthPrefixedCodec()
+}
+
+DEFAULT_CODEC = AsciiDecimalCodec.name
+
+def get_codec(name=None):
+    try:
+        return CODECS[name or DEFAULT_CODEC]
+    except KeyError:
+        raise ValueError('Unknown serial data codec: %s' % name)
@@ -0,0 +1,186 @@
+import json
+import logging
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from serial_data_schema import DEFAULT_FIELD_TYPES
+
+LOGGER = logging.getLogger(__name__)
+
+# Columnar layout of a batch, a JSON object instead of an array of rows:
+#
+#   layout     "columns"
+#   count      number of rows
+#   fields     field names in row order
+#   constants  field -> value of fields that are equal in every row
+#   columns    field -> array of values of the other fields
+#   deltas     field -> first value followed by differences to the previous
+#              row, for delta encoded integer and timestamp fields
+#   datetimes  delta encoded fields that are "YYYY-MM-DD HH:MM:SS[.ffffff]"
+#              strings in the rows, deltas are then in microseconds
+#
+# decode_columns gives back byte for byte the batch of SerialData.get_batch.
+LAYOUT_KEY = '{"layout":"columns"'
+TIMESTAMP_FIELDS = tuple(sorted(field for field, field_type in DEFAULT_FIELD_TYPES.items()
+                                if field_type == 'timestamp'))
+EPOCH = datetime(1970, 1, 1)
+# Raw batches sent columnar may grow past the MQTT payload limit
+RAW_BATCH_LIMIT = 1048576
+
+def topic_matches(topic_filter, topic):
+    # MQTT topic filter with + for one level and # for the rest
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or level not in ('+', topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+def get_layout(topic, columnar_topics):
+    # Layout of batches published to topic, columnar_topics is a comma separated list of filters
+    for topic_filter in columnar_topics.split(','):
+        if topic_filter.strip() and topic_matches(topic_filter.strip(), topic):
+            return 'columns'
+    return 'rows'
+
+def _encode_value(value):
+    return json.dumps(value, separators=(',', ':'))
+
+def _to_microseconds(value):
+    # None unless formatting the result back gives exactly value
+    try:
+        moment = datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+    delta = moment - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    if _from_microseconds(microseconds) != value:
+        return None
+    return microseconds
+
+def _from_microseconds(microseconds):
+    return unicode(EPOCH + timedelta(microseconds=microseconds))
+
+def _is_integer(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def _deltas(values):
+    return [values[0]] + [value - previous for previous, value in zip(values, values[1:])]
+
+def encode_columns(messages, delta_fields=TIMESTAMP_FIELDS):
+    # messages are the JSON objects of a batch, None if they have different fields
+    rows = [json.loads(message, object_pairs_hook=OrderedDict) for message in messages]
+    if not rows:
+        return None
+    fields = list(rows[0])
+    if any(list(row) != fields for row in rows[1:]):
+        return None
+    constants = OrderedDict()
+    columns = OrderedDict()
+    deltas = OrderedDict()
+    datetimes = []
+    for field in fields:
+        values = [row[field] for row in rows]
+        # 1 == 1.0 == True in Python, compare the JSON instead
+        first = _encode_value(values[0])
+        if all(_encode_value(value) == first for value in values[1:]):
+            constants[field] = values[0]
+            continue
+        if field in delta_fields:
+            if all(_is_integer(value) for value in values):
+                deltas[field] = _deltas(values)
+                continue
+            microseconds = [_to_microseconds(value) for value in values]
+            if None not in microseconds:
+                deltas[field] = _deltas(microseconds)
+                datetimes.append(field)
+                continue
+        columns[field] = values
+    layout = OrderedDict([('layout', 'columns'),
+                          ('count', len(rows)),
+                          ('fields', fields),
+                          ('constants', constants),
+                          ('columns', columns)])
+    if deltas:
+        layout['deltas'] = deltas
+    if datetimes:
+        layout['datetimes'] = datetimes
+    return _encode_value(layout)
+
+def is_columnar(payload):
+    return payload.startswith(LAYOUT_KEY)
+
+def decode_columns(payload):
+    # Row batch of a columnar payload, other payloads are returned as is
+    if not is_columnar(payload):
+        return payload
+    layout = json.loads(payload, object_pairs_hook=OrderedDict)
+    count = layout['count']
+    values = []
+    for field in layout['fields']:
+        key = _encode_value(field) + ':'
+        if field in layout['constants']:
+            values.append([key + _encode_value(layout['constants'][field])] * count)
+            continue
+        if field in layout['columns']:
+            column = layout['columns'][field]
+        else:
+            column = []
+            total = 0
+            for delta in layout['deltas'][field]:
+                total += delta
+                column.append(total)
+            if field in layout.get('datetimes', ()):
+                column = [_from_microseconds(value) for value in column]
+        if len(column) != count:
+            raise ValueError('Column %s has %i values, expected %i' % (field, len(column), count))
+        values.append([key + _encode_value(value) for value in column])
+    return '[' + ','.join('{' + ','.join(row) + '}' for row in zip(*values)) + ']'
+
+class SerialDataColumnar(object):
+
+    # Encodes batches in the columnar layout. max_size limits the columnar
+    # payload and the raw batch size to aim for is derived from the ratio
+    # seen so far, like the compressor does.
+
+    RATIO_WEIGHT = 0.2
+    RAW_SIZE_MARGIN = 0.9
+
+    def __init__(self, delta_fields=TIMESTAMP_FIELDS, max_size=0, metrics=None):
+        self.delta_fields = tuple(delta_fields)
+        self.max_size = int(max_size)
+        self.ratio = 1.0
+        self._metrics = metrics
+
+    def encode(self, messages):
+        rows = '[' + ','.join(messages) + ']'
+        payload = encode_columns(messages, self.delta_fields)
+        if payload is None:
+            # Rows of different schemas, send them as they are
+            if self._metrics is not None:
+                self._metrics.inc('columnar_fallbacks')
+            return rows
+        self.ratio += self.RATIO_WEIGHT * (float(len(payload)) / len(rows) - self.ratio)
+        if self._metrics is not None:
+            self._metrics.inc('columnar_batches')
+            self._metrics.inc('columnar_row_bytes', len(rows))
+            self._metrics.inc('columnar_sent_bytes', len(payload))
+        return payload
+
+    def encode_batch(self, messages):
+        # Returns (payload, message count) pairs. A batch above max_size is
+        # split in halves, a single message is sent anyway.
+        payload = self.encode(messages)
+        if not self.max_size or len(payload) <= self.max_size or len(messages) == 1:
+            return [(payload, len(messages))]
+        if self._metrics is not None:
+            self._metrics.inc('columnar_batch_splits')
+        half = len(messages) // 2
+        return self.encode_batch(messages[:half]) + self.encode_batch(messages[half:])
+
+    def get_raw_size(self, size):
+        # Raw batch size that should encode to about size
+        return int(size / self.ratio * self.RAW_SIZE_MARGIN)
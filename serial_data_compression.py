@@ -0,0 +1,158 @@
+import re
+import time
+import zlib
+import struct
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# Envelope of a compressed payload, all fields big-endian:
+#
+#   2 bytes  magic 'SZ'
+#   1 byte   method, 1 = zlib stream, 2 = raw deflate with a preset dictionary
+#   1 byte   dictionary id, 0 without a dictionary
+#   4 bytes  size of the uncompressed payload
+#   ...      compressed data
+#
+# Payloads below the threshold are sent as plain JSON, which never starts
+# with 'S'. Method 2 decodes with any inflate that takes a dictionary, for
+# example zlib.decompressobj(wbits=-15, zdict=dictionary) in Python 3.
+ENVELOPE = struct.Struct('>2sBBI')
+MAGIC = b'SZ'
+
+METHOD_ZLIB = 1
+METHOD_ZLIB_DICT = 2
+METHODS = {'zlib': METHOD_ZLIB, 'zlib-dict': METHOD_ZLIB_DICT}
+
+# Dictionaries are part of the wire format, never change a published one.
+# Content that occurs most often goes last, it is the cheapest to refer to.
+DICTIONARIES = {
+    1: ('"Total runtime","FW ver","Dev ID","Type","inputs","state","Sensor1","Sensor2"\r\n'
+        '{"Total runtime":15,"FW ver":"V001","Dev ID":0,"Type":"Sensor","inputs":8,'
+        '"state":"Active","Sensor1":,"Sensor2":},'
+        '{"Total runtime":"20-0 :","FW ver":"V001","Dev ID":"0","Type":"Sensor","inputs":"8",'
+        '"state":"Active","Sensor1":"","Sensor2":""},'),
+}
+DEFAULT_DICTIONARY_ID = 1
+
+# "key":value pairs of flat JSON objects
+TOKEN_PATTERN = re.compile(r'"[^"]*":(?:"[^"]*"|[^,}\]]*)[,}]*')
+
+def train_dictionary(samples, max_size=4096):
+    # Builds a dictionary of the most frequent key:value pairs in samples
+    counts = {}
+    for sample in samples:
+        for token in TOKEN_PATTERN.findall(sample):
+            counts[token] = counts.get(token, 0) + 1
+    dictionary = ''
+    for token in sorted(counts, key=lambda token: (-counts[token], token)):
+        if len(dictionary) + len(token) > max_size:
+            break
+        dictionary = token + dictionary
+    return dictionary
+
+def _prime(dictionary, level=9):
+    # Python 2 zlib has no zdict, a raw deflate stream that has already
+    # compressed the dictionary and flushed to a byte boundary has the same
+    # window. Its output so far is not part of the payload.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    prefix = compressor.compress(dictionary) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressor, prefix
+
+def decode_payload(payload):
+    # Reference decoder of the envelope, plain payloads are returned as is
+    if not payload.startswith(MAGIC):
+        return payload
+    _, method, dictionary_id, raw_size = ENVELOPE.unpack_from(payload)
+    data = payload[ENVELOPE.size:]
+    if method == METHOD_ZLIB:
+        raw = zlib.decompress(data)
+    elif method == METHOD_ZLIB_DICT:
+        if dictionary_id not in DICTIONARIES:
+            raise ValueError('Unknown compression dictionary %i' % dictionary_id)
+        _, prefix = _prime(DICTIONARIES[dictionary_id])
+        decompressor = zlib.decompressobj(-15)
+        decompressor.decompress(prefix)
+        raw = decompressor.decompress(data) + decompressor.flush()
+    else:
+        raise ValueError('Unknown compression method %i' % method)
+    if len(raw) != raw_size:
+        raise ValueError('Payload decompressed to %i bytes, envelope says %i' % (len(raw), raw_size))
+    return raw
+
+class SerialDataCompressor(object):
+
+    # Compresses batch payloads for the IoT uplink. With max_size the size
+    # limit applies to the compressed payload and the raw batch size to aim
+    # for is derived from the compression ratio seen so far.
+
+    RATIO_WEIGHT = 0.2
+    RAW_SIZE_MARGIN = 0.9
+
+    def __init__(self, method='zlib', level=6, threshold=256, max_size=0, metrics=None,
+                 dictionary_id=DEFAULT_DICTIONARY_ID):
+        if method not in METHODS:
+            raise ValueError('Unknown compression method %s, expected one of %s' %
+                             (method, ', '.join(sorted(METHODS))))
+        self.method = METHODS[method]
+        self.level = int(level)
+        self.threshold = int(threshold)
+        self.max_size = int(max_size)
+        self.ratio = 1.0
+        self._metrics = metrics
+        self._dictionary_id = 0
+        self._primer = None
+        if self.method == METHOD_ZLIB_DICT:
+            self._dictionary_id = dictionary_id
+            self._primer, _ = _prime(DICTIONARIES[dictionary_id], self.level)
+
+    def compress(self, payload):
+        if len(payload) < self.threshold:
+            self._record(payload, payload, 0.0)
+            return payload
+        started = time.clock()
+        if self._primer is None:
+            data = zlib.compress(payload, self.level)
+        else:
+            compressor = self._primer.copy()
+            data = compressor.compress(payload) + compressor.flush()
+        cpu_seconds = time.clock() - started
+        if len(data) + ENVELOPE.size >= len(payload):
+            self._record(payload, payload, cpu_seconds)
+            return payload
+        envelope = ENVELOPE.pack(MAGIC, self.method, self._dictionary_id, len(payload)) + data
+        self.ratio += self.RATIO_WEIGHT * (float(len(envelope)) / len(payload) - self.ratio)
+        self._record(payload, envelope, cpu_seconds)
+        return envelope
+
+    def compress_batch(self, messages, layout=None):
+        # Returns (payload, message count) pairs. A batch that compresses
+        # above max_size is split in halves, a single message is sent anyway.
+        # layout turns the messages into the payload, a JSON array by default.
+        if layout is None:
+            payload = self.compress('[' + ','.join(messages) + ']')
+        else:
+            payload = self.compress(layout(messages))
+        if not self.max_size or len(payload) <= self.max_size or len(messages) == 1:
+            return [(payload, len(messages))]
+        if self._metrics is not None:
+            self._metrics.inc('compressed_batch_splits')
+        half = len(messages) // 2
+        return (self.compress_batch(messages[:half], layout) +
+                self.compress_batch(messages[half:], layout))
+
+    def get_raw_size(self, raw_size):
+        # Raw batch size that should compress to about max_size
+        if not self.max_size:
+            return raw_size
+        return int(self.max_size / self.ratio * self.RAW_SIZE_MARGIN)
+
+    def _record(self, payload, sent, cpu_seconds):
+        if self._metrics is None:
+            return
+        compressed = sent is not payload
+        self._metrics.inc('payloads_compressed' if compressed else 'payloads_raw')
+        self._metrics.inc('payload_raw_bytes', len(payload))
+        self._metrics.inc('payload_sent_bytes', len(sent))
+        if compressed:
+            self._metrics.observe('compress_cpu_seconds', cpu_seconds)
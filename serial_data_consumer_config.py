@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+from serial_data_columnar import get_layout
+from serial_data_window import get_fields
+
+class SerialDataConsumerConfig(object):
+
+    # Run parameters of SerialDataConsumer besides its connections. Values
+    # may be the strings parsed from the command line, numbers are converted
+    # to the type of their default.
+
+    OPTIONS = OrderedDict([
+        # Batching
+        ('batch_messages', 0),
+        ('batch_count', 0),
+        ('batch_linger', 1.0),
+        ('batch_layout', 'rows'),
+        # Adaptive batching
+        ('adaptive', False),
+        ('batch_min', 1024),
+        ('batch_max', 131072),
+        ('linger_min', 0.05),
+        ('linger_max', 2.0),
+        ('target_latency', 0.5),
+        ('adaptive_backlog', 1000),
+        # Compression
+        ('compress', 'none'),
+        ('compress_level', 6),
+        ('compress_threshold', 256),
+        ('compressed_limit', False),
+        # Consuming
+        ('prefetch_count', 1000),
+        ('workers', 0),
+        ('log_sample', 100),
+        # Spool replay
+        ('replay_rate', 50.0),
+        ('max_replay_rate', 500.0),
+        # Windows
+        ('window', 0.0),
+        ('window_slide', 0.0),
+        ('window_rate', 0.0),
+        ('window_fields', ()),
+        ('window_passthrough', ()),
+    ])
+
+    def __init__(self, **options):
+        unknown = sorted(set(options) - set(self.OPTIONS))
+        if unknown:
+            raise TypeError('Unknown consumer options: %s' % ', '.join(unknown))
+        for name, default in self.OPTIONS.items():
+            value = options.get(name, default)
+            if isinstance(default, bool):
+                value = bool(value)
+            elif isinstance(default, (int, float)):
+                value = type(default)(value)
+            elif isinstance(default, tuple):
+                value = tuple(value)
+            setattr(self, name, value)
+
+    @classmethod
+    def from_args(cls, args):
+        # Options of the consumer's command line
+        return cls(batch_messages=args.batch_messages,
+                   batch_count=args.batch_count,
+                   batch_linger=args.batch_linger,
+                   batch_layout=get_layout(args.topic, args.columnar_topics),
+                   adaptive=args.adaptive,
+                   batch_min=args.batch_min,
+                   batch_max=args.batch_max,
+                   linger_min=args.linger_min,
+                   linger_max=args.linger_max,
+                   target_latency=args.target_latency,
+                   adaptive_backlog=args.adaptive_backlog,
+                   compress=args.compress,
+                   compress_level=args.compress_level,
+                   compress_threshold=args.compress_threshold,
+                   compressed_limit=args.compressed_limit,
+                   prefetch_count=args.prefetch,
+                   workers=args.workers,
+                   log_sample=args.log_sample,
+                   replay_rate=args.replay_rate,
+                   max_replay_rate=args.max_replay_rate,
+                   window=args.window,
+                   window_slide=args.window_slide,
+                   window_rate=args.window_rate,
+                   window_fields=get_fields(args.window_fields),
+                   window_passthrough=get_fields(args.window_passthrough))
+
+    def check_prefetch(self):
+        # Messages of a window are acked once its record is uploaded, and
+        # RabbitMQ stops delivering while prefetch_count of them wait
+        window_messages = self.window * self.window_rate
+        if self.prefetch_count and window_messages > self.prefetch_count:
+            raise ValueError('Prefetch of %i messages is less than the %i messages of a %s second '
+                             'window at %s messages per second' %
+                             (self.prefetch_count, window_messages, self.window, self.window_rate))
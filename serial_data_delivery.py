@@ -0,0 +1,105 @@
+import time
+import logging
+
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+class DeliveryAckWindow(object):
+
+    # Tracks AMQP delivery tags waiting for an upstream confirmation. A
+    # multiple=True ack covers every earlier tag on the channel, so tags are
+    # released only when everything before them has been confirmed too. A
+    # key added with tag None holds back later tags but releases none.
+
+    def __init__(self):
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, delivery_tag):
+        self._pending[key] = [delivery_tag, False]
+
+    def confirm(self, key):
+        entry = self._pending.get(key)
+        if entry is None:
+            LOGGER.debug('Ignoring confirmation for unknown key %s', key)
+            return None
+        entry[1] = True
+        ack_tag = None
+        while self._pending:
+            first_key = next(iter(self._pending))
+            delivery_tag, confirmed = self._pending[first_key]
+            if not confirmed:
+                break
+            del self._pending[first_key]
+            if delivery_tag is not None:
+                ack_tag = delivery_tag
+        return ack_tag
+
+    def clear(self):
+        self._pending.clear()
+
+class PublishConfirmTracker(object):
+
+    # Publisher side of RabbitMQ confirms. Delivery tags are assigned in
+    # publish order, so the map stays sorted and a multiple=True confirm
+    # pops from the front.
+
+    def __init__(self, max_in_flight=1000, max_retries=3, metrics=None):
+        self.max_in_flight = int(max_in_flight)
+        self.max_retries = int(max_retries)
+        self.acked = 0
+        self.nacked = 0
+        self.failed = 0
+        self._in_flight = OrderedDict()
+        self._delivery_tag = 0
+        self._metrics = metrics
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def is_full(self):
+        return len(self._in_flight) >= self.max_in_flight
+
+    def add(self, message, retries=0):
+        self._delivery_tag += 1
+        self._in_flight[self._delivery_tag] = (message, retries, time.time())
+        return self._delivery_tag
+
+    def confirm(self, delivery_tag, multiple=False, ack=True):
+        # Returns (message, retries) pairs of nacked messages to publish again
+        if multiple:
+            confirmed = []
+            while self._in_flight and next(iter(self._in_flight)) <= delivery_tag:
+                confirmed.append(self._in_flight.popitem(last=False)[1])
+        else:
+            entry = self._in_flight.pop(delivery_tag, None)
+            confirmed = [entry] if entry is not None else []
+        if self._metrics is not None:
+            now = time.time()
+            for _, _, published in confirmed:
+                self._metrics.observe('confirm_seconds', now - published)
+            self._metrics.inc('messages_acked' if ack else 'messages_nacked', len(confirmed))
+        if ack:
+            self.acked += len(confirmed)
+            return []
+        self.nacked += len(confirmed)
+        republish = []
+        for message, retries, _ in confirmed:
+            if retries < self.max_retries:
+                republish.append((message, retries + 1))
+            else:
+                self.failed += 1
+                if self._metrics is not None:
+                    self._metrics.inc('messages_failed')
+                LOGGER.error('Dropping message after %i nacks', retries + 1)
+        return republish
+
+    def reset(self):
+        # Channel is gone, unconfirmed messages have to be published again
+        unconfirmed = [(message, retries) for message, retries, _ in self._in_flight.values()]
+        self._in_flight.clear()
+        self._delivery_tag = 0
+        return unconfirmed
@@ -0,0 +1,89 @@
+import struct
+
+# AMQP message body with several frames of one serial port, all fields
+# big-endian:
+#
+#   2 bytes  magic 'SE'
+#   1 byte   version
+#   2 bytes  number of frames
+#
+# followed by each frame, line end included, as
+#
+#   4 bytes  size of the frame
+#   ...      frame as scanned
+HEADER = struct.Struct('>2sBH')
+FRAME_SIZE = struct.Struct('>I')
+MAGIC = b'SE'
+VERSION = 1
+MAX_FRAMES = 65535
+# Message header with the number of frames, set on envelopes only
+FRAMES_HEADER = 'frames'
+
+def pack_envelope(frames):
+    if not 0 < len(frames) <= MAX_FRAMES:
+        raise ValueError('Envelope takes 1 to %i frames, not %i' % (MAX_FRAMES, len(frames)))
+    parts = [HEADER.pack(MAGIC, VERSION, len(frames))]
+    for frame in frames:
+        parts.append(FRAME_SIZE.pack(len(frame)))
+        parts.append(frame)
+    return b''.join(parts)
+
+def unpack_envelope(body):
+    if len(body) < HEADER.size:
+        raise ValueError('Envelope is too short for a header')
+    magic, version, count = HEADER.unpack_from(body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a version %i envelope' % VERSION)
+    frames = []
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + FRAME_SIZE.size > len(body):
+            raise ValueError('Envelope ends after %i of %i frames' % (len(frames), count))
+        size, = FRAME_SIZE.unpack_from(body, offset)
+        offset += FRAME_SIZE.size
+        if offset + size > len(body):
+            raise ValueError('Envelope ends within frame %i' % len(frames))
+        frames.append(body[offset:offset + size])
+        offset += size
+    if offset != len(body):
+        raise ValueError('Envelope has %i bytes after its last frame' % (len(body) - offset))
+    return frames
+
+class SerialDataEnvelope(object):
+
+    # Frames of one serial port waiting to go out as one message. Full at
+    # max_frames frames or once the packed envelope reaches max_bytes.
+
+    def __init__(self, max_frames, max_bytes=65536):
+        self.max_frames = min(int(max_frames), MAX_FRAMES)
+        self.max_bytes = int(max_bytes)
+        self.clear()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def clear(self):
+        self.frames = []
+        self.size = HEADER.size
+        # Trace id and read time of the first frame
+        self.trace_id = None
+        self.frame_time = None
+
+    def add(self, frame, trace_id, frame_time):
+        # Returns True when the envelope is full
+        if not self.frames:
+            self.trace_id = trace_id
+            self.frame_time = frame_time
+        self.frames.append(frame)
+        self.size += FRAME_SIZE.size + len(frame)
+        return self.is_full()
+
+    def is_full(self):
+        return len(self.frames) >= self.max_frames or self.size >= self.max_bytes
+
+    def pack(self):
+        # Returns (body, number of frames, first trace id, first read time)
+        # and starts an empty envelope
+        packed = (pack_envelope(self.frames), len(self.frames), self.trace_id, self.frame_time)
+        self.clear()
+        return packed
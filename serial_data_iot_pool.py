@@ -0,0 +1,284 @@
+import time
+import struct
+import hashlib
+import logging
+import functools
+import threading
+
+from serial_data_reconnect import ReconnectBackoff
+
+LOGGER = logging.getLogger(__name__)
+
+QUEUED_MID = 'QUEUED' # AWSIoTPythonSDK mid for publishes queued while offline
+
+def get_client_ids(client_id, size):
+    if int(size) == 1:
+        return [client_id]
+    return ['%s-%i' % (client_id, index) for index in range(int(size))]
+
+class IoTConnection(object):
+
+    # One MQTT connection of the pool. Going offline takes it out of routing
+    # until the client is back online. A failed publish takes it out for a
+    # backoff that doubles with every failure in a row. A connect that fails
+    # is tried again after a jittered backoff over the same range.
+
+    BACKOFF_MIN = 1.0
+    BACKOFF_MAX = 32.0
+
+    def __init__(self, client, client_id):
+        self.client = client
+        self.client_id = client_id
+        self.online = True
+        self.connect_backoff = ReconnectBackoff(self.BACKOFF_MIN, self.BACKOFF_MAX)
+        self.reconnect = None
+        self.failures = 0
+        self.retry_at = 0
+        self.publishes = 0
+        self.pubacks = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def is_healthy(self, now):
+        return self.online and now >= self.retry_at
+
+    def get_weight(self, key):
+        # Rendezvous hashing, the key goes to the connection of max weight
+        digest = hashlib.md5('%s\n%s' % (self.client_id, key)).digest()
+        return struct.unpack('>Q', digest[:8])[0]
+
+    def on_publish(self, size):
+        self.publishes += 1
+        self.bytes += size
+        self.failures = 0
+
+    def on_publish_error(self, now):
+        self.errors += 1
+        self.failures += 1
+        backoff = min(self.BACKOFF_MIN * 2 ** (self.failures - 1), self.BACKOFF_MAX)
+        self.retry_at = now + backoff
+        return backoff
+
+class SerialDataIoTPool(object):
+
+    # Spreads IoT publishes over several MQTT connections. A payload is
+    # routed by its key, the device id, to one of the healthy connections.
+    # A key stays on its connection, which keeps the order of the device's
+    # messages, and only the keys of a connection that drops move to the
+    # others until it is healthy again. Packet ids are (connection index,
+    # packet id of the client), so they are unique in the pool.
+    #
+    # onOnline and onOffline are called like those of AWSIoTMQTTClient, when
+    # the first connection comes online and when the last one goes offline.
+
+    def __init__(self, clients, client_ids, metrics=None):
+        self.connections = [IoTConnection(client, client_id)
+                            for client, client_id in zip(clients, client_ids)]
+        self.onOnline = None
+        self.onOffline = None
+        self._online = True
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._healthy = []
+        self._routes_expire = 0
+        self._started = time.time()
+        self._metrics = None
+        self._connect_args = None
+        self._closing = False
+        for index, connection in enumerate(self.connections):
+            # Set before connect, the client hands them to its MQTT core then
+            connection.client.onOnline = functools.partial(self.on_connection_online, index)
+            connection.client.onOffline = functools.partial(self.on_connection_offline, index)
+        if metrics is not None:
+            self.set_metrics(metrics)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def set_metrics(self, metrics):
+        self._metrics = metrics
+        for counter in ('publishes', 'pubacks', 'errors', 'bytes'):
+            metrics.add_gauge('iot_connection_' + counter, lambda counter=counter: dict(
+                (connection.client_id, getattr(connection, counter))
+                for connection in self.connections), label='connection')
+        metrics.add_gauge('iot_connection_online', lambda: dict(
+            (connection.client_id, int(connection.online))
+            for connection in self.connections), label='connection')
+        metrics.add_gauge('iot_connection_keys', self.get_key_counts, label='connection')
+
+    def connectAsync(self, keepAliveIntervalSecond=600, ackCallback=None):
+        # The pool needs only one connection, the others that fail stay
+        # offline and are connected again in the background. When all fail
+        # the error is raised for the caller to retry the pool. The CONNACK
+        # of every connection goes to ackCallback.
+        self._connect_args = (keepAliveIntervalSecond, ackCallback)
+        last_error = None
+        failed = []
+        for index, connection in enumerate(self.connections):
+            try:
+                self.connect_connection(index)
+            except Exception as error:
+                LOGGER.error('IoT connection %s failed: %s', connection.client_id, error)
+                self.on_connection_offline(index)
+                failed.append(index)
+                last_error = error
+        if len(failed) == len(self.connections):
+            raise last_error
+        for index in failed:
+            self.schedule_reconnect(index)
+
+    def connect_connection(self, index):
+        keepAliveIntervalSecond, ackCallback = self._connect_args
+        callback = None
+        if ackCallback is not None:
+            callback = functools.partial(self.on_connack, index, ackCallback)
+        self.connections[index].client.connectAsync(keepAliveIntervalSecond, callback)
+
+    def schedule_reconnect(self, index):
+        connection = self.connections[index]
+        delay = connection.connect_backoff.next_delay()
+        LOGGER.info('Connecting IoT connection %s again in %0.0f ms', connection.client_id, delay * 1000)
+        connection.reconnect = threading.Timer(delay, self.reconnect, (index,))
+        connection.reconnect.daemon = True
+        connection.reconnect.start()
+
+    def reconnect(self, index):
+        # Called from the timer thread of the connection
+        connection = self.connections[index]
+        connection.reconnect = None
+        if self._closing:
+            return
+        try:
+            self.connect_connection(index)
+        except Exception as error:
+            LOGGER.error('IoT connection %s failed again: %s', connection.client_id, error)
+            if self._metrics is not None:
+                self._metrics.inc('iot_connect_errors')
+            self.schedule_reconnect(index)
+            return
+        connection.connect_backoff.on_recovered()
+
+    def cancel_reconnects(self):
+        self._closing = True
+        for connection in self.connections:
+            if connection.reconnect is not None:
+                connection.reconnect.cancel()
+                connection.reconnect = None
+
+    def on_connack(self, index, ackCallback, mid, data):
+        # Called from the MQTT client thread of the connection
+        ackCallback(mid=(index, mid), data=data)
+
+    def subscribeAsync(self, topic, QoS, ackCallback=None, messageCallback=None):
+        return self.connections[0].client.subscribeAsync(topic, QoS, ackCallback, messageCallback)
+
+    def get_connection(self, key):
+        # Index of the connection for key, among all connections when none
+        # is healthy, so the clients queue or fail as a single one would
+        now = time.time()
+        if now >= self._routes_expire:
+            self.update_routes(now)
+        index = self._routes.get(key)
+        if index is None:
+            candidates = self._healthy or range(len(self.connections))
+            index = max(candidates, key=lambda index: self.connections[index].get_weight(key))
+            self._routes[key] = index
+        return index
+
+    def update_routes(self, now):
+        healthy = [index for index, connection in enumerate(self.connections)
+                   if connection.is_healthy(now)]
+        if healthy != self._healthy:
+            LOGGER.info('Routing over IoT connections %s',
+                        ', '.join(self.connections[index].client_id for index in healthy) or 'none')
+            if self._metrics is not None:
+                self._metrics.inc('iot_pool_rebalances')
+        self._healthy = healthy
+        self._routes = {}
+        backoffs = [connection.retry_at for connection in self.connections
+                    if connection.retry_at > now]
+        self._routes_expire = min(backoffs) if backoffs else float('inf')
+
+    def get_key_counts(self):
+        counts = dict((connection.client_id, 0) for connection in self.connections)
+        for index in list(self._routes.values()):
+            counts[self.connections[index].client_id] += 1
+        return counts
+
+    def publishAsync(self, topic, payload, QoS, ackCallback=None, key=None):
+        # A publish that fails takes its connection out and moves on to the
+        # next one, the error is raised when no healthy connection is left
+        attempts = 0
+        while True:
+            index = self.get_connection(key)
+            connection = self.connections[index]
+            callback = None
+            if ackCallback is not None:
+                callback = functools.partial(self.on_puback, index, ackCallback)
+            try:
+                mid = connection.client.publishAsync(topic, payload, QoS, callback)
+            except Exception as error:
+                now = time.time()
+                backoff = connection.on_publish_error(now)
+                LOGGER.warning('IoT connection %s failed to publish, retrying it in %0.0f seconds: %s',
+                               connection.client_id, backoff, error)
+                self._routes_expire = 0
+                attempts += 1
+                if (attempts >= len(self.connections) or
+                        not any(other.is_healthy(now) for other in self.connections)):
+                    raise
+                continue
+            connection.on_publish(len(payload))
+            if mid == QUEUED_MID:
+                return mid
+            return (index, mid)
+
+    def on_puback(self, index, ackCallback, mid):
+        # Called from the MQTT client thread of the connection
+        self.connections[index].pubacks += 1
+        ackCallback((index, mid))
+
+    def on_connection_online(self, index):
+        connection = self.connections[index]
+        LOGGER.info('IoT connection %s is online', connection.client_id)
+        with self._lock:
+            connection.online = True
+            connection.failures = 0
+            connection.retry_at = 0
+            self._routes_expire = 0
+            if self._online:
+                return
+            self._online = True
+        if self.onOnline is not None:
+            self.onOnline()
+
+    def on_connection_offline(self, index):
+        connection = self.connections[index]
+        LOGGER.warning('IoT connection %s is offline', connection.client_id)
+        with self._lock:
+            connection.online = False
+            self._routes_expire = 0
+            if not self._online or any(other.online for other in self.connections):
+                return
+            self._online = False
+        if self.onOffline is not None:
+            self.onOffline()
+
+    def get_stats(self):
+        elapsed = max(time.time() - self._started, 1e-9)
+        return dict((connection.client_id, {'online': connection.online,
+                                            'publishes': connection.publishes,
+                                            'pubacks': connection.pubacks,
+                                            'errors': connection.errors,
+                                            'bytes': connection.bytes,
+                                            'publishes_per_second': connection.publishes / elapsed,
+                                            'bytes_per_second': connection.bytes / elapsed})
+                    for connection in self.connections)
+
+    def log_stats(self):
+        for client_id, stats in sorted(self.get_stats().items()):
+            LOGGER.info('IoT connection %s (%s): %i publishes, %0.1f publishes/s, %0.0f bytes/s, '
+                        '%i PUBACKs, %i errors', client_id,
+                        'online' if stats['online'] else 'offline', stats['publishes'],
+                        stats['publishes_per_second'], stats['bytes_per_second'],
+                        stats['pubacks'], stats['errors'])
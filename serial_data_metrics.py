@@ -0,0 +1,192 @@
+import json
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds in seconds, 100 us doubling up to about 100 s
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** exponent for exponent in range(21))
+RATIO_BUCKETS = tuple(step / 10.0 for step in range(1, 11))
+COUNT_BUCKETS = tuple(2 ** exponent for exponent in range(17))
+
+def to_microseconds(timestamp):
+    # AMQP headers of pika have no floats, timestamps travel as integers
+    return int(timestamp * 1000000)
+
+def from_microseconds(value):
+    return value / 1000000.0
+
+class Histogram(object):
+
+    # Fixed buckets, so memory does not grow with the number of samples.
+    # Percentiles are the upper bound of the bucket they fall in.
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+
+    def snapshot(self):
+        return OrderedDict([('count', self.count),
+                            ('sum', self.sum),
+                            ('p50', self.percentile(0.50)),
+                            ('p99', self.percentile(0.99))])
+
+class SerialDataMetrics(object):
+
+    # Counters and histograms are updated by the process that owns them,
+    # gauges are read when the metrics are requested. The lock keeps the
+    # HTTP thread from reading a half updated histogram.
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._counters = OrderedDict()
+        self._gauges = OrderedDict()
+        self._histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe_since(self, name, started):
+        self.observe(name, max(time.time() - started, 0))
+
+    def add_gauge(self, name, read, label=None):
+        # read returns a number, or a dict of label value -> number with label
+        self._gauges[name] = (read, label)
+
+    def get_counter(self, name):
+        return self._counters.get(name, 0)
+
+    def _read_gauges(self):
+        gauges = OrderedDict()
+        for name, (read, label) in self._gauges.items():
+            try:
+                gauges[name] = (read(), label)
+            except Exception as error:
+                LOGGER.warning('Failed to read gauge %s: %s', name, error)
+        return gauges
+
+    def snapshot(self):
+        gauges = self._read_gauges()
+        with self._lock:
+            return OrderedDict([
+                ('counters', OrderedDict(self._counters)),
+                ('gauges', OrderedDict((name, value) for name, (value, _) in gauges.items())),
+                ('histograms', OrderedDict((name, histogram.snapshot())
+                                           for name, histogram in self._histograms.items()))])
+
+    def render(self):
+        # Prometheus text format
+        lines = []
+        gauges = self._read_gauges()
+        with self._lock:
+            for name, value in self._counters.items():
+                lines.append('%s_%s_total %s' % (self.prefix, name, value))
+            for name, (value, label) in gauges.items():
+                if label is None:
+                    lines.append('%s_%s %s' % (self.prefix, name, value))
+                    continue
+                for label_value, number in sorted(value.items()):
+                    lines.append('%s_%s{%s="%s"} %s' % (self.prefix, name, label, label_value, number))
+            for name, histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_%s_bucket{le="%s"} %i' % (self.prefix, name, bound, cumulative))
+                lines.append('%s_%s_sum %r' % (self.prefix, name, histogram.sum))
+                lines.append('%s_%s_count %i' % (self.prefix, name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+class PayloadLogSampler(object):
+
+    # Logs every nth payload at DEBUG, payloads are not formatted otherwise
+
+    def __init__(self, logger, every=100):
+        self._logger = logger
+        self._every = max(int(every), 1)
+        self._seen = 0
+
+    def log(self, msg, *args):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        if self._seen % self._every == 0:
+            self._logger.debug(msg, *args)
+        self._seen += 1
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path == '/metrics':
+            body, content_type = metrics.render(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot(), indent=2), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug('Metrics request from %s: %s', self.client_address[0], format % args)
+
+class MetricsServer(object):
+
+    # Serves /metrics and /metrics.json on localhost from a daemon thread
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        self._server = HTTPServer((host, int(port)), MetricsRequestHandler)
+        self._server.metrics = metrics
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer')
+        self._thread.daemon = True
+
+    def start(self):
+        LOGGER.info('Serving metrics on http://%s:%i/metrics', *self._server.server_address)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def start_metrics_server(metrics, port):
+    if not int(port):
+        return None
+    return MetricsServer(metrics, port).start()
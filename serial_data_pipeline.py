@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+import time
+import Queue
+import logging
+import argparse
+import threading
+
+from serial_data import SerialData
+from serial_port_reader import SerialPortReader
+from serial_data_codec import get_codec, CODECS, DEFAULT_CODEC
+from serial_data_columnar import SerialDataColumnar, RAW_BATCH_LIMIT, get_layout
+from serial_data_schema import DEFAULT_FIELD_TYPES
+from serial_data_spool import SerialDataSpool
+from serial_data_metrics import SerialDataMetrics, RATIO_BUCKETS, start_metrics_server
+
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+LEVELS = {'debug': logging.DEBUG,
+          'info': logging.INFO,
+          'warning': logging.WARNING,
+          'error': logging.ERROR,
+          'critical': logging.CRITICAL}
+
+class SerialDataPipeline(object):
+
+    # Reader, parser and IoT publisher stages in one process, joined by
+    # bounded queues. A full queue blocks the stage before it, so a slow
+    # uplink pushes back to the serial port instead of growing memory.
+
+    RETRY_INTERVAL = 1
+
+    def __init__(self, serial_port, serial_data, iot_client, target_topic, spool,
+                 batch_messages=0, batch_count=0, batch_linger=1.0, queue_size=1000,
+                 batch_layout='rows'):
+        self._serial_port = serial_port
+        self._serial_data = serial_data
+        self._iot_client = iot_client
+        self._target_topic = target_topic
+        self._spool = spool
+        self._batch_messages = int(batch_messages)
+        self._batch_linger = float(batch_linger)
+        self._frames = Queue.Queue(int(queue_size))
+        self._payloads = Queue.Queue(int(queue_size))
+        self._online = threading.Event()
+        self._stopping = threading.Event()
+        self._reader_stopped = threading.Event()
+        self._serial_data.set_batch_max_count(batch_count)
+        if self._batch_messages > 0:
+            self._serial_data.set_message_max_size(self._batch_messages)
+        self.published = 0
+        self.spooled = 0
+        self.metrics = SerialDataMetrics('serial_data_pipeline')
+        self._columnar = None
+        if batch_layout == 'columns':
+            self._columnar = SerialDataColumnar(max_size=self._serial_data.message_max_size,
+                                                metrics=self.metrics)
+            self._serial_data.message_max_size_limit = RAW_BATCH_LIMIT
+        self.metrics.add_gauge('frames_queue', self._frames.qsize)
+        self.metrics.add_gauge('payloads_queue', self._payloads.qsize)
+        self.metrics.add_gauge('spool_bytes', lambda: self._spool.unread_bytes)
+        self.metrics.add_gauge('online', lambda: int(self._online.is_set()))
+
+    def on_online(self):
+        LOGGER.info('IoT client is online')
+        self._online.set()
+
+    def on_offline(self):
+        LOGGER.warning('IoT client is offline, spooling payloads')
+        self._online.clear()
+
+    def read_frames(self):
+        for frame in self._serial_port.frames():
+            if self._stopping.is_set():
+                break
+            # Frames queue carries (frame, frame completion time)
+            self._frames.put((frame, self._serial_port.last_read_time))
+            self.metrics.inc('frames_read')
+
+    def parse_frames(self):
+        try:
+            self.parse_queued_frames()
+        finally:
+            # Tells the publisher nothing follows once it has the rest
+            self._payloads.put(None)
+
+    def parse_queued_frames(self):
+        # Once the reader has stopped, the frames still queued are parsed and
+        # the partial batch is flushed before the stage ends
+        codec = self._serial_port.codec
+        serial_data = self._serial_data
+        linger_deadline = None
+        batch_frame_time = None
+        while True:
+            timeout = self.RETRY_INTERVAL
+            if linger_deadline is not None:
+                timeout = max(linger_deadline - time.time(), 0)
+            if self._reader_stopped.is_set():
+                timeout = 0
+            try:
+                frame, frame_time = self._frames.get(timeout=timeout)
+            except Queue.Empty:
+                self.flush_batch(batch_frame_time)
+                if self._reader_stopped.is_set():
+                    break
+                linger_deadline = batch_frame_time = None
+                continue
+            started = time.time()
+            self.metrics.observe('frame_queue_seconds', started - frame_time)
+            try:
+                serial_data.set_message(frame)
+                serial_data.parse_wire_to_string(codec).parse_string_to_json()
+            except Exception as error:
+                # One broken line must not stop the stage
+                LOGGER.warning('Dropping line that failed to parse: %s', error)
+                self.metrics.inc('parse_errors')
+                self.metrics.inc('frames_skipped')
+                continue
+            self.metrics.observe_since('parse_seconds', started)
+            if not serial_data.message:
+                if serial_data.parse_error is not None:
+                    LOGGER.warning('Dropping line that failed to parse: %s', serial_data.parse_error)
+                    self.metrics.inc('parse_errors')
+                if serial_data.unknown_schema is not None:
+                    LOGGER.warning('Dropping line with unknown schema %s', serial_data.unknown_schema)
+                self.metrics.inc('frames_skipped')
+                continue
+            if self._batch_messages <= 0:
+                self._payloads.put((serial_data.message, frame_time))
+                continue
+            if self._columnar is not None:
+                serial_data.set_message_max_size(self._columnar.get_raw_size(self._batch_messages))
+            serial_data.set_batch()
+            if serial_data.batch_overflow is not None:
+                # Overflow message opens the next batch
+                self.flush_batch(batch_frame_time)
+                batch_frame_time = frame_time
+            if batch_frame_time is None:
+                batch_frame_time = frame_time
+            if serial_data.batch_full:
+                self.flush_batch(batch_frame_time)
+                batch_frame_time = frame_time if serial_data.batch else None
+            if not serial_data.batch:
+                linger_deadline = None
+            elif linger_deadline is None:
+                linger_deadline = time.time() + self._batch_linger
+
+    def flush_batch(self, frame_time=None):
+        if self._serial_data.batch:
+            self.metrics.observe('batch_fill_ratio',
+                                 float(self._serial_data.get_batch_size()) / self._serial_data.message_max_size,
+                                 RATIO_BUCKETS)
+            if self._columnar is None:
+                self._payloads.put((self._serial_data.get_batch(), frame_time))
+            else:
+                for payload, _ in self._columnar.encode_batch(self._serial_data.batch):
+                    self._payloads.put((payload, frame_time))
+            self._serial_data.clear_batch()
+
+    def publish_payloads(self):
+        # Ends with the parser, payloads queued when stopping are spooled
+        # for the next start instead of waiting for their PUBACK
+        while True:
+            if self._online.is_set() and len(self._spool) and not self._stopping.is_set():
+                self.replay_spool()
+            try:
+                item = self._payloads.get(timeout=self.RETRY_INTERVAL)
+            except Queue.Empty:
+                continue
+            if item is None:
+                break
+            payload, frame_time = item
+            # Keep order, once spooling new payloads go behind the spooled ones
+            if self._stopping.is_set() or len(self._spool) or not self.publish(payload):
+                if not self._spool.append(payload):
+                    LOGGER.error('Spool is full, dropping payload of %i bytes', len(payload))
+                    self.metrics.inc('payloads_dropped')
+                    continue
+                self._spool.flush()
+                self.spooled += 1
+                self.metrics.inc('payloads_spooled')
+            elif frame_time is not None:
+                self.metrics.observe_since('frame_to_puback_seconds', frame_time)
+
+    def replay_spool(self):
+        LOGGER.info('Replaying %i spooled bytes', self._spool.unread_bytes)
+        while len(self._spool) and not self._stopping.is_set():
+            payload, position = self._spool.read()
+            if not self.publish(payload):
+                self._spool.rewind()
+                break
+            self._spool.commit(position)
+
+    def publish(self, payload):
+        if not self._online.is_set():
+            return False
+        started = time.time()
+        try:
+            # Blocks until PUBACK, so a payload is never lost in memory
+            self._iot_client.publish(self._target_topic, payload, 1)
+        except Exception as error:
+            LOGGER.warning('IoT publish failed: %s', error)
+            self.metrics.inc('iot_publish_errors')
+            return False
+        self.metrics.observe_since('iot_puback_seconds', started)
+        self.metrics.inc('payloads_published')
+        self.published += 1
+        return True
+
+    def run_stage(self, stage):
+        try:
+            stage()
+        except Exception:
+            LOGGER.exception('Pipeline stage %s failed', stage.__name__)
+
+    def run(self):
+        # Stops the pipeline and raises when a stage ends on its own, the
+        # stages before it would block on a full queue forever
+        stages = [threading.Thread(target=self.run_stage, args=(stage,), name=stage.__name__)
+                  for stage in (self.read_frames, self.parse_frames, self.publish_payloads)]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+        stopped = []
+        try:
+            while not self._stopping.is_set():
+                time.sleep(self.RETRY_INTERVAL)
+                LOGGER.debug('Queued frames: %i, queued payloads: %i, published: %i, spooled: %i',
+                             self._frames.qsize(), self._payloads.qsize(),
+                             self.published, self.spooled)
+                stopped = [stage.name for stage in stages if not stage.is_alive()]
+                if stopped and not self._stopping.is_set():
+                    LOGGER.error('Pipeline stage %s stopped, stopping the pipeline', ', '.join(stopped))
+                    self.stop()
+                else:
+                    stopped = []
+        finally:
+            self._stopping.set()
+            self.join_stages(stages)
+        if stopped:
+            raise RuntimeError('Pipeline stage %s stopped' % ', '.join(stopped))
+
+    def join_stages(self, stages):
+        # The reader sees the stop with its next frame unless it is blocked
+        # on the serial port, its frames are not queued after that. Parser
+        # and publisher drain the queues behind it, the spool is closed only
+        # when the publisher is done with it
+        reader, parser, publisher = stages
+        reader.join(self.RETRY_INTERVAL * 2)
+        self._reader_stopped.set()
+        parser.join()
+        publisher.join()
+        self._spool.close()
+        LOGGER.info('Stopped, published: %i, spooled: %i', self.published, self.spooled)
+
+    def stop(self):
+        # Returns at once, run drains the queues and closes the spool
+        LOGGER.info('Stopping')
+        self._stopping.set()
+
+def main():
+
+    from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-l", "--logging", action="store", dest="logging_level", help="Set logging level for pipeline", default="info")
+    parser.add_argument("-s", "--serial_port", action="store", dest="serial_port", help="Set serial port to read data", default="/dev/pts/4")
+    parser.add_argument("--codec", action="store", dest="codec", choices=sorted(CODECS), help="Set wire encoding of serial lines", default=DEFAULT_CODEC)
+    parser.add_argument("-b", "--batch_messages", action="store", dest="batch_messages", help="Set batching of messages instead of sending single lines. Give batch size in bytes", default="0")
+    parser.add_argument("--batch_count", action="store", dest="batch_count", help="Set max number of messages in a batch, 0 for no limit", default="0")
+    parser.add_argument("--batch_linger", action="store", dest="batch_linger", help="Set max seconds a message waits in a partial batch", default="1.0")
+    parser.add_argument("--columnar_topics", action="store", dest="columnar_topics", help="Set comma separated MQTT topic filters whose batches are sent in columnar layout, + and # allowed", default="")
+    parser.add_argument("--queue_size", action="store", dest="queue_size", help="Set size of the queues between pipeline stages", default="1000")
+    parser.add_argument("--spool", "--spill", action="store", dest="spool", help="Set directory spooling payloads while AWS IoT is unreachable", default="serial_data_spool")
+    parser.add_argument("--spool_segment_mb", action="store", dest="spool_segment_mb", help="Set size of a spool segment file in megabytes", default="16")
+    parser.add_argument("--spool_max_mb", "--spill_max_mb", action="store", dest="spool_max_mb", help="Set max size of the spool in megabytes", default="512")
+    parser.add_argument("--metrics_port", action="store", dest="metrics_port", help="Set local HTTP port serving /metrics, 0 to disable", default="0")
+    parser.add_argument("--typed", action="store_true", dest="typed", help="Send numeric fields as JSON numbers and timestamps as epoch milliseconds")
+    parser.add_argument("-e", "--endpoint", action="store", required=True, dest="host", help="Your AWS IoT custom endpoint")
+    parser.add_argument("-r", "--rootCA", action="store", required=True, dest="rootCAPath", help="root_ca.pem")
+    parser.add_argument("-c", "--cert", action="store", dest="certificatePath", help="aa6562034b-certificate.pem.crt")
+    parser.add_argument("-k", "--key", action="store", dest="privateKeyPath", help="aa6562034b-private.pem.key")
+    parser.add_argument("-p", "--port", action="store", dest="port", type=int, help="Port number override")
+    parser.add_argument("-id", "--clientId", action="store", dest="clientId", default="serial-data-simulator", help="Targeted client id")
+    parser.add_argument("-t", "--topic", action="store", dest="topic", default="rules/DataToDynamo/teknoware/telemetry/RaspberryPI3", help="Targeted topic")
+
+    args = parser.parse_args()
+    if not args.certificatePath or not args.privateKeyPath:
+        parser.error("Missing credentials for authentication.")
+        exit(2)
+
+    level = LEVELS.get(args.logging_level, logging.NOTSET)
+    logging.basicConfig(level=level)
+
+    serial_port = SerialPortReader(get_codec(args.codec))
+    serial_port.open(args.serial_port)
+
+    serial_data = SerialData()
+    if args.typed:
+        serial_data.set_field_types(DEFAULT_FIELD_TYPES)
+
+    AWSIotClient = AWSIoTMQTTClient(args.clientId)
+    AWSIotClient.configureEndpoint(args.host, args.port)
+    AWSIotClient.configureCredentials(args.rootCAPath, args.privateKeyPath, args.certificatePath)
+    AWSIotClient.configureAutoReconnectBackoffTime(1, 32, 20)
+    AWSIotClient.configureOfflinePublishQueueing(0)  # Pipeline spools to disk instead
+    AWSIotClient.configureConnectDisconnectTimeout(10)  # 10 sec
+    AWSIotClient.configureMQTTOperationTimeout(5)  # 5 sec
+
+    segment_size = int(args.spool_segment_mb) * 1024 * 1024
+    pipeline = SerialDataPipeline(
+        serial_port=serial_port,
+        serial_data=serial_data,
+        iot_client=AWSIotClient,
+        target_topic=args.topic,
+        spool=SerialDataSpool(args.spool, segment_size,
+                              max(int(args.spool_max_mb) * 1024 * 1024 // segment_size, 1)),
+        batch_messages=args.batch_messages,
+        batch_count=args.batch_count,
+        batch_linger=args.batch_linger,
+        queue_size=args.queue_size,
+        batch_layout=get_layout(args.topic, args.columnar_topics)
+    )
+    AWSIotClient.onOnline = pipeline.on_online
+    AWSIotClient.onOffline = pipeline.on_offline
+
+    start_metrics_server(pipeline.metrics, args.metrics_port)
+
+    try:
+        logging.info('Establishing AWS IoT Connection ...')
+        AWSIotClient.connect()
+        pipeline.on_online()
+        pipeline.run()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        serial_port.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import time
+import random
+import logging
+
+from collections import OrderedDict
+
+LOGGER = logging.getLogger(__name__)
+
+class ReconnectBackoff(object):
+
+    # Delay before the next connection attempt, doubling from initial_delay
+    # up to max_delay with full jitter, so gateways restarted together do not
+    # hit the broker in lockstep. The first attempt after a connection was
+    # lost waits at most initial_delay.
+    #
+    # Also times the outage, from the first on_lost to on_recovered.
+
+    def __init__(self, initial_delay=0.1, max_delay=30.0, rng=None):
+        self.initial_delay = float(initial_delay)
+        self.max_delay = float(max_delay)
+        self.attempts = 0
+        self.lost_time = None
+        self._rng = rng or random.Random()
+
+    def next_delay(self):
+        ceiling = min(self.initial_delay * 2 ** self.attempts, self.max_delay)
+        self.attempts += 1
+        return self._rng.uniform(0, ceiling)
+
+    def on_lost(self):
+        if self.lost_time is None:
+            self.lost_time = time.time()
+
+    def on_recovered(self):
+        # Returns (seconds since the connection was lost, attempts), None
+        # when nothing was lost
+        recovered = None
+        if self.lost_time is not None:
+            recovered = (time.time() - self.lost_time, self.attempts)
+        self.attempts = 0
+        self.lost_time = None
+        return recovered
+
+class StartupTimer(object):
+
+    # Seconds from start to each milestone of the first connection, logged
+    # and reported as the startup_seconds gauge labelled by milestone
+
+    def __init__(self, metrics=None, started=None):
+        self.started = time.time() if started is None else started
+        self.milestones = OrderedDict()
+        if metrics is not None:
+            metrics.add_gauge('startup_seconds', lambda: OrderedDict(self.milestones), label='milestone')
+
+    def mark(self, milestone):
+        if milestone in self.milestones:
+            return
+        seconds = time.time() - self.started
+        self.milestones[milestone] = seconds
+        LOGGER.info('Startup: %s after %0.0f ms', milestone, seconds * 1000)
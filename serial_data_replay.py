@@ -0,0 +1,130 @@
+import time
+import logging
+import functools
+
+from serial_data_delivery import DeliveryAckWindow
+
+LOGGER = logging.getLogger(__name__)
+
+class SerialDataReplay(object):
+
+    # Spool path of the consumer. While the IoT client is offline, or spooled
+    # payloads are still waiting, payloads are appended to the spool so they
+    # keep their order. The replay publishes spooled payloads at the replay
+    # rate and commits the spool position as their PUBACKs arrive.
+
+    REPLAY_INTERVAL = 0.1
+    REPLAY_MAX_IN_FLIGHT_SECONDS = 2 # Replay slows down above this many seconds in flight
+    REPLAY_TIMEOUT = 30 # Replay starts over when no PUBACK arrives for this long
+
+    def __init__(self, spool, iot_client, target_topic, is_online, call_threadsafe, metrics,
+                 replay_rate=50, max_replay_rate=500):
+        self._spool = spool
+        self._iot_client = iot_client
+        self._target_topic = target_topic
+        self._is_online = is_online
+        self._call_threadsafe = call_threadsafe
+        self._metrics = metrics
+        self._connection = None
+        self._replay_rate = float(replay_rate)
+        self._max_replay_rate = float(max_replay_rate)
+        self._replay_credit = 0.0
+        self._replay_timeout = None
+        self._replay_progress_time = 0
+        # MQTT packet id -> spool position after the replayed payload
+        self._replay_window = DeliveryAckWindow()
+        metrics.add_gauge('spool_payloads', lambda: len(self._spool))
+        metrics.add_gauge('spool_bytes', lambda: self._spool.unread_bytes)
+        metrics.add_gauge('replay_in_flight', lambda: len(self._replay_window))
+        metrics.add_gauge('replay_rate', lambda: self._replay_rate)
+
+    def is_spooling(self):
+        # Once spooling, new payloads go behind the spooled ones
+        return not self._is_online() or len(self._spool) > 0 or len(self._replay_window) > 0
+
+    def append(self, payload):
+        # Returns False when the spool is full
+        if not self._spool.append(payload):
+            self._metrics.inc('spool_full')
+            return False
+        self._spool.flush()
+        self._metrics.inc('payloads_spooled')
+        return True
+
+    def start(self, connection):
+        self._connection = connection
+        self.schedule_replay()
+
+    def stop(self):
+        if self._replay_timeout is not None:
+            self._connection.remove_timeout(self._replay_timeout)
+            self._replay_timeout = None
+
+    def schedule_replay(self):
+        self._replay_timeout = self._connection.add_timeout(self.REPLAY_INTERVAL, self.replay)
+
+    def replay(self):
+        # The rate halves when PUBACKs fall behind and grows back up to the
+        # max rate otherwise
+        self._replay_timeout = None
+        in_flight = len(self._replay_window)
+        if in_flight and time.time() - self._replay_progress_time > self.REPLAY_TIMEOUT:
+            LOGGER.warning('No PUBACK for replayed payloads in %i seconds, replaying %i payloads again',
+                           self.REPLAY_TIMEOUT, in_flight)
+            self.restart()
+        elif not self._is_online():
+            if in_flight:
+                LOGGER.warning('IoT client went offline, replaying %i payloads again later', in_flight)
+                self.restart()
+        elif len(self._spool):
+            if in_flight > self._replay_rate * self.REPLAY_MAX_IN_FLIGHT_SECONDS:
+                self._replay_rate = max(self._replay_rate / 2, 1.0)
+            else:
+                self._replay_rate = min(self._replay_rate * 1.25, self._max_replay_rate)
+            self._replay_credit = min(self._replay_credit + self._replay_rate * self.REPLAY_INTERVAL,
+                                      self._replay_rate * self.REPLAY_INTERVAL + 1)
+            while self._replay_credit >= 1 and self.replay_payload():
+                self._replay_credit -= 1
+        self.schedule_replay()
+
+    def replay_payload(self):
+        record = self._spool.read()
+        if record is None:
+            return False
+        payload, position = record
+        try:
+            mid = self._iot_client.publishAsync(self._target_topic, payload, 1,
+                                                self.on_puback_threadsafe)
+        except Exception as error:
+            LOGGER.warning('IoT publish of a spooled payload failed: %s', error)
+            self._metrics.inc('replay_errors')
+            self._replay_rate = max(self._replay_rate / 2, 1.0)
+            self.restart()
+            return False
+        if not len(self._replay_window):
+            self._replay_progress_time = time.time()
+        self._replay_window.add(mid, position)
+        self._metrics.inc('payloads_replayed')
+        return True
+
+    def restart(self):
+        # PUBACKs of the replays in flight are ignored, they are sent again
+        self._replay_window.clear()
+        self._replay_credit = 0.0
+        self._spool.rewind()
+
+    def on_puback_threadsafe(self, mid):
+        # Called from the MQTT client thread
+        self._call_threadsafe(functools.partial(self.on_puback, mid))
+
+    def on_puback(self, mid):
+        position = self._replay_window.confirm(mid)
+        if position is None:
+            return
+        self._replay_progress_time = time.time()
+        self._spool.commit(position)
+        if not len(self._spool) and not len(self._replay_window):
+            LOGGER.info('Spool replayed, publishing directly again')
+
+    def close(self):
+        self._spool.close()
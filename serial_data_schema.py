@@ -0,0 +1,150 @@
+import math
+import time
+import zlib
+import logging
+
+from collections import OrderedDict
+
+from json.encoder import encode_basestring_ascii
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA_MARKER = '!'
+DATA_MARKER = '#'
+
+# Field types for --typed output, other fields stay JSON strings
+DEFAULT_FIELD_TYPES = {'Total runtime': 'timestamp',
+                       'Dev ID': 'int',
+                       'inputs': 'int',
+                       'Sensor1': 'int',
+                       'Sensor2': 'int'}
+
+def get_schema_id(fields):
+    fields = [field.strip() for field in fields]
+    return '%x' % (zlib.crc32('\x1f'.join(fields).encode('utf-8')) & 0xffffffff)
+
+def encode_str(value):
+    return encode_basestring_ascii(value)
+
+def encode_int(value):
+    try:
+        return str(int(value))
+    except ValueError:
+        return encode_basestring_ascii(value)
+
+def encode_float(value):
+    try:
+        number = float(value)
+    except ValueError:
+        return encode_basestring_ascii(value)
+    if math.isinf(number) or math.isnan(number):
+        return encode_basestring_ascii(value)
+    return repr(number)
+
+def encode_timestamp(value):
+    # 'YYYY-MM-DD HH:MM:SS[.ffffff]' as epoch milliseconds. The writer sends
+    # its local time, read in the local time zone of this process with DST
+    # looked up for the date
+    try:
+        date, time_of_day = value.split(' ')
+        year, month, day = date.split('-')
+        hour, minute, second = time_of_day.split(':')
+        seconds = time.mktime((int(year), int(month), int(day),
+                               int(hour), int(minute), 0, 0, 0, -1)) + float(second)
+        # nan and inf seconds fail here
+        milliseconds = int(round(seconds * 1000))
+    except (ValueError, OverflowError):
+        return encode_basestring_ascii(value)
+    return str(milliseconds)
+
+FIELD_ENCODERS = {'str': encode_str,
+                  'int': encode_int,
+                  'float': encode_float,
+                  'timestamp': encode_timestamp}
+
+class SerialDataSchema(object):
+
+    def __init__(self, schema_id, fields, field_types=None):
+        self.schema_id = schema_id
+        self.fields = [field.strip() for field in fields]
+        self.field_types = field_types or {}
+        # Key prefix and value encoder per field are built once per layout
+        self._encoders = [(encode_basestring_ascii(field) + ':',
+                           FIELD_ENCODERS[self.field_types.get(field, 'str')])
+                          for field in self.fields]
+
+    def to_json(self, values):
+        # None when the values do not match the fields
+        if len(values) != len(self._encoders):
+            return None
+        return '{' + ','.join([key + encode(value) for (key, encode), value
+                               in zip(self._encoders, values)]) + '}'
+
+class SerialDataSchemaCache(object):
+
+    # Legacy lines name their schema only by their headings, a writer that
+    # sends changing headings would grow the cache without end, so the least
+    # recently used ones are dropped beyond MAX_LEGACY_SCHEMAS
+
+    MAX_LEGACY_SCHEMAS = 64
+
+    def __init__(self, field_types=None):
+        self._schemas = {}
+        self._legacy_schemas = OrderedDict()
+        self.field_types = field_types or {}
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def set_field_types(self, field_types):
+        self.field_types = field_types or {}
+        for schema_id, schema in self._schemas.items():
+            self._schemas[schema_id] = SerialDataSchema(schema_id, schema.fields, self.field_types)
+        self._legacy_schemas = OrderedDict()
+
+    def add(self, schema_id, fields):
+        schema = SerialDataSchema(schema_id, fields, self.field_types)
+        if schema_id not in self._schemas:
+            LOGGER.info('Registered schema %s: %s', schema_id, schema.fields)
+        self._schemas[schema_id] = schema
+        return schema
+
+    def get(self, schema_id):
+        return self._schemas.get(schema_id)
+
+    def get_fields(self):
+        return dict((schema_id, schema.fields) for schema_id, schema in self._schemas.items())
+
+    def get_legacy(self, fields):
+        # Lines with the heading on every line reuse one schema per heading
+        key = tuple(fields)
+        schema = self._legacy_schemas.pop(key, None)
+        if schema is None:
+            schema = SerialDataSchema(get_schema_id(fields), fields, self.field_types)
+            if len(self._legacy_schemas) >= self.MAX_LEGACY_SCHEMAS:
+                self._legacy_schemas.popitem(last=False)
+        self._legacy_schemas[key] = schema
+        return schema
+
+class SerialDataSchemaFramer(object):
+
+    # Writer side of schema mode. The heading row is sent once as a schema
+    # definition, again when it changes and every resend_interval lines so a
+    # consumer that started late picks it up.
+
+    def __init__(self, resend_interval=100):
+        self._resend_interval = int(resend_interval)
+        self._schema_id = None
+        self._lines_since_schema = 0
+
+    def frame(self, headings, values):
+        rows = []
+        schema_id = get_schema_id(headings)
+        if (schema_id != self._schema_id or
+                (self._resend_interval and self._lines_since_schema >= self._resend_interval)):
+            rows.append([SCHEMA_MARKER + schema_id] + list(headings))
+            self._schema_id = schema_id
+            self._lines_since_schema = 0
+        rows.append([DATA_MARKER + schema_id] + list(values))
+        self._lines_since_schema += 1
+        return rows
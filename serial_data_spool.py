@@ -0,0 +1,217 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+import logging
+
+from collections import deque
+
+LOGGER = logging.getLogger(__name__)
+
+class SerialDataSpool(object):
+
+    # Append-only spool of payloads in preallocated, memory mapped segment
+    # files. A record is a big-endian length and crc32 followed by the
+    # payload, a zero length marks the end of the written part. The read
+    # position is checkpointed to a separate file, so after a restart
+    # replay starts from the last checkpoint instead of the beginning.
+    # Replay is at least once: records read after the last checkpoint are
+    # read again after a restart or a rewind.
+
+    RECORD_HEADER = struct.Struct('>II')
+    CHECKPOINT = struct.Struct('>QQ')
+    SEGMENT_SUFFIX = '.spool'
+    CHECKPOINT_FILE = 'checkpoint'
+
+    def __init__(self, directory, segment_size=16777216, max_segments=32, checkpoint_interval=1.0):
+        self._directory = directory
+        self._segment_size = int(segment_size)
+        self._max_segments = max(int(max_segments), 1)
+        self._checkpoint_interval = float(checkpoint_interval)
+        self._maps = {}
+        self._synced = 0
+        self._checkpointed_at = time.time()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        numbers = sorted(int(name[:-len(self.SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                         if name.endswith(self.SEGMENT_SUFFIX))
+        committed = self._load_checkpoint() or ((numbers or [1])[0], 0)
+        for number in numbers:
+            if number < committed[0]:
+                self._remove_segment(number)
+        self._segments = [number for number in numbers if number >= committed[0]] or [committed[0]]
+        if committed[0] != self._segments[0]:
+            committed = (self._segments[0], 0)
+        self._committed = committed
+        self._read = committed
+        # (position, payload size) of records read but not committed
+        self._uncommitted = deque()
+
+        # Count what is left to replay and find where the last segment ends
+        self._unread = 0
+        self.unread_bytes = 0
+        position = committed
+        while True:
+            record = self._next_record(position, recover=True)
+            if record is None:
+                break
+            position = record[1]
+            self._unread += 1
+            self.unread_bytes += len(record[0])
+        if position[0] != self._segments[-1]:
+            position = (self._segments[-1], 0)
+        self._write = position
+        self._synced = position[1]
+        if self._unread:
+            LOGGER.info('Spool %s has %i records (%i bytes) to replay',
+                        directory, self._unread, self.unread_bytes)
+
+    def __len__(self):
+        return self._unread
+
+    def _segment_path(self, number):
+        return os.path.join(self._directory, '%010d%s' % (number, self.SEGMENT_SUFFIX))
+
+    def _map(self, number, size=None):
+        segment = self._maps.get(number)
+        if segment is None:
+            fd = os.open(self._segment_path(number), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if size is not None or os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, size or self._segment_size)
+                segment = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            self._maps[number] = segment
+        return segment
+
+    def _unmap(self, number):
+        segment = self._maps.pop(number, None)
+        if segment is not None:
+            segment.close()
+
+    def _remove_segment(self, number):
+        self._unmap(number)
+        try:
+            os.remove(self._segment_path(number))
+        except OSError as error:
+            LOGGER.warning('Failed to remove spool segment %i: %s', number, error)
+
+    def _next_record(self, position, recover=False):
+        # Returns (payload, position after it) or None at the end of the spool
+        number, offset = position
+        while True:
+            segment = self._map(number)
+            header_end = offset + self.RECORD_HEADER.size
+            length = crc = 0
+            if header_end <= len(segment):
+                length, crc = self.RECORD_HEADER.unpack_from(segment, offset)
+            if length and header_end + length <= len(segment):
+                payload = segment[header_end:header_end + length]
+                if zlib.crc32(payload) & 0xffffffff == crc:
+                    return payload, (number, header_end + length)
+            later = [later for later in self._segments if later > number]
+            if not later:
+                if recover and (length or crc):
+                    # Last record was torn by a crash, appends overwrite it
+                    LOGGER.warning('Dropping torn record at offset %i of spool segment %i',
+                                   offset, number)
+                    end = min(header_end + length, len(segment))
+                    segment[offset:end] = '\x00' * (end - offset)
+                return None
+            # Records that did not fit continue in the next segment
+            number, offset = later[0], 0
+
+    def append(self, payload):
+        # Returns False when the spool is full
+        size = self.RECORD_HEADER.size + len(payload)
+        number, offset = self._write
+        segment = self._map(number)
+        if offset + size > len(segment):
+            if len(self._segments) >= self._max_segments:
+                return False
+            self.flush()
+            if number != self._read[0]:
+                self._unmap(number)
+            number, offset = number + 1, 0
+            self._segments.append(number)
+            segment = self._map(number, max(self._segment_size, size))
+            self._synced = 0
+        self.RECORD_HEADER.pack_into(segment, offset, len(payload), zlib.crc32(payload) & 0xffffffff)
+        segment[offset + self.RECORD_HEADER.size:offset + size] = payload
+        self._write = (number, offset + size)
+        self._unread += 1
+        self.unread_bytes += len(payload)
+        return True
+
+    def flush(self):
+        # Makes the appended records durable, msync needs page aligned offsets
+        number, offset = self._write
+        start = self._synced - self._synced % mmap.PAGESIZE
+        if offset > start:
+            self._map(number).flush(start, offset - start)
+        self._synced = offset
+
+    def read(self):
+        # Returns (payload, position) of the next unread record or None
+        record = self._next_record(self._read)
+        if record is None:
+            return None
+        payload, position = record
+        if position[0] != self._read[0] and self._read[0] != self._write[0]:
+            self._unmap(self._read[0])
+        self._read = position
+        self._uncommitted.append((position, len(payload)))
+        self._unread -= 1
+        self.unread_bytes -= len(payload)
+        return payload, position
+
+    def commit(self, position):
+        # Everything up to position has been delivered
+        while self._uncommitted and self._uncommitted[0][0] <= position:
+            self._uncommitted.popleft()
+        if position <= self._committed:
+            return
+        self._committed = position
+        finished = [number for number in self._segments if number < position[0]]
+        for number in finished:
+            self._segments.remove(number)
+            self._remove_segment(number)
+        if finished or time.time() - self._checkpointed_at >= self._checkpoint_interval:
+            self.checkpoint()
+
+    def rewind(self):
+        # Reads again everything after the last commit
+        for _, size in self._uncommitted:
+            self._unread += 1
+            self.unread_bytes += size
+        self._uncommitted.clear()
+        self._read = self._committed
+
+    def checkpoint(self):
+        path = os.path.join(self._directory, self.CHECKPOINT_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.CHECKPOINT.pack(*self._committed))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        self._checkpointed_at = time.time()
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self._directory, self.CHECKPOINT_FILE), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        if len(data) != self.CHECKPOINT.size:
+            LOGGER.warning('Ignoring damaged spool checkpoint in %s', self._directory)
+            return None
+        return self.CHECKPOINT.unpack(data)
+
+    def close(self):
+        self.flush()
+        self.checkpoint()
+        for number in list(self._maps):
+            self._unmap(number)
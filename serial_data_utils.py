@@ -5,26 +5,39 @@ LOGGER = logging.getLogger(__name__)
 
 class SerialDataUtils(object):
 
+    HEADINGS = ['Total runtime','FW ver','Dev ID','Type','inputs','state','Sensor1','Sensor2']
+
     def __init__(self):
         pass
 
+    def generate_mock_headings(self):
+        return [cell + '\n' for cell in self.HEADINGS]
+
     def generate_mock_data(self, min_range=0, max_range=1):
-        headings = ['Total runtime','FW ver','Dev ID','Type','inputs','state','Sensor1','Sensor2']
-        headings = [cell + '\n' for cell in headings]
         rows = []
-        rows.extend(headings)
+        rows.extend(self.generate_mock_headings())
+        rows.extend(self.generate_mock_values(min_range, max_range))
+        LOGGER.debug('Generated random mock data: %s', rows)
+        return rows
+
+    def generate_mock_values(self, min_range=0, max_range=1):
+        rows = []
         for i in range(min_range, max_range):
-            totalRuntime = datetime.now()
-            FWVer = 'V001'
-            devID = 0
-            Type = 'Sensor'
-            inputs = 8
-            state = 'Active'
-            Sensor1 = random.randint(0,100)
-            Sensor2 = random.randint(0,50)
-            values = [str(totalRuntime), str(FWVer), str(devID), Type, str(inputs), state, str(Sensor1), str(Sensor2)]
-            values = [cell + '\n' for cell in values]
-            #values[-1] = values[-1].replace('\n', '\r\n')
-            rows.extend(values)
-        LOGGER.debug('Generated random mock data: ', rows)
+            rows.extend(self._build_values(datetime.now(), 0, random))
         return rows
+
+    def generate_seeded_values(self, rng, dev_id, total_runtime):
+        # Same line as generate_mock_values, but reproducible for a seeded rng
+        return self._build_values(total_runtime, dev_id, rng)
+
+    def _build_values(self, totalRuntime, devID, rng):
+        FWVer = 'V001'
+        Type = 'Sensor'
+        inputs = 8
+        state = 'Active'
+        Sensor1 = rng.randint(0,100)
+        Sensor2 = rng.randint(0,50)
+        values = [str(totalRuntime), str(FWVer), str(devID), Type, str(inputs), state, str(Sensor1), str(Sensor2)]
+        values = [cell + '\n' for cell in values]
+        #values[-1] = values[-1].replace('\n', '\r\n')
+        return values
@@ -0,0 +1,240 @@
+import json
+import math
+import time
+
+from collections import OrderedDict, deque
+
+# Field that tells devices multiplexed on one serial port apart
+DEVICE_FIELD = 'Dev ID'
+
+def get_fields(value):
+    # Comma separated field names as a list
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+def get_number(value):
+    # JSON number or numeric string as int or float, None otherwise
+    if isinstance(value, bool):
+        return None
+    if not isinstance(value, (int, long, float)):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return None
+    if isinstance(value, float) and (math.isinf(value) or math.isnan(value)):
+        return None
+    return value
+
+def to_milliseconds(seconds):
+    return int(round(seconds * 1000))
+
+class FieldWindow(object):
+
+    # Count, min, max, sum and last value of one field, the same size
+    # however many values were added
+
+    __slots__ = ('count', 'min', 'max', 'sum', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0
+        self.last = None
+
+    def add(self, value):
+        if not self.count or value < self.min:
+            self.min = value
+        if not self.count or value > self.max:
+            self.max = value
+        self.count += 1
+        self.sum += value
+        self.last = value
+
+    def merge(self, other):
+        # other is the later window
+        if not other.count:
+            return
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if not self.count or other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.sum += other.sum
+        self.last = other.last
+
+    def to_dict(self):
+        return OrderedDict([('count', self.count),
+                            ('min', self.min),
+                            ('max', self.max),
+                            ('mean', float(self.sum) / self.count),
+                            ('last', self.last)])
+
+class WindowPane(object):
+
+    # Values of one device in one slide interval. hold and ack_tag belong to
+    # the consumer, the ack window key holding back later deliveries and the
+    # last delivery tag that is acked once the pane is uploaded.
+
+    __slots__ = ('start', 'fields', 'hold', 'ack_tag')
+
+    def __init__(self, start):
+        self.start = start
+        self.fields = {}
+        self.hold = None
+        self.ack_tag = None
+
+class DeviceWindows(object):
+
+    # Panes of one device, oldest first, at most size / slide of them
+
+    def __init__(self, key):
+        self.key = key
+        self.panes = deque()
+        # (field, value) pairs of the last message, copied to records
+        # without the window fields
+        self.last_fields = []
+        self.touched = 0
+
+class SerialDataWindows(object):
+
+    # Downsamples parsed messages into windows per device. Windows are size
+    # seconds long and start every slide seconds, tumbling when slide equals
+    # size, aligned to the epoch. A window is kept as size / slide panes of
+    # slide seconds each holding count, min, max, sum and last per field, so
+    # memory per window does not grow with the sample rate. Windows end when
+    # a value of a later pane arrives or the device is quiet for slide
+    # seconds, and are sent as one record with the window fields replaced by
+    # their statistics.
+    #
+    # Values are placed by the time the publisher read them, values older
+    # than the newest pane go into the newest pane. Fields in passthrough are
+    # also sent raw with every message.
+
+    def __init__(self, size, slide=None, fields=(), passthrough=(), metrics=None):
+        self.size = float(size)
+        self.slide = float(slide) if slide else self.size
+        if self.size <= 0 or self.slide <= 0 or self.slide > self.size:
+            raise ValueError('Window of %s seconds cannot slide by %s seconds' % (size, slide))
+        panes = self.size / self.slide
+        if abs(panes - round(panes)) > 1e-9:
+            raise ValueError('Window of %s seconds is not a multiple of its slide of %s seconds' %
+                             (size, slide))
+        self.fields = [field for field in fields if field]
+        if not self.fields:
+            raise ValueError('Window needs at least one field to aggregate')
+        self._window_fields = set(self.fields)
+        self.passthrough = set(passthrough)
+        # Window fields left out of the raw messages
+        self._window_only = set(self.fields) - self.passthrough
+        self._devices = OrderedDict()
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add_gauge('window_devices', lambda: len(self._devices))
+
+    def __len__(self):
+        return len(self._devices)
+
+    def clear(self):
+        self._devices.clear()
+
+    def get_pane_start(self, sample_time):
+        return math.floor(sample_time / self.slide) * self.slide
+
+    def add(self, device, message, sample_time=None, now=None):
+        # Returns (pane the message went into or None, closed records, raw
+        # message to send or None). Records are (key, JSON, panes they
+        # release), oldest first.
+        now = time.time() if now is None else now
+        # Pairs keep the field order at a third of the cost of an OrderedDict
+        try:
+            pairs = json.loads(message, object_pairs_hook=list)
+        except ValueError:
+            return None, [], message
+        if not isinstance(pairs, list) or (pairs and not isinstance(pairs[0], tuple)):
+            return None, [], message
+        fields = dict(pairs)
+        values = []
+        for field in self.fields:
+            if field in fields:
+                value = get_number(fields[field])
+                if value is None:
+                    self.inc('window_invalid_values')
+                else:
+                    values.append((field, value))
+        if not values:
+            return None, [], message
+
+        key = (device, fields.get(DEVICE_FIELD))
+        windows = self._devices.get(key)
+        if windows is None:
+            windows = self._devices[key] = DeviceWindows(key)
+        pane_start = self.get_pane_start(now if sample_time is None else sample_time)
+        records = []
+        if windows.panes and pane_start < windows.panes[-1].start:
+            self.inc('window_late_values', len(values))
+        elif windows.panes and pane_start > windows.panes[-1].start:
+            records = self.advance(windows, pane_start)
+        if not windows.panes or pane_start > windows.panes[-1].start:
+            windows.panes.append(WindowPane(pane_start))
+        pane = windows.panes[-1]
+        for field, value in values:
+            stats = pane.fields.get(field)
+            if stats is None:
+                stats = pane.fields[field] = FieldWindow()
+            stats.add(value)
+        self.inc('window_values', len(values))
+        windows.last_fields = pairs
+        windows.touched = now
+
+        raw = None
+        if self.passthrough.intersection(fields):
+            raw = json.dumps(OrderedDict((field, value) for field, value in pairs
+                                         if field not in self._window_only),
+                             separators=(',', ':'))
+        return pane, records, raw
+
+    def advance(self, windows, pane_start):
+        # Closes the windows that end by pane_start
+        records = []
+        end = windows.panes[-1].start + self.slide
+        while windows.panes and end <= pane_start:
+            record = self.to_record(windows, end)
+            released = []
+            # Panes that are in none of the windows still to come
+            while windows.panes and windows.panes[0].start < end + self.slide - self.size - 1e-9:
+                released.append(windows.panes.popleft())
+            records.append((windows.key[0], record, released))
+            end += self.slide
+        self.inc('window_records', len(records))
+        return records
+
+    def to_record(self, windows, end):
+        record = OrderedDict((field, value) for field, value in windows.last_fields
+                             if field not in self._window_fields)
+        record['window_start'] = to_milliseconds(end - self.size)
+        record['window_end'] = to_milliseconds(end)
+        for field in self.fields:
+            stats = FieldWindow()
+            for pane in windows.panes:
+                if field in pane.fields:
+                    stats.merge(pane.fields[field])
+            if stats.count:
+                record[field] = stats.to_dict()
+        return json.dumps(record, separators=(',', ':'))
+
+    def flush_idle(self, now=None):
+        # Records of every window of devices quiet for slide seconds
+        now = time.time() if now is None else now
+        records = []
+        for key, windows in list(self._devices.items()):
+            if now - windows.touched >= self.slide:
+                records.extend(self.advance(windows, float('inf')))
+                del self._devices[key]
+        return records
+
+    def inc(self, name, value=1):
+        if self._metrics is not None:
+            self._metrics.inc(name, value)
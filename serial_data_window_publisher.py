@@ -0,0 +1,146 @@
+import logging
+
+from collections import deque
+
+LOGGER = logging.getLogger(__name__)
+
+class SerialDataWindowPublisher(object):
+
+    # Window path of the consumer. Parsed messages go into SerialDataWindows
+    # and closed windows are published as records. A pane holds back the
+    # acks of later deliveries in the consumer's ack window until the record
+    # releasing it has its PUBACK or is spooled. Records that fail to publish
+    # are sent again in order. Once the held messages reach the prefetch
+    # count RabbitMQ delivers nothing more, and windows of devices that look
+    # quiet close early, so that is logged and counted in window_starved.
+
+    TIMER_INTERVAL = 1.0 # Longest time between closing windows of quiet devices
+
+    def __init__(self, windows, ack_window, send, hand_over, acknowledge, metrics, replay=None,
+                 prefetch_count=0):
+        self._windows = windows
+        self._ack_window = ack_window
+        # send(payload, key) returns the MQTT packet id or raises
+        self._send = send
+        self._hand_over = hand_over
+        self._acknowledge = acknowledge
+        self._metrics = metrics
+        self._replay = replay
+        self._connection = None
+        self._timeout = None
+        # MQTT packet id of a window record -> holds of the panes it releases
+        self._publishes = {}
+        # (key, record, holds) that failed to publish, sent again in order
+        self._retry = deque()
+        self._prefetch_count = prefetch_count
+        # Pane hold -> number of messages it keeps unacked
+        self._held = {}
+        self._held_messages = 0
+        self._starved = False
+        metrics.add_gauge('window_retry', lambda: len(self._retry))
+        metrics.add_gauge('window_held_messages', lambda: self._held_messages)
+
+    def add(self, delivery_tag, device, message, frame_time=None):
+        # Returns the message to send raw, or None when it went into windows only
+        pane, records, raw = self._windows.add(device, message, frame_time)
+        for key, record, panes in records:
+            self.publish_record(key, record, panes)
+        if pane is None:
+            return raw
+        if pane.hold is None:
+            # No delivery after this one is acked before the pane is uploaded
+            pane.hold = object()
+            self._ack_window.add(pane.hold, None)
+        self._held[pane.hold] = self._held.get(pane.hold, 0) + 1
+        self._held_messages += 1
+        if self._prefetch_count and self._held_messages >= self._prefetch_count:
+            self.on_starved()
+        if raw is not None:
+            return raw
+        ack_tag = self._hand_over([delivery_tag])
+        if ack_tag is not None:
+            pane.ack_tag = ack_tag
+        return None
+
+    def publish_record(self, key, record, panes):
+        # Holds of the released panes stay in place in the ack window and
+        # now ack their deliveries, once the record has its PUBACK
+        for pane in panes:
+            self._ack_window.add(pane.hold, pane.ack_tag)
+        holds = [pane.hold for pane in panes]
+        if self._retry or not self.send_record(key, record, holds):
+            self._retry.append((key, record, holds))
+
+    def send_record(self, key, record, holds):
+        if self._replay is not None and self._replay.is_spooling():
+            if not self._replay.append(record):
+                return False
+            self.confirm_holds(holds)
+            return True
+        try:
+            mid = self._send(record, key)
+        except Exception as error:
+            # Holds stay until a PUBACK
+            LOGGER.warning('IoT publish of a window record failed, sending it again later: %s', error)
+            self._metrics.inc('iot_publish_errors')
+            return False
+        self._metrics.inc('window_records_published')
+        self._publishes[mid] = holds
+        return True
+
+    def on_starved(self):
+        self._metrics.inc('window_starved')
+        if not self._starved:
+            LOGGER.error('Open windows hold all %i prefetched messages, RabbitMQ stops delivering '
+                         'and windows close early. Raise --prefetch above the messages of one window',
+                         self._prefetch_count)
+            self._starved = True
+
+    def confirm_holds(self, holds):
+        ack_tag = None
+        for hold in holds:
+            self._held_messages -= self._held.pop(hold, 0)
+            delivery_tag = self._ack_window.confirm(hold)
+            if delivery_tag is not None:
+                ack_tag = delivery_tag
+        if ack_tag is not None:
+            self._acknowledge(ack_tag, multiple=True)
+        if self._held_messages < self._prefetch_count:
+            self._starved = False
+
+    def on_puback(self, mid):
+        # Returns False when mid is not a window record
+        holds = self._publishes.pop(mid, None)
+        if holds is None:
+            return False
+        self.confirm_holds(holds)
+        return True
+
+    def start(self, connection):
+        self._connection = connection
+        self.schedule_timer()
+
+    def stop(self):
+        # Deliveries of the windows are requeued by the broker
+        if self._timeout is not None:
+            self._connection.remove_timeout(self._timeout)
+            self._timeout = None
+        self._windows.clear()
+        self._publishes = {}
+        self._retry.clear()
+        self._held = {}
+        self._held_messages = 0
+        self._starved = False
+
+    def schedule_timer(self):
+        self._timeout = self._connection.add_timeout(min(self._windows.slide, self.TIMER_INTERVAL),
+                                                     self.on_timer)
+
+    def on_timer(self):
+        # Sends records that failed before, then closes windows of quiet devices
+        self._timeout = None
+        while self._retry and self.send_record(*self._retry[0]):
+            self._retry.popleft()
+        for key, record, panes in self._windows.flush_idle():
+            self.publish_record(key, record, panes)
+        self.schedule_timer()
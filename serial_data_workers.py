@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+import multiprocessing
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+
+LOGGER = logging.getLogger(__name__)
+
+_serial_data = None
+
+def init_worker(field_types):
+    global _serial_data
+    _serial_data = SerialData()
+    _serial_data.set_field_types(field_types)
+
+def decode_message(task):
+    sequence, codec_name, body, schemas = task
+    start = time.time()
+    try:
+        for schema_id, fields in schemas.items():
+            if _serial_data.schemas.get(schema_id) is None:
+                _serial_data.schemas.add(schema_id, fields)
+        _serial_data.set_message(body)
+        text = _serial_data.parse_wire_to_string(get_codec(codec_name)).message
+        message = _serial_data.parse_string_to_json().message
+    except Exception as error:
+        LOGGER.exception('Failed to decode message')
+        return sequence, os.getpid(), time.time() - start, 'error', str(error)
+    if not message:
+        # Schema lines have to be handled in order by the parent process
+        return sequence, os.getpid(), time.time() - start, 'text', text
+    return sequence, os.getpid(), time.time() - start, 'json', message
+
+class SerialDataWorkerPool(object):
+
+    # Decodes messages in a process pool and hands the results back in
+    # submission order, which keeps the order of every device's lines.
+    #
+    # Python 2 pools have no error callback, a task that fails to pickle or
+    # dies with its worker never calls back. check fails those tasks, and
+    # tasks without a result after task_timeout seconds, so the results
+    # after them are not held back for good.
+
+    def __init__(self, workers, dispatch, field_types=None, task_timeout=30):
+        self._pool = multiprocessing.Pool(int(workers), init_worker, (field_types or {},))
+        self._dispatch = dispatch
+        self._task_timeout = float(task_timeout)
+        self._sequence = 0
+        self._next_sequence = 1
+        self._results = {}
+        self._callbacks = {}
+        # Sequence -> (async result, submit time) until the result is in
+        self._tasks = {}
+        self._schemas = {}
+        self._stats = {}
+        self._stats_started = time.time()
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def set_schemas(self, schemas):
+        self._schemas = schemas
+
+    def submit(self, codec_name, body, callback):
+        self._sequence += 1
+        sequence = self._sequence
+        self._callbacks[sequence] = callback
+        try:
+            task = self._pool.apply_async(decode_message,
+                                          ((sequence, codec_name, body, self._schemas),),
+                                          callback=self.on_result_threadsafe)
+        except Exception as error:
+            self.on_result((sequence, None, 0.0, 'error', str(error)))
+            return
+        self._tasks[sequence] = (task, time.time())
+
+    def check(self, now=None):
+        now = time.time() if now is None else now
+        for sequence, (task, submitted) in sorted(self._tasks.items()):
+            if task.ready():
+                if task.successful():
+                    # Its callback is on the way
+                    continue
+                try:
+                    task.get(0)
+                except Exception as error:
+                    message = str(error) or error.__class__.__name__
+            elif now - submitted > self._task_timeout:
+                message = 'No result after %0.0f seconds' % self._task_timeout
+            else:
+                continue
+            LOGGER.warning('Decoding task %i failed: %s', sequence, message)
+            self.on_result((sequence, None, 0.0, 'error', message))
+
+    def on_result_threadsafe(self, result):
+        # Called from the result thread of the pool
+        self._dispatch(lambda: self.on_result(result))
+
+    def on_result(self, result):
+        sequence, pid, elapsed, kind, message = result
+        if sequence < self._next_sequence or sequence in self._results:
+            # Failed by check already
+            return
+        self._tasks.pop(sequence, None)
+        if pid is not None:
+            stats = self._stats.setdefault(pid, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+        self._results[sequence] = (kind, message)
+        while self._next_sequence in self._results:
+            kind, message = self._results.pop(self._next_sequence)
+            callback = self._callbacks.pop(self._next_sequence)
+            self._next_sequence += 1
+            callback(kind, message)
+
+    def get_stats(self):
+        elapsed = max(time.time() - self._stats_started, 1e-9)
+        return dict((pid, {'messages': count,
+                           'messages_per_second': count / elapsed,
+                           'busy_ratio': busy / elapsed})
+                    for pid, (count, busy) in self._stats.items())
+
+    def log_stats(self):
+        for pid, stats in sorted(self.get_stats().items()):
+            LOGGER.info('Worker %i decoded %i messages, %0.1f messages/s, %0.0f%% busy',
+                        pid, stats['messages'], stats['messages_per_second'],
+                        stats['busy_ratio'] * 100)
+        self._stats = {}
+        self._stats_started = time.time()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
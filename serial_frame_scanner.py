@@ -0,0 +1,125 @@
+import struct
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+class SerialFrameScanner(object):
+
+    CRLF = b'13 10'
+    SEPARATOR = ord(b' ')
+
+    def __init__(self, max_frame_size=65536):
+        self.max_frame_size = int(max_frame_size)
+        self.bytes_read = 0
+        self.frames_emitted = 0
+        self.bytes_dropped = 0
+        self._buffer = bytearray()
+        self._scan_offset = 0
+        self._synced = False
+
+    def feed(self, data):
+        # Frames are the bytes between two CRLF markers, anything before the
+        # first marker is a partial line and gets dropped.
+        self.bytes_read += len(data)
+        self._buffer.extend(data)
+        buffer = self._buffer
+        frames = []
+        frame_start = 0
+        while True:
+            index = buffer.find(self.CRLF, self._scan_offset)
+            if index < 0:
+                break
+            self._scan_offset = index + 1
+            if index > frame_start and buffer[index - 1] != self.SEPARATOR:
+                continue
+            frame_end = index + len(self.CRLF)
+            if self._synced:
+                frame = b' '.join(bytes(buffer[frame_start:frame_end]).split())
+                self.frames_emitted += 1
+                LOGGER.debug('Read complete line: %s', frame)
+                frames.append(frame)
+            else:
+                self.bytes_dropped += frame_end
+                self._synced = True
+            frame_start = frame_end
+            self._scan_offset = frame_end
+
+        if frame_start:
+            del buffer[:frame_start]
+            self._scan_offset -= frame_start
+        self._scan_offset = max(self._scan_offset, len(buffer) - len(self.CRLF) + 1, 0)
+
+        if len(buffer) > self.max_frame_size:
+            LOGGER.warning('Dropping %i bytes without line ending', len(buffer))
+            self.bytes_dropped += len(buffer)
+            del buffer[:]
+            self._scan_offset = 0
+            self._synced = False
+        return frames
+
+    def reset(self):
+        self.bytes_dropped += len(self._buffer)
+        del self._buffer[:]
+        self._scan_offset = 0
+        self._synced = False
+
+    def get_counters(self):
+        return {'bytes_read': self.bytes_read,
+                'frames_emitted': self.frames_emitted,
+                'bytes_dropped': self.bytes_dropped}
+
+class LengthPrefixedFrameScanner(object):
+
+    MAGIC = b'\xa5\x5a'
+    HEADER = struct.Struct('>2sH')
+
+    def __init__(self, max_frame_size=65535):
+        self.max_frame_size = int(max_frame_size)
+        self.bytes_read = 0
+        self.frames_emitted = 0
+        self.bytes_dropped = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        # Frames are MAGIC, a big-endian 16 bit length and the payload. Bytes
+        # that do not start a valid header are dropped until MAGIC is found.
+        self.bytes_read += len(data)
+        self._buffer.extend(data)
+        buffer = self._buffer
+        frames = []
+        offset = 0
+        while True:
+            index = buffer.find(self.MAGIC, offset)
+            if index < 0:
+                garbage = max(len(buffer) - len(self.MAGIC) + 1, offset)
+                self.bytes_dropped += garbage - offset
+                offset = garbage
+                break
+            self.bytes_dropped += index - offset
+            offset = index
+            if len(buffer) - offset < self.HEADER.size:
+                break
+            magic, length = self.HEADER.unpack_from(buffer, offset)
+            if length > self.max_frame_size:
+                self.bytes_dropped += 1
+                offset += 1
+                continue
+            frame_end = offset + self.HEADER.size + length
+            if frame_end > len(buffer):
+                break
+            frames.append(bytes(buffer[offset + self.HEADER.size:frame_end]))
+            self.frames_emitted += 1
+            offset = frame_end
+
+        if offset:
+            del buffer[:offset]
+        return frames
+
+    def reset(self):
+        self.bytes_dropped += len(self._buffer)
+        del self._buffer[:]
+
+    def get_counters(self):
+        return {'bytes_read': self.bytes_read,
+                'frames_emitted': self.frames_emitted,
+                'bytes_dropped': self.bytes_dropped}
@@ -0,0 +1,183 @@
+import os
+import math
+import time
+import random
+import logging
+
+from datetime import datetime, timedelta
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+from serial_data_schema import SerialDataSchemaFramer
+from serial_data_utils import SerialDataUtils
+
+LOGGER = logging.getLogger(__name__)
+
+# Fixed base for generated timestamps, so a seed always gives the same bytes
+LOAD_START_TIME = datetime(2019, 1, 1)
+
+def build_load_payloads(ports, devices, variants=100, seed=0, codec=None,
+                        schema=False, schema_interval=100):
+    # Device i writes to port i % ports, lines of a port interleave its devices
+    ports = int(ports)
+    devices = int(devices)
+    if devices < ports:
+        raise ValueError('Need at least one device per port, got %i devices for %i ports' %
+                         (devices, ports))
+    codec = codec or get_codec()
+    rng = random.Random(seed)
+    utils = SerialDataUtils()
+    serial_data = SerialData()
+    payloads = []
+    for port in range(ports):
+        framer = SerialDataSchemaFramer(schema_interval) if schema else None
+        lines = []
+        for variant in range(int(variants)):
+            total_runtime = LOAD_START_TIME + timedelta(seconds=variant)
+            for dev_id in range(port, devices, ports):
+                values = utils.generate_seeded_values(rng, dev_id, total_runtime)
+                if framer:
+                    rows = framer.frame(utils.generate_mock_headings(), values)
+                else:
+                    rows = [utils.generate_mock_headings() + values]
+                for row in rows:
+                    serial_data.set_message(row)
+                    lines.append(serial_data.parse_csv_to_string().parse_string_to_wire(codec).message)
+        payloads.append(lines)
+    return payloads
+
+class SerialLoadSchedule(object):
+
+    # Line n is due at a fixed offset from the start, so a late write is made
+    # up by the next one instead of shifting every later line. The rate goes
+    # linearly from rate to ramp_to during the first ramp_seconds.
+
+    def __init__(self, rate, ramp_to=None, ramp_seconds=0):
+        self.rate = float(rate)
+        self.ramp_to = self.rate if ramp_to is None else float(ramp_to)
+        self.ramp_seconds = float(ramp_seconds) if self.ramp_to != self.rate else 0.0
+        if self.rate < 0 or self.ramp_to < 0:
+            raise ValueError('Rate must not be negative')
+        self._ramp_lines = (self.rate + self.ramp_to) * self.ramp_seconds / 2
+
+    def rate_at(self, elapsed):
+        if elapsed < self.ramp_seconds:
+            return self.rate + (self.ramp_to - self.rate) * elapsed / self.ramp_seconds
+        return self.ramp_to
+
+    def lines_due(self, elapsed):
+        if elapsed < self.ramp_seconds:
+            return (self.rate * elapsed +
+                    (self.ramp_to - self.rate) * elapsed * elapsed / (2 * self.ramp_seconds))
+        return self._ramp_lines + self.ramp_to * (elapsed - self.ramp_seconds)
+
+    def time_due(self, lines):
+        # Inverse of lines_due, None if the line is never due
+        if lines < self._ramp_lines:
+            acceleration = (self.ramp_to - self.rate) / self.ramp_seconds
+            return ((math.sqrt(max(self.rate * self.rate + 2 * acceleration * lines, 0)) - self.rate) /
+                    acceleration)
+        if self.ramp_to == 0:
+            return None
+        return self.ramp_seconds + (lines - self._ramp_lines) / self.ramp_to
+
+class SerialLoadGenerator(object):
+
+    # Writes precomputed lines to one or more serial ports. Every wakeup
+    # writes all lines that are due as one buffer per port, a schedule of
+    # None writes as fast as the ports accept data.
+
+    REPORT_INTERVAL = 5
+    MAX_WRITE_LINES = 1000
+
+    def __init__(self, ports, payloads, schedule=None, burst=1, duration=0):
+        if len(ports) != len(payloads):
+            raise ValueError('Got payloads for %i ports, expected %i' % (len(payloads), len(ports)))
+        self._port_names = ports
+        self._ports = [os.open(port, os.O_WRONLY | os.O_NOCTTY) for port in ports]
+        self._payloads = payloads
+        self._cursors = [0] * len(ports)
+        self._schedule = schedule
+        self._burst = max(int(burst), 1)
+        self._duration = float(duration)
+        self.lines_written = 0
+        self.bytes_written = 0
+
+    def write_lines(self, count):
+        ports = len(self._ports)
+        first_port = self.lines_written % ports
+        for offset in range(min(count, ports)):
+            port = (first_port + offset) % ports
+            # Lines go round robin over ports, port gets every ports-th line
+            data = self._take(port, (count - offset + ports - 1) // ports)
+            self._write_all(self._ports[port], data)
+            self.bytes_written += len(data)
+        self.lines_written += count
+
+    def _take(self, port, count):
+        payloads = self._payloads[port]
+        cursor = self._cursors[port]
+        chunks = []
+        while count:
+            chunk = payloads[cursor:cursor + count]
+            chunks.extend(chunk)
+            count -= len(chunk)
+            cursor = (cursor + len(chunk)) % len(payloads)
+        self._cursors[port] = cursor
+        return ''.join(chunks)
+
+    def _write_all(self, fd, data):
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+
+    def get_stats(self, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        return {'lines': self.lines_written,
+                'bytes': self.bytes_written,
+                'seconds': elapsed,
+                'lines_per_second': self.lines_written / elapsed,
+                'bytes_per_second': self.bytes_written / elapsed}
+
+    def run(self):
+        LOGGER.info('Started writing load to ports: %s', ', '.join(self._port_names))
+        start = time.time()
+        report_at = start + self.REPORT_INTERVAL
+        reported_lines, reported_bytes = 0, 0
+        try:
+            while True:
+                now = time.time()
+                elapsed = now - start
+                if self._duration and elapsed >= self._duration:
+                    break
+                if now >= report_at:
+                    LOGGER.info('Wrote %0.1f lines/s (target %s), %0.1f kB/s',
+                                (self.lines_written - reported_lines) / self.REPORT_INTERVAL,
+                                'max' if self._schedule is None else
+                                '%0.1f' % self._schedule.rate_at(elapsed),
+                                (self.bytes_written - reported_bytes) / 1024.0 / self.REPORT_INTERVAL)
+                    reported_lines, reported_bytes = self.lines_written, self.bytes_written
+                    report_at += self.REPORT_INTERVAL
+                if self._schedule is None:
+                    count = self._burst
+                else:
+                    count = int(self._schedule.lines_due(elapsed)) - self.lines_written
+                if count < self._burst:
+                    due = self._schedule.time_due(self.lines_written + self._burst)
+                    wakeup = report_at if due is None else min(start + due, report_at)
+                    if self._duration:
+                        wakeup = min(wakeup, start + self._duration)
+                    time.sleep(max(wakeup - time.time(), 0))
+                    continue
+                self.write_lines(min(count, max(self._burst, self.MAX_WRITE_LINES)))
+        except KeyboardInterrupt:
+            pass
+        stats = self.get_stats(time.time() - start)
+        LOGGER.info('Wrote %i lines and %i bytes in %0.1f s: %0.1f lines/s, %0.1f kB/s',
+                    stats['lines'], stats['bytes'], stats['seconds'],
+                    stats['lines_per_second'], stats['bytes_per_second'] / 1024.0)
+        return stats
+
+    def close(self):
+        for fd in self._ports:
+            os.close(fd)
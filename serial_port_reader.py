@@ -1,37 +1,110 @@
+import re
+import glob
+import time
 import serial
 import logging
 
+from collections import deque
+from serial_capture import SerialCaptureWriter
+from serial_data_codec import get_codec
+
 LOGGER = logging.getLogger(__name__)
 
+def get_device_id(port):
+    # Device id is used as a routing key word, so it must not contain dots
+    if port.startswith('/dev/'):
+        port = port[len('/dev/'):]
+    return re.sub(r'[^A-Za-z0-9_-]', '_', port)
+
+def parse_port_list(ports):
+    # 'port[=device_id],...' where port may be a glob like /dev/ttyUSB*
+    parsed = []
+    for item in ports.split(','):
+        port, _, device_id = item.strip().partition('=')
+        if not port:
+            continue
+        if glob.has_magic(port):
+            matches = sorted(glob.glob(port))
+            if not matches:
+                LOGGER.warning('No serial ports match %s', port)
+            parsed.extend((match, get_device_id(match)) for match in matches)
+        else:
+            parsed.append((port, get_device_id(device_id or port)))
+    return parsed
+
 class SerialPortReader(object):
 
-    def __init__(self):
+    def __init__(self, codec=None):
         self.serial_port = None
         self.serial_port_name = ''
-        self.output = ''
-        self.CRLF = False
+        self.device_id = ''
+        # When the frames of the last read were completed
+        self.last_read_time = None
+        self.codec = codec or get_codec()
+        self.scanner = self.codec.new_scanner()
+        self._frames = deque()
+        self._capture = None
 
-    def open(self, port="/dev/pts/4"):
+    def open(self, port="/dev/pts/4", device_id=None):
         self.serial_port = serial.Serial(port, 9600, rtscts=True,dsrdtr=True)
         self.serial_port_name = port
+        self.device_id = get_device_id(device_id or port)
         LOGGER.info('Started reading output from port: %s', self.serial_port_name)
 
+    def reopen(self):
+        # After a hangup, the partial frame read before it is dropped
+        try:
+            self.serial_port.close()
+        except (IOError, OSError):
+            pass
+        self.scanner.reset()
+        self.open(self.serial_port_name, self.device_id)
+
+    def start_capture(self, path):
+        # Records raw bytes with their read time, see serial_capture
+        self._capture = SerialCaptureWriter(path, self.codec.name, self.serial_port_name, self.device_id)
+
+    def stop_capture(self):
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
     def stop(self):
+        self.stop_capture()
         self.serial_port.close()
 
+    def read_pending(self):
+        # Blocks for the first byte only, then drains whatever the driver has.
+        # A read without data is a hung up port and raises SerialException,
+        # an IOError, like a port that fails to read.
+        pending = self.serial_port.in_waiting
+        data = self.serial_port.read(pending or 1)
+        if not data:
+            raise serial.SerialException('Port %s returned no data' % self.serial_port_name)
+        self.last_read_time = time.time()
+        if self._capture is not None:
+            self._capture.write(data, self.last_read_time)
+        return data
+
+    def frames(self):
+        while True:
+            if not self._frames:
+                self._frames.extend(self.scanner.feed(self.read_pending()))
+            while self._frames:
+                yield self._frames.popleft()
+
+    def fileno(self):
+        return self.serial_port.fileno()
+
+    def read_frames(self):
+        # Non-blocking, for use when the port is known to be readable
+        return self.scanner.feed(self.read_pending())
+
     def read(self):
-        self.output += self.serial_port.read(1)
-        output_list = self.output.split(' ')
-
-        for index, value in enumerate(output_list):
-            if index >= 1 and value == '10' and output_list[index-1] == '13':
-                if self.CRLF:
-                    message = ' '.join(element for element in output_list if element)
-                    LOGGER.debug('Read complete line: %s', message)
-                    self.CRLF = True
-                    del output_list[:]
-                    self.output = ''
-                    return message
-                self.CRLF = True
-                del output_list[:]
-                self.output = ''
+        if not self._frames:
+            self._frames.extend(self.scanner.feed(self.read_pending()))
+        if self._frames:
+            return self._frames.popleft()
+
+    def get_counters(self):
+        return self.scanner.get_counters()
@@ -3,7 +3,11 @@ import argparse
 import logging
 
 from serial_data import SerialData
+from serial_data_codec import get_codec, CODECS, DEFAULT_CODEC
+from serial_data_metrics import PayloadLogSampler
+from serial_data_schema import SerialDataSchemaFramer
 from serial_data_utils import SerialDataUtils
+from serial_load_generator import SerialLoadGenerator, SerialLoadSchedule, build_load_payloads
 
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
                 '-35s %(lineno) -5d: %(message)s')
@@ -19,20 +23,28 @@ class SerialPortWriter(object):
 
     utils = SerialDataUtils()
 
-    def __init__(self, port, interval, serial_data):
+    def __init__(self, port, interval, serial_data, codec=None, schema_framer=None, log_sample=100):
         self._serial_port_name = port
         self._serial_port = open(port, "w+")
         self._serial_data = serial_data
         self._interval = float(interval)
+        self._codec = codec or get_codec()
+        self._schema_framer = schema_framer
+        self._payload_log = PayloadLogSampler(LOGGER, log_sample)
 
     def run(self):
         LOGGER.info('Started writing serial data to port: %s', self._serial_port_name)
         while True:
-            mock_data = self.utils.generate_mock_data()
-            self._serial_data.set_message(mock_data)
-            self._serial_data.parse_csv_to_string().parse_string_to_ascii()
-            LOGGER.info('%s', self._serial_data.message)
-            self._serial_port.write(self._serial_data.message)
+            if self._schema_framer:
+                rows = self._schema_framer.frame(self.utils.generate_mock_headings(),
+                                                 self.utils.generate_mock_values())
+            else:
+                rows = [self.utils.generate_mock_data()]
+            for mock_data in rows:
+                self._serial_data.set_message(mock_data)
+                self._serial_data.parse_csv_to_string().parse_string_to_wire(self._codec)
+                self._payload_log.log('%s', self._serial_data.message)
+                self._serial_port.write(self._serial_data.message)
             time.sleep(self._interval)
 
 def main():
@@ -42,6 +54,18 @@ def main():
     parser.add_argument("-l", "--logging", action="store", dest="logging_level", help="Set logging level for Serial Data Writer", default="info")
     parser.add_argument("-p", "--port", action="store", dest="serial_port", help="Set serial port to write data", default="/dev/pts/3")
     parser.add_argument("-i", "--interval", action="store", dest="interval", help="Set interval for writing to serial port", default="10")
+    parser.add_argument("--schema", action="store_true", dest="schema", help="Send heading row once as a schema and only schema id with values on data lines")
+    parser.add_argument("--schema_interval", action="store", dest="schema_interval", help="Set number of data lines between schema resends", default="100")
+    parser.add_argument("--codec", action="store", dest="codec", choices=sorted(CODECS), help="Set wire encoding of serial lines", default=DEFAULT_CODEC)
+    parser.add_argument("--log_sample", action="store", dest="log_sample", help="Log every nth line at debug level", default="100")
+    parser.add_argument("--rate", action="store", dest="rate", help="Generate load at this many lines per second over all ports, 0 for as fast as possible. Port may be a comma separated list")
+    parser.add_argument("--devices", action="store", dest="devices", help="Set number of simulated device ids in load mode", default="1")
+    parser.add_argument("--burst", action="store", dest="burst", help="Set number of lines written at once in load mode", default="1")
+    parser.add_argument("--ramp_to", action="store", dest="ramp_to", help="Set rate reached at the end of the ramp in load mode")
+    parser.add_argument("--ramp_seconds", action="store", dest="ramp_seconds", help="Set length of the rate ramp in seconds", default="0")
+    parser.add_argument("--duration", action="store", dest="duration", help="Set seconds to generate load, 0 to run until interrupted", default="0")
+    parser.add_argument("--seed", action="store", dest="seed", type=int, help="Set seed of generated values in load mode", default=0)
+    parser.add_argument("--variants", action="store", dest="variants", help="Set number of precomputed lines per device in load mode", default="100")
 
     args = parser.parse_args()
     level = LEVELS.get(args.logging_level, logging.NOTSET)
@@ -50,8 +74,22 @@ def main():
     logging.debug('Using debug logging ...')
     logging.info('Using info logging ...')
 
+    if args.rate is not None:
+        ports = [port.strip() for port in args.serial_port.split(',') if port.strip()]
+        payloads = build_load_payloads(len(ports), args.devices, args.variants, args.seed,
+                                       get_codec(args.codec), args.schema, args.schema_interval)
+        schedule = None
+        if float(args.rate) > 0 or args.ramp_to is not None:
+            schedule = SerialLoadSchedule(args.rate, args.ramp_to, args.ramp_seconds)
+        load_generator = SerialLoadGenerator(ports, payloads, schedule, args.burst, args.duration)
+        load_generator.run()
+        load_generator.close()
+        return
+
     serial_data = SerialData()
-    serial_port_writer = SerialPortWriter(args.serial_port, args.interval, serial_data)
+    schema_framer = SerialDataSchemaFramer(args.schema_interval) if args.schema else None
+    serial_port_writer = SerialPortWriter(args.serial_port, args.interval, serial_data,
+                                          get_codec(args.codec), schema_framer, args.log_sample)
     serial_port_writer.run()
 
 if __name__ == '__main__':
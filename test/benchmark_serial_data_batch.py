@@ -0,0 +1,37 @@
+import sys, json, timeit
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+
+# Prints the average cost of one set_batch call per tenth of a full 128KB
+# batch. With O(1) accounting the numbers stay flat while the batch grows.
+
+def main():
+    with open(path.join(path.dirname(path.abspath(__file__)), 'mock_data.json')) as f:
+        message = json.dumps(json.load(f), separators=(',',':'))
+
+    serial_data = SerialData()
+    serial_data.set_message_max_size(serial_data.message_max_size_limit)
+    serial_data.set_message(message)
+    appends_per_batch = serial_data.message_max_size // (len(message) + 1)
+    step = max(appends_per_batch // 10, 1)
+    rounds = 50
+
+    totals = [0.0] * 10
+    for _ in range(rounds):
+        serial_data.clear_batch()
+        for decile in range(10):
+            start = timeit.default_timer()
+            for _ in range(step):
+                serial_data.set_batch()
+            totals[decile] += timeit.default_timer() - start
+        serial_data.get_batch()
+
+    print('appends per batch: %i' % appends_per_batch)
+    for decile, total in enumerate(totals):
+        print('fill %3i%%: %.3f us per append' % (decile * 10, total / (rounds * step) * 1e6))
+
+if __name__ == '__main__':
+    main()
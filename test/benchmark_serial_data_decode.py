@@ -0,0 +1,36 @@
+import sys, timeit
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_utils import SerialDataUtils
+
+# Compares decoding a backlog one message at a time with SerialData.decode_batch
+
+def main(count=10000, rounds=3):
+    utils = SerialDataUtils()
+    bodies = []
+    for _ in range(count):
+        serial_data = SerialData()
+        serial_data.set_message(utils.generate_mock_data())
+        bodies.append(serial_data.parse_csv_to_string().parse_string_to_ascii().message)
+
+    def scalar():
+        serial_data = SerialData()
+        messages = []
+        for body in bodies:
+            serial_data.set_message(body)
+            messages.append(serial_data.parse_ascii_to_string().parse_string_to_json().message)
+        return messages
+
+    def batch():
+        return SerialData().decode_batch(bodies)
+
+    assert scalar() == batch()
+    for name, decode in (('scalar', scalar), ('batch', batch)):
+        elapsed = min(timeit.repeat(decode, number=1, repeat=rounds))
+        print('%-6s %8.0f messages/s' % (name, count / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,607 @@
+import os
+import sys
+import pty
+import tty
+import json
+import time
+import heapq
+import Queue
+import select
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from collections import deque, OrderedDict
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_codec import get_codec, CODECS, DEFAULT_CODEC
+from serial_data_compression import METHODS as COMPRESSION_METHODS, decode_payload
+from serial_data_columnar import decode_columns
+from serial_data_consumer import SerialDataConsumer
+from serial_data_consumer_config import SerialDataConsumerConfig
+from serial_data_envelope import FRAMES_HEADER
+from serial_data_publisher import SerialDataPublisher
+from serial_load_generator import SerialLoadGenerator, SerialLoadSchedule, build_load_payloads
+from serial_port_reader import SerialPortReader
+
+# Runs writer, reader, publisher and consumer end to end on a pty pair. The
+# RabbitMQ broker and the AWS IoT client are replaced by in-process stand-ins
+# so only the code of this repository is measured. Results per mode go to a
+# JSON file so runs of different releases can be compared.
+
+LOGGER = logging.getLogger(__name__)
+
+READ = 1 # pika.adapters.select_connection.READ
+
+# Scanner of the ascii codec drops everything before the first CRLF
+SYNC = {'ascii': '13 10 '}
+
+MODES = OrderedDict([('single', {'batch_messages': 0}),
+                     ('batch', {'batch_messages': 10240}),
+                     ('adaptive', {'batch_messages': 10240, 'adaptive': True})])
+
+class FakeIOLoop(object):
+
+    # Single threaded epoll loop with the parts of the pika ioloop used by
+    # publisher and consumer. Publisher and consumer share one loop.
+
+    def __init__(self):
+        self._poller = select.epoll()
+        self._handlers = {}
+        self._timeouts = []
+        self._cancelled = set()
+        self._timeout_id = 0
+        self._callbacks = deque()
+        self._lock = threading.Lock()
+        self._wake_read, self._wake_write = os.pipe()
+        self._poller.register(self._wake_read, select.EPOLLIN)
+        self._running = False
+
+    def add_handler(self, fd, handler, events):
+        self._handlers[fd] = handler
+        self._poller.register(fd, select.EPOLLIN)
+
+    def remove_handler(self, fd):
+        del self._handlers[fd]
+        self._poller.unregister(fd)
+
+    def add_timeout(self, delay, callback):
+        self._timeout_id += 1
+        heapq.heappush(self._timeouts, (time.time() + delay, self._timeout_id, callback))
+        return self._timeout_id
+
+    def remove_timeout(self, timeout_id):
+        self._cancelled.add(timeout_id)
+
+    def add_callback(self, callback):
+        self.add_callback_threadsafe(callback)
+
+    def add_callback_threadsafe(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        os.write(self._wake_write, b'x')
+
+    def start(self):
+        self._running = True
+        while self._running:
+            with self._lock:
+                callbacks, self._callbacks = self._callbacks, deque()
+            for callback in callbacks:
+                callback()
+            now = time.time()
+            while self._timeouts and self._timeouts[0][0] <= now:
+                _, timeout_id, callback = heapq.heappop(self._timeouts)
+                if timeout_id in self._cancelled:
+                    self._cancelled.discard(timeout_id)
+                else:
+                    callback()
+            timeout = 1.0
+            if self._callbacks:
+                timeout = 0
+            elif self._timeouts:
+                timeout = max(min(self._timeouts[0][0] - time.time(), timeout), 0)
+            for fd, events in self._poller.poll(timeout):
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                elif fd in self._handlers:
+                    self._handlers[fd](fd, READ)
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        self._poller.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+class FakeMethod(object):
+
+    def __init__(self, name, delivery_tag=0, multiple=False, message_count=0):
+        self.NAME = name
+        self.delivery_tag = delivery_tag
+        self.multiple = multiple
+        self.message_count = message_count
+
+class FakeFrame(object):
+
+    def __init__(self, method):
+        self.method = method
+
+def topic_matches(binding, routing_key):
+    return _match_words(binding.split('.'), routing_key.split('.'))
+
+def _match_words(binding, words):
+    if not binding:
+        return not words
+    if binding[0] == '#':
+        return any(_match_words(binding[1:], words[index:]) for index in range(len(words) + 1))
+    if not words or binding[0] not in ('*', words[0]):
+        return False
+    return _match_words(binding[1:], words[1:])
+
+class FakeBroker(object):
+
+    # One topic exchange and the queues bound to it, with publisher confirms,
+    # prefetch and acks. Records when every message was published, delivered
+    # and acknowledged, and which serial lines a message carries.
+
+    def __init__(self, ioloop):
+        self.ioloop = ioloop
+        self.bindings = []
+        self.queues = {}
+        self.consumers = {}
+        self.published = 0
+        self.unroutable = 0
+        self.publish_times = {}
+        self.deliver_times = {}
+        self.ack_times = {}
+        # Message index -> (first line, number of lines)
+        self.lines = {}
+        self.lines_published = 0
+        self._dispatch_scheduled = False
+
+    def publish(self, routing_key, body, properties):
+        index = self.published
+        self.published += 1
+        self.publish_times[index] = time.time()
+        frames = (properties.headers or {}).get(FRAMES_HEADER, 1) if properties else 1
+        self.lines[index] = (self.lines_published, frames)
+        self.lines_published += frames
+        queues = set(queue for queue, binding in self.bindings if topic_matches(binding, routing_key))
+        if not queues:
+            self.unroutable += 1
+        for queue in queues:
+            self.queues[queue].append((index, body, properties))
+        self.schedule_dispatch()
+
+    def schedule_dispatch(self):
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            self.ioloop.add_callback(self.dispatch)
+
+    def dispatch(self):
+        self._dispatch_scheduled = False
+        for queue, channel in self.consumers.items():
+            messages = self.queues[queue]
+            while messages and channel.is_open and (
+                    not channel.prefetch_count or len(channel.unacked) < channel.prefetch_count):
+                index, body, properties = messages.popleft()
+                self.deliver_times.setdefault(index, time.time())
+                channel.deliver(queue, index, body, properties)
+
+    def get_line_times(self, times):
+        # Message times as times of the lines in the message
+        line_times = {}
+        for index, recorded in times.items():
+            first_line, count = self.lines[index]
+            for line in range(first_line, first_line + count):
+                line_times[line] = recorded
+        return line_times
+
+    def acknowledge(self, indexes):
+        now = time.time()
+        for index in indexes:
+            self.ack_times[index] = now
+        self.schedule_dispatch()
+
+    def requeue(self, queue, messages):
+        self.queues[queue].extendleft(reversed(messages))
+        self.schedule_dispatch()
+
+class FakeChannel(object):
+
+    def __init__(self, connection, broker):
+        self._connection = connection
+        self._broker = broker
+        self._close_callbacks = []
+        self._confirm_callback = None
+        self._confirm_scheduled = False
+        self._publish_tag = 0
+        self._deliver_tag = 0
+        self._on_message = None
+        self.prefetch_count = 0
+        self.unacked = OrderedDict()
+        self.is_open = True
+
+    def __int__(self):
+        return 1
+
+    def _reply(self, callback, name='Ok', message_count=0):
+        if callback is not None:
+            method = FakeMethod(name, message_count=message_count)
+            self._broker.ioloop.add_callback(lambda: callback(FakeFrame(method)))
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def exchange_declare(self, callback, exchange, exchange_type):
+        self._reply(callback)
+
+    def queue_declare(self, callback, queue, passive=False):
+        self._broker.queues.setdefault(queue, deque())
+        self._reply(callback, message_count=len(self._broker.queues[queue]))
+
+    def queue_bind(self, callback, queue, exchange, routing_key):
+        if (queue, routing_key) not in self._broker.bindings:
+            self._broker.bindings.append((queue, routing_key))
+        self._reply(callback)
+
+    def confirm_delivery(self, callback):
+        self._confirm_callback = callback
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self._broker.publish(routing_key, body, properties)
+        if self._confirm_callback is not None:
+            self._publish_tag += 1
+            if not self._confirm_scheduled:
+                # RabbitMQ confirms everything written so far with one ack
+                self._confirm_scheduled = True
+                self._broker.ioloop.add_callback(self._confirm)
+
+    def _confirm(self):
+        self._confirm_scheduled = False
+        self._confirm_callback(FakeFrame(FakeMethod('Basic.Ack', self._publish_tag, True)))
+
+    def basic_qos(self, callback, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+        self._reply(callback)
+
+    def basic_consume(self, on_message, queue):
+        self._on_message = on_message
+        self._broker.consumers[queue] = self
+        self._broker.schedule_dispatch()
+        return 'ctag1'
+
+    def deliver(self, queue, index, body, properties):
+        self._deliver_tag += 1
+        self.unacked[self._deliver_tag] = (queue, index, body, properties)
+        self._on_message(self, FakeMethod('Basic.Deliver', self._deliver_tag), properties, body)
+
+    def _settle(self, delivery_tag, multiple):
+        if not multiple:
+            message = self.unacked.pop(delivery_tag, None)
+            return [message] if message is not None else []
+        settled = []
+        while self.unacked and next(iter(self.unacked)) <= delivery_tag:
+            settled.append(self.unacked.popitem(last=False)[1])
+        return settled
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._broker.acknowledge([index for _, index, _, _ in self._settle(delivery_tag, multiple)])
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        for queue, index, body, properties in self._settle(delivery_tag, multiple):
+            if requeue:
+                self._broker.requeue(queue, [(index, body, properties)])
+
+    def basic_cancel(self, consumer_tag):
+        for queue, channel in list(self._broker.consumers.items()):
+            if channel is self:
+                del self._broker.consumers[queue]
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.basic_cancel(None)
+        for queue, index, body, properties in self.unacked.values():
+            self._broker.requeue(queue, [(index, body, properties)])
+        self.unacked.clear()
+        for callback in self._close_callbacks:
+            self._broker.ioloop.add_callback(lambda callback=callback: callback(self, 200, 'Normal shutdown'))
+
+class FakeConnection(object):
+
+    def __init__(self, ioloop, broker, on_open_callback, on_close_callback=None):
+        self.ioloop = ioloop
+        self._broker = broker
+        self._close_callbacks = [on_close_callback] if on_close_callback else []
+        self.is_open = True
+        self.is_closed = False
+        ioloop.add_callback(lambda: on_open_callback(self))
+
+    def add_on_close_callback(self, callback):
+        self._close_callbacks.append(callback)
+
+    def add_timeout(self, delay, callback):
+        return self.ioloop.add_timeout(delay, callback)
+
+    def remove_timeout(self, timeout_id):
+        self.ioloop.remove_timeout(timeout_id)
+
+    def channel(self, on_open_callback):
+        channel = FakeChannel(self, self._broker)
+        self.ioloop.add_callback(lambda: on_open_callback(channel))
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_open = False
+        self.is_closed = True
+        for callback in self._close_callbacks:
+            self.ioloop.add_callback(lambda callback=callback: callback(self, 200, 'Normal shutdown'))
+
+class FakeIoTClient(object):
+
+    # Stands in for AWSIoTMQTTClient.publishAsync. PUBACKs come from another
+    # thread after puback_latency seconds, like the MQTT client thread does.
+
+    def __init__(self, puback_latency=0.005):
+        self._puback_latency = float(puback_latency)
+        self._pubacks = Queue.Queue()
+        self._mid = 0
+        self.messages = 0
+        self.payloads = 0
+        self.bytes = 0
+        self.publish_times = {}
+        self._thread = threading.Thread(target=self.run_pubacks, name='FakeIoTClient')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publishAsync(self, topic, payload, QoS, ackCallback=None):
+        now = time.time()
+        self._mid += 1
+        self.bytes += len(payload)
+        payload = decode_columns(decode_payload(payload))
+        # Batches are JSON arrays of flat objects
+        count = payload.count('},{') + 1 if payload.startswith('[') else 1
+        for index in range(self.messages, self.messages + count):
+            self.publish_times[index] = now
+        self.messages += count
+        self.payloads += 1
+        if ackCallback is not None:
+            self._pubacks.put((now + self._puback_latency, self._mid, ackCallback))
+        return self._mid
+
+    def run_pubacks(self):
+        while True:
+            due, mid, callback = self._pubacks.get()
+            if callback is None:
+                break
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            callback(mid)
+
+    def close(self):
+        self._pubacks.put((0, 0, None))
+        self._thread.join()
+
+class TimedLoadGenerator(SerialLoadGenerator):
+
+    def __init__(self, *args, **kwargs):
+        SerialLoadGenerator.__init__(self, *args, **kwargs)
+        self.write_times = []
+
+    def write_lines(self, count):
+        self.write_times.append((self.lines_written, count, time.time()))
+        SerialLoadGenerator.write_lines(self, count)
+
+    def get_write_times(self):
+        times = {}
+        for first_line, count, written in self.write_times:
+            for line in range(first_line, first_line + count):
+                times[line] = written
+        return times
+
+def open_ptys(directory):
+    # Linked ptys like in the readme when socat is installed, else two pty
+    # pairs joined by a relay thread. Returns writer port, reader port and a
+    # function that closes them.
+    writer_port = path.join(directory, 'writer')
+    reader_port = path.join(directory, 'reader')
+    try:
+        socat = subprocess.Popen(['socat', 'pty,raw,echo=0,link=' + writer_port,
+                                  'pty,raw,echo=0,link=' + reader_port])
+    except OSError:
+        socat = None
+    if socat is not None:
+        deadline = time.time() + 5
+        while not (path.exists(writer_port) and path.exists(reader_port)):
+            if time.time() > deadline or socat.poll() is not None:
+                raise RuntimeError('socat did not create the ptys')
+            time.sleep(0.01)
+        def close():
+            socat.terminate()
+            socat.wait()
+        return writer_port, reader_port, close
+
+    writer_master, writer_slave = pty.openpty()
+    reader_master, reader_slave = pty.openpty()
+    for fd in (writer_slave, reader_slave):
+        tty.setraw(fd)
+    stopping = threading.Event()
+    def relay():
+        while not stopping.is_set():
+            if select.select([writer_master], [], [], 0.1)[0]:
+                data = os.read(writer_master, 65536)
+                while data:
+                    data = data[os.write(reader_master, data):]
+    relay_thread = threading.Thread(target=relay, name='PtyRelay')
+    relay_thread.daemon = True
+    relay_thread.start()
+    def close():
+        stopping.set()
+        relay_thread.join()
+        for fd in (writer_master, writer_slave, reader_master, reader_slave):
+            os.close(fd)
+    return os.ttyname(writer_slave), os.ttyname(reader_slave), close
+
+def percentiles(start_times, end_times):
+    latencies = sorted(end_times[index] - start_times[index]
+                       for index in end_times if index in start_times)
+    if not latencies:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None}
+    return {'count': len(latencies),
+            'p50_ms': latencies[int(0.50 * (len(latencies) - 1))] * 1000,
+            'p99_ms': latencies[int(0.99 * (len(latencies) - 1))] * 1000}
+
+def run_mode(mode, batch_messages, settings, adaptive=False):
+    LOGGER.info('Running %s mode', mode)
+    codec = get_codec(settings['codec'])
+    directory = tempfile.mkdtemp()
+    writer_port, reader_port, close_ptys = open_ptys(directory)
+    ioloop = FakeIOLoop()
+    broker = FakeBroker(ioloop)
+    iot_client = FakeIoTClient(settings['puback_latency'])
+    try:
+        serial_port = SerialPortReader(codec)
+        serial_port.open(reader_port, 'benchmark')
+        publisher = SerialDataPublisher('amqp://benchmark', [serial_port],
+                                        aggregate_frames=settings['aggregate_frames'],
+                                        aggregate_linger=settings['aggregate_ms'] / 1000.0)
+        config = SerialDataConsumerConfig(batch_messages=batch_messages,
+                                          batch_linger=settings['batch_linger'],
+                                          compress=settings['compress'],
+                                          batch_layout='columns' if settings['columnar'] else 'rows',
+                                          adaptive=adaptive,
+                                          adaptive_backlog=settings['adaptive_backlog'],
+                                          target_latency=settings['target_latency'])
+        consumer = SerialDataConsumer('amqp://benchmark', 'benchmark/topic', iot_client,
+                                      SerialData(), config)
+        publisher._connection = FakeConnection(ioloop, broker, publisher.on_connection_open,
+                                               publisher.on_connection_closed)
+        consumer._connection = FakeConnection(ioloop, broker, consumer.on_connection_open)
+
+        payloads = build_load_payloads(1, settings['devices'], settings['variants'],
+                                       settings['seed'], codec)
+        schedule = SerialLoadSchedule(settings['rate']) if settings['rate'] > 0 else None
+        writer = TimedLoadGenerator([writer_port], payloads, schedule,
+                                    settings['burst'], settings['duration'])
+        if codec.name in SYNC:
+            os.write(writer._ports[0], SYNC[codec.name])
+        writer_stats = {}
+        def write():
+            writer_stats.update(writer.run())
+        writer_thread = threading.Thread(target=write, name='Writer')
+
+        drain_deadline = [None]
+        def check_done():
+            if writer_thread.is_alive():
+                ioloop.add_timeout(0.1, check_done)
+                return
+            if drain_deadline[0] is None:
+                drain_deadline[0] = time.time() + settings['drain_timeout']
+            if (len(broker.get_line_times(broker.ack_times)) >= writer.lines_written or
+                    time.time() > drain_deadline[0]):
+                ioloop.stop()
+            else:
+                ioloop.add_timeout(0.1, check_done)
+
+        # Let the consumer subscribe before the first line is written
+        ioloop.add_timeout(0.2, writer_thread.start)
+        ioloop.add_timeout(0.3, check_done)
+        ioloop.start()
+        writer_thread.join()
+        publisher.stop_reading()
+        serial_port.stop()
+    finally:
+        iot_client.close()
+        ioloop.close()
+        close_ptys()
+        shutil.rmtree(directory)
+
+    write_times = writer.get_write_times()
+    publish_times = broker.get_line_times(broker.publish_times)
+    deliver_times = broker.get_line_times(broker.deliver_times)
+    ack_times = broker.get_line_times(broker.ack_times)
+    delivered = len(ack_times)
+    first_write = min(write_times.values()) if write_times else 0
+    last_ack = max(ack_times.values()) if ack_times else first_write
+    elapsed = max(last_ack - first_write, 1e-9)
+    if delivered < writer.lines_written:
+        LOGGER.warning('Only %i of %i lines were acknowledged', delivered, writer.lines_written)
+    result = {'lines_written': writer.lines_written,
+              'messages_delivered': delivered,
+              'amqp_messages': broker.published,
+              'iot_publishes': iot_client.payloads,
+              'seconds': elapsed,
+              'messages_per_second': delivered / elapsed,
+              'serial_bytes_per_second': writer_stats.get('bytes', 0) / elapsed,
+              'iot_bytes_per_second': iot_client.bytes / elapsed,
+              'writer_lines_per_second': writer_stats.get('lines_per_second', 0),
+              'reader': serial_port.get_counters(),
+              'publisher_metrics': publisher.metrics.snapshot(),
+              'consumer_metrics': consumer.metrics.snapshot(),
+              'latency': OrderedDict([
+                  ('serial', percentiles(write_times, publish_times)),
+                  ('broker', percentiles(publish_times, deliver_times)),
+                  ('consumer', percentiles(deliver_times, iot_client.publish_times)),
+                  ('puback', percentiles(iot_client.publish_times, ack_times)),
+                  ('end_to_end', percentiles(write_times, ack_times))])}
+    if consumer._batch_controller is not None:
+        result['batch_control'] = list(consumer._batch_controller.decisions)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", action="store", dest="output", help="Set file for the JSON results", default="benchmark_results.json")
+    parser.add_argument("--modes", action="store", dest="modes", help="Set comma separated modes to run", default=','.join(MODES))
+    parser.add_argument("--rate", action="store", dest="rate", type=float, help="Set lines per second written, 0 for as fast as possible", default=1000)
+    parser.add_argument("--duration", action="store", dest="duration", type=float, help="Set seconds to write in each mode", default=5)
+    parser.add_argument("--burst", action="store", dest="burst", type=int, help="Set number of lines written at once", default=1)
+    parser.add_argument("--devices", action="store", dest="devices", type=int, help="Set number of simulated device ids", default=4)
+    parser.add_argument("--variants", action="store", dest="variants", type=int, help="Set number of precomputed lines per device", default=100)
+    parser.add_argument("--seed", action="store", dest="seed", type=int, help="Set seed of generated values", default=0)
+    parser.add_argument("--codec", action="store", dest="codec", choices=sorted(CODECS), help="Set wire encoding of serial lines", default=DEFAULT_CODEC)
+    parser.add_argument("--compress", action="store", dest="compress", choices=['none'] + sorted(COMPRESSION_METHODS), help="Set compression of batch payloads", default="none")
+    parser.add_argument("--columnar", action="store_true", dest="columnar", help="Send batches in columnar layout")
+    parser.add_argument("--aggregate_frames", action="store", dest="aggregate_frames", type=int, help="Set max number of serial lines the publisher packs into one message, 0 for one per line", default=0)
+    parser.add_argument("--aggregate_ms", action="store", dest="aggregate_ms", type=float, help="Set max milliseconds a line waits to be packed with others", default=50)
+    parser.add_argument("--adaptive_backlog", action="store", dest="adaptive_backlog", type=int, help="Set queue depth above which adaptive mode grows batches", default=1000)
+    parser.add_argument("--target_latency", action="store", dest="target_latency", type=float, help="Set PUBACK latency below which adaptive mode shrinks batches", default=0.5)
+    parser.add_argument("--batch_linger", action="store", dest="batch_linger", type=float, help="Set max seconds a partial batch waits", default=0.05)
+    parser.add_argument("--puback_latency", action="store", dest="puback_latency", type=float, help="Set seconds before the fake IoT client sends PUBACK", default=0.005)
+    parser.add_argument("--drain_timeout", action="store", dest="drain_timeout", type=float, help="Set max seconds to wait for acks after writing stops", default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    LOGGER.setLevel(logging.INFO)
+
+    settings = dict(vars(args))
+    del settings['output'], settings['modes']
+    results = OrderedDict()
+    for mode in args.modes.split(','):
+        results[mode] = run_mode(mode, MODES[mode]['batch_messages'], settings,
+                                 MODES[mode].get('adaptive', False))
+        print('%-6s %8.0f messages/s %10.0f serial bytes/s  end to end p50 %7.2f ms p99 %7.2f ms' %
+              (mode, results[mode]['messages_per_second'], results[mode]['serial_bytes_per_second'],
+               results[mode]['latency']['end_to_end']['p50_ms'] or 0,
+               results[mode]['latency']['end_to_end']['p99_ms'] or 0))
+
+    report = OrderedDict([('started', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('python', platform.python_version()),
+                          ('platform', platform.platform()),
+                          ('settings', settings),
+                          ('results', results)])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to %s' % args.output)
+
+if __name__ == '__main__':
+    main()
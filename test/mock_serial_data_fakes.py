@@ -0,0 +1,153 @@
+import sys
+
+from collections import OrderedDict
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_consumer import SerialDataConsumer
+from serial_data_consumer_config import SerialDataConsumerConfig
+
+# Stand-ins for the pika connection and channel and the AWS IoT client, so
+# consumer tests run without RabbitMQ or AWS IoT
+
+class FakeIOLoop(object):
+
+    # Runs callbacks of other threads right away, or keeps them in callbacks
+    # when deferred
+
+    def __init__(self, deferred=False):
+        self.deferred = deferred
+        self.callbacks = []
+        # fd -> handler
+        self.handlers = {}
+
+    def add_callback_threadsafe(self, callback):
+        if self.deferred:
+            self.callbacks.append(callback)
+        else:
+            callback()
+
+    def add_handler(self, fd, handler, events):
+        self.handlers[fd] = handler
+
+    def remove_handler(self, fd):
+        del self.handlers[fd]
+
+    def stop(self):
+        pass
+
+class FakeConnection(object):
+
+    def __init__(self, deferred=False):
+        self.ioloop = FakeIOLoop(deferred)
+        # Handle -> (delay, callback)
+        self.timeouts = OrderedDict()
+        self.closed = False
+        self._handle = 0
+
+    def add_timeout(self, deadline, callback):
+        self._handle += 1
+        self.timeouts[self._handle] = (deadline, callback)
+        return self._handle
+
+    def remove_timeout(self, handle):
+        self.timeouts.pop(handle, None)
+
+    def run_timeouts(self):
+        # Runs the timeouts added so far as if their delays were over
+        for handle in list(self.timeouts):
+            timeout = self.timeouts.pop(handle, None)
+            if timeout is not None:
+                timeout[1]()
+
+    def close(self):
+        self.closed = True
+
+class FakeChannel(object):
+
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+        self.consumes = 0
+        self.cancels = []
+        self.published = []
+        self.is_open = True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacks.append(delivery_tag)
+
+    def basic_consume(self, callback, queue):
+        self.consumes += 1
+        return 'ctag%i' % self.consumes
+
+    def basic_cancel(self, callback=None, consumer_tag='', nowait=False):
+        self.cancels.append(consumer_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append(body)
+
+class FakeIoTClient(object):
+
+    # Publishes get mids 1, 2, ... A failing client refuses to connect and
+    # publish, fail_after makes it fail after that many publishes. A queued
+    # client answers publishes like the SDK does with its offline queue.
+
+    QUEUED_MID = 'QUEUED'
+
+    def __init__(self, fail_after=None, failing=False):
+        self.queued = False
+        self.payloads = []
+        self.callbacks = []
+        self.fail_after = fail_after
+        self.failing = failing
+        self.connack = None
+        self.subscriptions = []
+
+    def connectAsync(self, keepAliveIntervalSecond=600, ackCallback=None):
+        if self.failing:
+            raise IOError('Connection refused')
+        self.connack = ackCallback
+
+    def subscribeAsync(self, topic, QoS, ackCallback=None, messageCallback=None):
+        self.subscriptions.append(topic)
+
+    def publishAsync(self, topic, payload, QoS, ackCallback=None):
+        if self.failing or (self.fail_after is not None and len(self.payloads) >= self.fail_after):
+            raise IOError('Client is offline')
+        if self.queued:
+            return self.QUEUED_MID
+        self.payloads.append(payload)
+        self.callbacks.append(ackCallback)
+        return len(self.payloads)
+
+    def puback_all(self):
+        for mid, callback in enumerate(self.callbacks, 1):
+            if callback is not None:
+                callback(mid)
+        self.callbacks = [None] * len(self.callbacks)
+
+class FakeDeliver(object):
+
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+class FakeProperties(object):
+
+    def __init__(self, headers=None):
+        self.app_id = 'test'
+        self.headers = headers
+
+def build_consumer(iot_client, batch_messages=0, serial_data=None, spool=None, **options):
+    consumer = SerialDataConsumer('amqp://test', 'test/topic', iot_client, serial_data or SerialData(),
+                                  SerialDataConsumerConfig(batch_messages=batch_messages, **options),
+                                  spool)
+    consumer._connection = FakeConnection()
+    consumer._channel = FakeChannel()
+    return consumer
+
+def deliver(consumer, delivery_tag, body, headers=None):
+    consumer.on_message(None, FakeDeliver(delivery_tag), FakeProperties(headers or {}), body)
@@ -1,4 +1,9 @@
-from serial_port_reader import SerialPortReade
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_port_reader import SerialPortReader
 
 import pika
 import socket
@@ -14,7 +19,7 @@ mqchannel.queue_declare(queue='serial_data')
 while True:
     message = False
     while not message:
-        message = self._serial_port.read()
+        message = serial_port.read()
     mqchannel.basic_publish(exchange='',
                           routing_key='serial_data',
                           body=message)
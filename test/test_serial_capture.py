@@ -0,0 +1,123 @@
+import unittest
+import sys
+import os
+import time
+import select
+import shutil
+import tempfile
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_capture import SerialCaptureWriter, SerialCaptureReplay, read_capture, iter_records
+from serial_data_codec import get_codec
+from serial_port_reader import SerialPortReader
+
+LINES = ['%i,%i\r\n' % (number, number * 7) for number in range(20)]
+
+class SerialCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dev0.scap')
+        self.codec = get_codec('ascii')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_capture(self, interval):
+        writer = SerialCaptureWriter(self.path, 'ascii', '/dev/pts/4', 'dev0')
+        # Scanner drops data before the first line end, like a port opened mid-line
+        writer.write(self.codec.encode('\r\n'), 1000.0)
+        for number, line in enumerate(LINES):
+            writer.write(self.codec.encode(line), 1000.0 + (number + 1) * interval)
+        writer.close()
+
+    def replay_all(self, replay, timeout=5):
+        frames = []
+        deadline = time.time() + timeout
+        while not replay.finished and time.time() < deadline:
+            select.select([replay], [], [], deadline - time.time())
+            frames.extend(replay.read_frames())
+        return frames
+
+    def decode(self, frames):
+        return [self.codec.decode(frame) for frame in frames]
+
+    def test_should_replay_captured_frames_at_max_speed(self):
+        self.write_capture(interval=10)
+        replay = SerialCaptureReplay(self.path, speed=0)
+        try:
+            self.assertEqual(replay.device_id, 'dev0')
+            self.assertEqual(replay.codec.name, 'ascii')
+            self.assertEqual(self.decode(self.replay_all(replay, timeout=1)), LINES)
+        finally:
+            replay.stop()
+
+    def test_should_keep_captured_pace_scaled_by_speed(self):
+        self.write_capture(interval=0.05)
+        replay = SerialCaptureReplay(self.path, speed=5)
+        try:
+            started = time.time()
+            first = replay.read_frames()
+            self.assertEqual(first, [])
+            frames = self.replay_all(replay)
+            elapsed = time.time() - started
+        finally:
+            replay.stop()
+        self.assertEqual(self.decode(frames), LINES)
+        # 20 lines 10 ms apart after scaling
+        self.assertGreater(elapsed, 0.18)
+        self.assertLess(elapsed, 1.0)
+
+    def test_should_start_over_when_looping(self):
+        self.write_capture(interval=0.001)
+        replay = SerialCaptureReplay(self.path, speed=0, loop=True)
+        try:
+            frames = []
+            while len(frames) <= 2 * len(LINES):
+                select.select([replay], [], [], 1)
+                frames.extend(replay.read_frames())
+        finally:
+            replay.stop()
+        # Line end the capture starts with is an empty line the second time
+        self.assertEqual(self.decode(frames[:2 * len(LINES) + 1]), LINES + ['\r\n'] + LINES)
+        self.assertFalse(replay.finished)
+
+    def test_should_ignore_truncated_last_record(self):
+        self.write_capture(interval=1)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        metadata, offset = read_capture(data)
+        self.assertEqual(metadata['port'], '/dev/pts/4')
+        self.assertEqual(len(list(iter_records(data, offset))), len(LINES))
+
+    def test_should_capture_bytes_read_from_port(self):
+        master, slave = os.openpty()
+        reader = SerialPortReader(self.codec)
+        reader.open(os.ttyname(slave), 'dev0')
+        reader.start_capture(self.path)
+        try:
+            data = self.codec.encode('\r\n' + LINES[0])
+            os.write(master, data)
+            deadline = time.time() + 2
+            frames = []
+            while not frames and time.time() < deadline:
+                select.select([reader], [], [], 0.1)
+                frames = reader.read_frames()
+        finally:
+            reader.stop()
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(self.decode(frames), [LINES[0]])
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        metadata, offset = read_capture(data)
+        self.assertEqual((metadata['codec'], metadata['device']), ('ascii', 'dev0'))
+        captured = ''.join(chunk for _, chunk, _ in iter_records(data, offset))
+        self.assertEqual(captured, self.codec.encode('\r\n' + LINES[0]))
+
+if __name__ == '__main__':
+    unittest.main()
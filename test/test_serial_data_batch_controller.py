@@ -0,0 +1,67 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_batch_controller import SerialDataBatchController
+from serial_data_metrics import SerialDataMetrics
+
+class SerialDataBatchControllerTest(unittest.TestCase):
+
+    def build_controller(self, **kwargs):
+        settings = dict(batch_bytes=10240, linger=0.5, min_bytes=1024, max_bytes=131072,
+                        min_linger=0.05, max_linger=2.0, target_latency=0.5, backlog=1000)
+        settings.update(kwargs)
+        return SerialDataBatchController(**settings)
+
+    def test_should_grow_up_to_max_while_backlog_builds(self):
+        controller = self.build_controller()
+        self.assertTrue(controller.update(5000))
+        self.assertEqual((controller.batch_bytes, controller.linger), (20480, 1.0))
+        for _ in range(10):
+            controller.update(5000)
+        self.assertEqual(controller.batch_bytes, 131072)
+        self.assertEqual(controller.linger, 2.0)
+        self.assertFalse(controller.update(5000))
+        self.assertEqual(controller.decisions[-1]['action'], 'hold')
+
+    def test_should_shrink_down_to_min_when_queue_is_empty(self):
+        controller = self.build_controller()
+        controller.observe_puback(0.1)
+        self.assertTrue(controller.update(0))
+        self.assertEqual((controller.batch_bytes, controller.linger), (7680, 0.375))
+        for _ in range(20):
+            controller.update(0)
+        self.assertEqual((controller.batch_bytes, controller.linger), (1024, 0.05))
+
+    def test_should_hold_while_pubacks_are_slow(self):
+        controller = self.build_controller()
+        controller.observe_puback(0.4)
+        controller.observe_puback(0.8)
+        self.assertFalse(controller.update(0))
+        decision = controller.decisions[-1]
+        self.assertEqual(decision['action'], 'hold')
+        self.assertAlmostEqual(decision['puback_latency'], 0.6)
+        # Latency is measured per interval
+        self.assertTrue(controller.update(0))
+
+    def test_should_hold_between_low_and_high_backlog(self):
+        controller = self.build_controller()
+        self.assertFalse(controller.update(500))
+        self.assertEqual(controller.batch_bytes, 10240)
+
+    def test_should_export_decisions_as_metrics(self):
+        metrics = SerialDataMetrics('test')
+        controller = self.build_controller(metrics=metrics)
+        controller.update(5000)
+        controller.update(500)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'batch_control_grow': 1, 'batch_control_hold': 1})
+        self.assertEqual(snapshot['gauges'], {'batch_bytes': 20480, 'batch_linger': 1.0})
+
+    def test_should_reject_min_above_max(self):
+        self.assertRaises(ValueError, self.build_controller, min_bytes=4096, max_bytes=2048)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+
+class SerialDataCodecTest(unittest.TestCase):
+
+    row = [cell + '\n' for cell in
+           ['Total runtime', 'FW ver', 'Dev ID', 'Type', 'inputs', 'state', 'Sensor1', 'Sensor2',
+            '2019-02-08 14:26:09.506939', 'V001', '0', 'Sensor', '8', 'Active', '52', '28']]
+
+    def encode_line(self, codec):
+        serial_data = SerialData()
+        serial_data.set_message(self.row)
+        return serial_data.parse_csv_to_string().parse_string_to_wire(codec).message
+
+    def decode_frames(self, codec, stream):
+        scanner = codec.new_scanner()
+        frames = []
+        for i in range(0, len(stream), 7):
+            frames.extend(scanner.feed(stream[i:i + 7]))
+        messages = []
+        for frame in frames:
+            serial_data = SerialData()
+            serial_data.set_message(frame)
+            messages.append(serial_data.parse_wire_to_string(codec).parse_string_to_json().message)
+        return messages
+
+    def test_should_round_trip_both_codecs_to_same_json(self):
+        ascii = get_codec('ascii')
+        binary = get_codec('binary')
+        ascii_messages = self.decode_frames(ascii, (self.encode_line(ascii) + ' ') * 3)
+        binary_messages = self.decode_frames(binary, self.encode_line(binary) * 2)
+        self.assertEqual(len(ascii_messages), 2)
+        self.assertEqual(ascii_messages[0], binary_messages[0])
+        self.assertEqual(ascii_messages, binary_messages)
+
+    def test_should_encode_binary_smaller_than_ascii(self):
+        self.assertLess(len(self.encode_line(get_codec('binary'))) * 3,
+                        len(self.encode_line(get_codec('ascii'))))
+
+    def test_should_skip_garbage_before_binary_frame(self):
+        binary = get_codec('binary')
+        scanner = binary.new_scanner()
+        line = self.encode_line(binary)
+        frames = scanner.feed('\x00\xa5garbage' + line)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(scanner.bytes_dropped, len('\x00\xa5garbage'))
+
+    def test_should_reject_unknown_codec(self):
+        self.assertRaises(ValueError, get_codec, 'base64')
+
+if __name__ == '__main__':
+    unittest.main()
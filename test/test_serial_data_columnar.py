@@ -0,0 +1,92 @@
+import unittest
+import sys
+import json
+import random
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from datetime import datetime, timedelta
+
+from serial_data import SerialData
+from serial_data_columnar import (SerialDataColumnar, encode_columns, decode_columns,
+                                  get_layout, topic_matches)
+from serial_data_compression import SerialDataCompressor, decode_payload
+from serial_data_schema import DEFAULT_FIELD_TYPES
+from serial_data_utils import SerialDataUtils
+
+class SerialDataColumnarTest(unittest.TestCase):
+
+    def build_messages(self, count, field_types=None):
+        utils = SerialDataUtils()
+        serial_data = SerialData()
+        if field_types:
+            serial_data.set_field_types(field_types)
+        rng = random.Random(0)
+        messages = []
+        for index in range(count):
+            # Every other reading has a fraction of a second
+            total_runtime = datetime(2019, 1, 1, 0, 0, 0, 250000 * (index % 2)) + timedelta(seconds=index)
+            serial_data.set_message(utils.generate_mock_headings() +
+                                    utils.generate_seeded_values(rng, index % 3, total_runtime))
+            serial_data.parse_csv_to_string().parse_string_to_ascii()
+            serial_data.parse_ascii_to_string().parse_string_to_json()
+            messages.append(serial_data.message)
+        return messages
+
+    def test_should_decode_to_the_row_batch(self):
+        for field_types in (None, DEFAULT_FIELD_TYPES):
+            messages = self.build_messages(50, field_types)
+            payload = encode_columns(messages)
+            self.assertEqual(decode_columns(payload), '[' + ','.join(messages) + ']')
+            self.assertLess(len(payload), len('[' + ','.join(messages) + ']') / 4)
+
+    def test_should_hoist_constant_fields(self):
+        layout = json.loads(encode_columns(self.build_messages(10)))
+        self.assertEqual(layout['constants'], {'FW ver': 'V001', 'Type': 'Sensor',
+                                               'inputs': '8', 'state': 'Active'})
+        self.assertEqual(sorted(layout['columns']), ['Dev ID', 'Sensor1', 'Sensor2'])
+        self.assertEqual(layout['datetimes'], ['Total runtime'])
+        self.assertEqual(layout['deltas']['Total runtime'][1:3], [1250000, 750000])
+
+    def test_should_delta_encode_typed_timestamps(self):
+        layout = json.loads(encode_columns(self.build_messages(3, DEFAULT_FIELD_TYPES)))
+        self.assertEqual(layout['deltas']['Total runtime'], [1546300800000, 1250, 750])
+        self.assertNotIn('datetimes', layout)
+
+    def test_should_keep_values_that_only_compare_equal(self):
+        messages = ['{"a":1,"b":"x"}', '{"a":1.0,"b":"x"}', '{"a":true,"b":"x"}']
+        payload = encode_columns(messages)
+        self.assertEqual(json.loads(payload)['columns'], {'a': [1, 1.0, True]})
+        self.assertEqual(decode_columns(payload), '[' + ','.join(messages) + ']')
+
+    def test_should_send_rows_of_different_fields_as_rows(self):
+        messages = ['{"a":"1"}', '{"b":"1"}']
+        self.assertEqual(encode_columns(messages), None)
+        self.assertEqual(SerialDataColumnar().encode(messages), '[{"a":"1"},{"b":"1"}]')
+
+    def test_should_split_batches_above_max_size(self):
+        messages = self.build_messages(40)
+        columnar = SerialDataColumnar(max_size=600)
+        payloads = columnar.encode_batch(messages)
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) <= 600 for payload, _ in payloads))
+        decoded = sum((json.loads(decode_columns(payload)) for payload, _ in payloads), [])
+        self.assertEqual(decoded, [json.loads(message) for message in messages])
+
+    def test_should_compress_columnar_layout(self):
+        messages = self.build_messages(20)
+        compressor = SerialDataCompressor('zlib-dict')
+        (payload, count), = compressor.compress_batch(messages, SerialDataColumnar().encode)
+        self.assertEqual(count, 20)
+        self.assertEqual(decode_columns(decode_payload(payload)), '[' + ','.join(messages) + ']')
+
+    def test_should_select_layout_by_topic_filter(self):
+        self.assertTrue(topic_matches('rules/+/telemetry/#', 'rules/DataToDynamo/telemetry/Pi3'))
+        self.assertFalse(topic_matches('rules/+/telemetry', 'rules/DataToDynamo/telemetry/Pi3'))
+        self.assertFalse(topic_matches('rules/+', 'rules'))
+        self.assertEqual(get_layout('telemetry/Pi3', 'alerts/#, telemetry/+'), 'columns')
+        self.assertEqual(get_layout('telemetry/Pi3', ''), 'rows')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import sys
+import json
+import unittest
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+from serial_data_compression import (SerialDataCompressor, decode_payload, train_dictionary,
+                                     MAGIC)
+from serial_load_generator import build_load_payloads
+
+def generate_messages(count):
+    serial_data = SerialData()
+    messages = []
+    for line in build_load_payloads(1, 4, count // 4 + 1)[0][:count]:
+        serial_data.set_message(line)
+        messages.append(serial_data.parse_wire_to_string(get_codec()).parse_string_to_json().message)
+    return messages
+
+class SerialDataCompressorTest(unittest.TestCase):
+
+    def test_should_round_trip_batches_through_envelope(self):
+        messages = generate_messages(20)
+        batch = '[' + ','.join(messages) + ']'
+        for method in ('zlib', 'zlib-dict'):
+            payload = SerialDataCompressor(method, threshold=0).compress(batch)
+            self.assertTrue(payload.startswith(MAGIC))
+            self.assertLess(len(payload), len(batch) // 4)
+            self.assertEqual(decode_payload(payload), batch)
+            self.assertEqual(len(json.loads(decode_payload(payload))), 20)
+
+    def test_should_compress_small_batches_better_with_dictionary(self):
+        batch = '[' + ','.join(generate_messages(2)) + ']'
+        plain = SerialDataCompressor('zlib', threshold=0).compress(batch)
+        preset = SerialDataCompressor('zlib-dict', threshold=0).compress(batch)
+        self.assertLess(len(preset), len(plain))
+
+    def test_should_send_payloads_below_threshold_raw(self):
+        payload = '[' + generate_messages(1)[0] + ']'
+        compressor = SerialDataCompressor('zlib', threshold=len(payload) + 1)
+        self.assertEqual(compressor.compress(payload), payload)
+        self.assertEqual(decode_payload(payload), payload)
+
+    def test_should_split_batches_above_compressed_limit(self):
+        messages = generate_messages(200)
+        compressor = SerialDataCompressor('zlib', threshold=0, max_size=1024)
+        payloads = compressor.compress_batch(messages)
+        self.assertGreater(len(payloads), 1)
+        self.assertEqual(sum(count for _, count in payloads), len(messages))
+        self.assertTrue(all(len(payload) <= 1024 for payload, _ in payloads))
+        decoded = sum((json.loads(decode_payload(payload)) for payload, _ in payloads), [])
+        self.assertEqual(decoded, [json.loads(message) for message in messages])
+        self.assertGreater(compressor.get_raw_size(1024), 1024)
+
+    def test_should_put_most_frequent_tokens_last(self):
+        dictionary = train_dictionary(['{"a":"1","b":"2"}', '{"a":"1","b":"3"}'])
+        self.assertTrue(dictionary.endswith('"a":"1",'))
+
+if __name__ == '__main__':
+    unittest.main()
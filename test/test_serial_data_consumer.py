@@ -0,0 +1,146 @@
+import unittest
+import sys
+import json
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_data_iot_pool import SerialDataIoTPool, get_client_ids
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+HEADINGS = '"Dev ID","Sensor1"'
+
+class SerialDataConsumerAckTest(unittest.TestCase):
+
+    def test_should_ack_deliveries_only_on_puback(self):
+        consumer = build_consumer(FakeIoTClient())
+        consumer.publish_to_target_topic('{}', [1])
+        consumer.publish_to_target_topic('{}', [2])
+        consumer.on_iot_puback(2)
+        self.assertEqual(consumer._channel.acks, [])
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+    def test_should_requeue_publishes_queued_while_offline(self):
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client)
+        iot_client.queued = True
+        consumer.publish_to_target_topic('{}', [1])
+        iot_client.queued = False
+        consumer.publish_to_target_topic('{}', [2])
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.nacks, [1])
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+        self.assertEqual(consumer.metrics.snapshot()['counters']['iot_queued'], 1)
+
+class SerialDataConsumerDecodeErrorTest(unittest.TestCase):
+
+    # Malformed deliveries are acked and dropped, the lines after them are
+    # still published
+
+    def setUp(self):
+        self.iot_client = FakeIoTClient()
+        self.consumer = build_consumer(self.iot_client)
+
+    def assert_dropped(self, delivery_tag, body, headers=None):
+        deliver(self.consumer, delivery_tag, body, headers)
+        self.assertEqual(self.consumer._channel.acks, [(delivery_tag, False)])
+        self.assertEqual(self.consumer.metrics.snapshot()['counters']['decode_errors'], 1)
+        self.assertEqual(self.iot_client.payloads, [])
+        deliver(self.consumer, delivery_tag + 1,
+                get_codec('ascii').encode('%s,"1","2"\r\n' % HEADINGS))
+        self.assertEqual(len(self.iot_client.payloads), 1)
+
+    def test_should_drop_message_with_unknown_codec(self):
+        self.assert_dropped(1, get_codec('ascii').encode('%s,"1","2"\r\n' % HEADINGS),
+                            {'codec': 'morse'})
+
+    def test_should_drop_line_with_wrong_field_count_for_its_schema(self):
+        deliver(self.consumer, 1, get_codec('ascii').encode('!s1,%s\r\n' % HEADINGS))
+        self.consumer._channel.acks = []
+        self.assert_dropped(2, get_codec('ascii').encode('#s1,1,2,3\r\n'))
+
+    def test_should_drop_ascii_body_that_is_not_decimal(self):
+        self.assert_dropped(1, '34 68 ab 118')
+
+    def test_should_drop_ascii_body_with_non_ascii_character(self):
+        self.assert_dropped(1, get_codec('ascii').encode(u'%s,"1","\xe9"\r\n' % HEADINGS))
+
+    def test_should_drop_binary_line_that_is_not_utf8(self):
+        self.assert_dropped(1, '%s,"1","\xff\xfe"\r\n' % HEADINGS, {'codec': 'binary'})
+
+class SerialDataConsumerBatchTest(unittest.TestCase):
+
+    def deliver(self, consumer, delivery_tag, sensor1, device=None):
+        headers = {'codec': 'ascii'}
+        if device is not None:
+            headers['device'] = device
+        deliver(consumer, delivery_tag,
+                get_codec('ascii').encode('%s,"0","%s"\r\n' % (HEADINGS, sensor1)), headers)
+
+    def get_batches(self, iot_client):
+        return [[message['Sensor1'] for message in json.loads(payload)]
+                for payload in iot_client.payloads]
+
+    def test_should_flush_partial_batch_when_linger_expires(self):
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client, 10240, batch_linger=1.0)
+        self.deliver(consumer, 1, 1)
+        self.deliver(consumer, 2, 2)
+        self.assertEqual(iot_client.payloads, [])
+        self.assertEqual(len(consumer._connection.timeouts), 1)
+        consumer._connection.run_timeouts()
+        self.assertEqual(self.get_batches(iot_client), [['1', '2']])
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+    def test_should_flush_batch_when_next_message_overflows_it(self):
+        iot_client = FakeIoTClient()
+        # Room for two messages of 28 bytes, brackets and comma
+        consumer = build_consumer(iot_client, 70)
+        for delivery_tag in (1, 2, 3):
+            self.deliver(consumer, delivery_tag, delivery_tag)
+        self.assertEqual(self.get_batches(iot_client), [['1', '2']])
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+        # The overflowing message opened the next batch
+        consumer._connection.run_timeouts()
+        self.assertEqual(self.get_batches(iot_client), [['1', '2'], ['3']])
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [(2, True), (3, True)])
+
+    def test_should_ack_each_flushed_batch_once(self):
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client, 10240, batch_count=3)
+        for delivery_tag in range(1, 7):
+            self.deliver(consumer, delivery_tag, delivery_tag)
+        self.assertEqual(self.get_batches(iot_client), [['1', '2', '3'], ['4', '5', '6']])
+        self.assertEqual(consumer._channel.acks, [])
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [(3, True), (6, True)])
+
+    def test_should_hold_ack_of_batch_split_over_pool_until_every_puback(self):
+        clients = [FakeIoTClient(), FakeIoTClient()]
+        pool = SerialDataIoTPool(clients, get_client_ids('gateway', 2))
+        devices = ['dev%i' % number for number in range(40)]
+        first = next(device for device in devices if pool.get_connection(device) == 0)
+        second = next(device for device in devices if pool.get_connection(device) == 1)
+        consumer = build_consumer(pool, 10240, batch_count=4)
+        for delivery_tag, device in enumerate([first, second, first, second], 1):
+            self.deliver(consumer, delivery_tag, delivery_tag, device)
+        self.assertEqual([self.get_batches(client) for client in clients],
+                         [[['1', '3']], [['2', '4']]])
+        # Tag 3 of the first part must not ack tag 2 of the second one early
+        clients[0].puback_all()
+        self.assertEqual(consumer._channel.acks, [])
+        clients[1].puback_all()
+        self.assertEqual(consumer._channel.acks, [(4, True)])
+        # The next batch does not inherit the held ack
+        for delivery_tag in range(5, 9):
+            self.deliver(consumer, delivery_tag, delivery_tag, second)
+        clients[1].puback_all()
+        self.assertEqual(consumer._channel.acks, [(4, True), (8, True)])
+
+if __name__ == '__main__':
+    unittest.main()
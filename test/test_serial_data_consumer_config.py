@@ -0,0 +1,30 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_consumer_config import SerialDataConsumerConfig
+
+class SerialDataConsumerConfigTest(unittest.TestCase):
+
+    def test_should_convert_command_line_strings_to_default_types(self):
+        config = SerialDataConsumerConfig(batch_messages='4096', batch_linger='0.5',
+                                          window_fields=['Sensor1'])
+        self.assertEqual(config.batch_messages, 4096)
+        self.assertEqual(config.batch_linger, 0.5)
+        self.assertEqual(config.window_fields, ('Sensor1',))
+        self.assertEqual(config.prefetch_count, 1000)
+        self.assertFalse(config.adaptive)
+
+    def test_should_refuse_unknown_options(self):
+        self.assertRaises(TypeError, SerialDataConsumerConfig, batch_size=4096)
+
+    def test_should_refuse_prefetch_below_one_window_of_messages(self):
+        SerialDataConsumerConfig(window=10, window_rate=100, prefetch_count=1000).check_prefetch()
+        SerialDataConsumerConfig(window=10, window_rate=100, prefetch_count=0).check_prefetch()
+        config = SerialDataConsumerConfig(window=10, window_rate=101, prefetch_count=1000)
+        self.assertRaises(ValueError, config.check_prefetch)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_delivery import DeliveryAckWindow, PublishConfirmTracker
+
+class DeliveryAckWindowTest(unittest.TestCase):
+
+    def test_should_release_tags_only_when_earlier_batches_are_confirmed(self):
+        window = DeliveryAckWindow()
+        window.add(1, 3)
+        window.add(2, 7)
+        window.add(3, 9)
+        self.assertEqual(window.confirm(2), None)
+        self.assertEqual(window.confirm(1), 7)
+        self.assertEqual(window.confirm(3), 9)
+        self.assertEqual(len(window), 0)
+
+    def test_should_keep_last_tag_when_releasing_keys_without_one(self):
+        window = DeliveryAckWindow()
+        window.add(1, 3)
+        window.add(2, None)
+        self.assertEqual(window.confirm(2), None)
+        self.assertEqual(window.confirm(1), 3)
+        self.assertEqual(len(window), 0)
+
+    def test_should_ignore_confirmations_after_clear(self):
+        window = DeliveryAckWindow()
+        window.add(1, 3)
+        window.clear()
+        self.assertEqual(window.confirm(1), None)
+
+class PublishConfirmTrackerTest(unittest.TestCase):
+
+    def test_should_confirm_all_earlier_tags_on_multiple_ack(self):
+        tracker = PublishConfirmTracker(max_in_flight=3)
+        for message in 'abc':
+            tracker.add(message)
+        self.assertTrue(tracker.is_full())
+        self.assertEqual(tracker.confirm(2, multiple=True), [])
+        self.assertEqual(len(tracker), 1)
+        self.assertEqual(tracker.acked, 2)
+        self.assertFalse(tracker.is_full())
+
+    def test_should_return_nacked_messages_until_retry_limit(self):
+        tracker = PublishConfirmTracker(max_retries=1)
+        tag = tracker.add('a')
+        message, retries = tracker.confirm(tag, ack=False)[0]
+        self.assertEqual((message, retries), ('a', 1))
+        tag = tracker.add(message, retries)
+        self.assertEqual(tracker.confirm(tag, ack=False), [])
+        self.assertEqual(tracker.failed, 1)
+
+    def test_should_restart_tags_after_reset(self):
+        tracker = PublishConfirmTracker()
+        tracker.add('a')
+        tracker.add('b')
+        self.assertEqual(tracker.reset(), [('a', 0), ('b', 0)])
+        self.assertEqual(tracker.add('c'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
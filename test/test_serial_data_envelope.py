@@ -0,0 +1,85 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_data_envelope import (SerialDataEnvelope, pack_envelope, unpack_envelope,
+                                  FRAMES_HEADER)
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+class SerialDataEnvelopeTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(path.join(path.dirname(path.abspath(__file__)), 'mock_data.txt')) as f:
+            line = f.read().strip() + '\r\n'
+        self.codec = get_codec('ascii')
+        self.frame = self.codec.encode(line)
+
+    def deliver(self, consumer, delivery_tag, frames=None):
+        headers = {'codec': self.codec.name}
+        body = self.frame
+        if frames is not None:
+            headers[FRAMES_HEADER] = len(frames)
+            body = pack_envelope(frames)
+        deliver(consumer, delivery_tag, body, headers)
+
+    def test_should_unpack_frames_in_order(self):
+        frames = [b'1,2\r\n', b'', b'\x00' * 300]
+        self.assertEqual(unpack_envelope(pack_envelope(frames)), frames)
+
+    def test_should_reject_broken_envelopes(self):
+        body = pack_envelope([b'1,2\r\n', b'3,4\r\n'])
+        self.assertRaises(ValueError, unpack_envelope, body[:-1])
+        self.assertRaises(ValueError, unpack_envelope, body + b'x')
+        self.assertRaises(ValueError, unpack_envelope, b'XX' + body[2:])
+        self.assertRaises(ValueError, pack_envelope, [])
+
+    def test_should_be_full_at_max_frames_or_bytes(self):
+        envelope = SerialDataEnvelope(max_frames=3, max_bytes=1024)
+        self.assertFalse(envelope.add(b'a' * 10, 7, 100.0))
+        self.assertFalse(envelope.add(b'b' * 10, 8, 100.5))
+        self.assertTrue(envelope.add(b'c' * 10, 9, 101.0))
+        body, frames, trace_id, frame_time = envelope.pack()
+        self.assertEqual((frames, trace_id, frame_time), (3, 7, 100.0))
+        self.assertEqual(unpack_envelope(body), [b'a' * 10, b'b' * 10, b'c' * 10])
+        self.assertEqual(len(envelope), 0)
+        envelope = SerialDataEnvelope(max_frames=100, max_bytes=64)
+        self.assertFalse(envelope.add(b'a' * 40, 1, 100.0))
+        self.assertTrue(envelope.add(b'b' * 40, 2, 100.0))
+
+    def test_should_ack_envelope_after_its_last_line(self):
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client)
+        self.deliver(consumer, 1, [self.frame] * 3)
+        self.deliver(consumer, 2)
+        self.assertEqual(len(iot_client.payloads), 4)
+        consumer.on_iot_puback(1)
+        consumer.on_iot_puback(2)
+        self.assertEqual(consumer._channel.acks, [])
+        consumer.on_iot_puback(4)
+        self.assertEqual(consumer._channel.acks, [])
+        consumer.on_iot_puback(3)
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+    def test_should_requeue_envelope_once_and_never_ack_it(self):
+        iot_client = FakeIoTClient(fail_after=1)
+        consumer = build_consumer(iot_client)
+        self.deliver(consumer, 1, [self.frame] * 3)
+        self.assertEqual(consumer._channel.nacks, [1])
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [])
+        iot_client.fail_after = None
+        self.deliver(consumer, 2)
+        consumer.on_iot_puback(2)
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+    def test_should_drop_broken_envelope(self):
+        consumer = build_consumer(FakeIoTClient())
+        deliver(consumer, 1, b'SE', {FRAMES_HEADER: 2})
+        self.assertEqual(consumer._channel.acks, [(1, False)])
+        self.assertEqual(consumer.metrics.snapshot()['counters']['envelopes_broken'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import sys
+import json
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_data_iot_pool import SerialDataIoTPool, IoTConnection, get_client_ids
+from serial_data_metrics import SerialDataMetrics
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+DEVICES = ['dev%i' % number for number in range(40)]
+
+class SerialDataIoTPoolTest(unittest.TestCase):
+
+    def build_pool(self, size=4):
+        self.clients = [FakeIoTClient() for _ in range(size)]
+        return SerialDataIoTPool(self.clients, get_client_ids('gateway', size))
+
+    def get_routes(self, pool):
+        return dict((device, pool.get_connection(device)) for device in DEVICES)
+
+    def test_should_derive_client_ids(self):
+        self.assertEqual(get_client_ids('gateway', 1), ['gateway'])
+        self.assertEqual(get_client_ids('gateway', 3), ['gateway-0', 'gateway-1', 'gateway-2'])
+
+    def test_should_keep_devices_on_one_connection(self):
+        pool = self.build_pool()
+        routes = self.get_routes(pool)
+        self.assertEqual(len(set(routes.values())), 4)
+        for device in DEVICES:
+            pool.publishAsync('topic', 'payload', 1, key=device)
+        self.assertEqual(self.get_routes(pool), routes)
+        self.assertEqual(sum(len(client.payloads) for client in self.clients), len(DEVICES))
+
+    def test_should_move_only_devices_of_a_dropped_connection(self):
+        pool = self.build_pool()
+        routes = self.get_routes(pool)
+        self.clients[1].onOffline()
+        rebalanced = self.get_routes(pool)
+        for device in DEVICES:
+            if routes[device] == 1:
+                self.assertNotEqual(rebalanced[device], 1)
+            else:
+                self.assertEqual(rebalanced[device], routes[device])
+        self.clients[1].onOnline()
+        self.assertEqual(self.get_routes(pool), routes)
+
+    def test_should_back_off_a_failing_connection_and_retry_on_another(self):
+        pool = self.build_pool()
+        device = next(device for device in DEVICES if pool.get_connection(device) == 2)
+        self.clients[2].failing = True
+        index, mid = pool.publishAsync('topic', 'payload', 1, key=device)
+        self.assertNotEqual(index, 2)
+        self.assertEqual(pool.connections[2].errors, 1)
+        self.assertFalse(pool.connections[2].is_healthy(pool.connections[2].retry_at - 0.5))
+        self.assertNotEqual(pool.get_connection(device), 2)
+        # Back in routing once the backoff is over
+        pool.connections[2].retry_at = 0
+        pool._routes_expire = 0
+        self.assertEqual(pool.get_connection(device), 2)
+
+    def test_should_raise_when_every_connection_fails(self):
+        pool = self.build_pool(2)
+        for client in self.clients:
+            client.failing = True
+        self.assertRaises(IOError, pool.publishAsync, 'topic', 'payload', 1, None, 'dev0')
+
+    def test_should_report_pool_offline_after_last_connection(self):
+        pool = self.build_pool(2)
+        events = []
+        pool.onOnline = lambda: events.append('online')
+        pool.onOffline = lambda: events.append('offline')
+        self.clients[0].onOffline()
+        self.clients[1].onOffline()
+        self.clients[1].onOnline()
+        self.clients[0].onOnline()
+        self.assertEqual(events, ['offline', 'online'])
+
+    def test_should_reconnect_a_connection_that_failed_to_connect(self):
+        pool = self.build_pool(3)
+        self.clients[1].failing = True
+        connacks = []
+        pool.connectAsync(ackCallback=lambda mid, data: connacks.append(mid))
+        self.assertEqual([connection.online for connection in pool.connections], [True, False, True])
+        reconnect = pool.connections[1].reconnect
+        self.assertTrue(reconnect is not None)
+        self.assertTrue(reconnect.interval <= IoTConnection.BACKOFF_MIN)
+        reconnect.cancel()
+        # Still refused, the next try waits longer
+        pool.reconnect(1)
+        self.assertEqual(pool.connections[1].connect_backoff.attempts, 2)
+        pool.connections[1].reconnect.cancel()
+        self.clients[1].failing = False
+        pool.reconnect(1)
+        self.assertEqual(pool.connections[1].reconnect, None)
+        self.assertEqual(pool.connections[1].connect_backoff.attempts, 0)
+        self.clients[1].connack(mid=7, data=0)
+        self.assertEqual(connacks, [(1, 7)])
+        self.clients[1].onOnline()
+        self.assertTrue(pool.connections[1].online)
+
+    def test_should_not_reconnect_when_every_connection_fails(self):
+        pool = self.build_pool(2)
+        for client in self.clients:
+            client.failing = True
+        self.assertRaises(IOError, pool.connectAsync)
+        self.assertEqual([connection.reconnect for connection in pool.connections], [None, None])
+
+    def test_should_count_publishes_and_pubacks_per_connection(self):
+        pool = self.build_pool(2)
+        metrics = SerialDataMetrics('test')
+        pool.set_metrics(metrics)
+        acked = []
+        for device in DEVICES:
+            pool.publishAsync('topic', 'payload', 1, acked.append, device)
+        for client in self.clients:
+            client.puback_all()
+        self.assertEqual(len(set(acked)), len(DEVICES))
+        stats = pool.get_stats()
+        self.assertEqual(sum(stats[client_id]['pubacks'] for client_id in stats), len(DEVICES))
+        self.assertTrue(all(stats[client_id]['publishes_per_second'] > 0 for client_id in stats))
+        self.assertEqual(sum(metrics.snapshot()['gauges']['iot_connection_bytes'].values()),
+                         7 * len(DEVICES))
+
+    def test_should_ack_batch_split_over_connections_after_all_pubacks(self):
+        pool = self.build_pool(2)
+        consumer = build_consumer(pool, 100000, batch_count=len(DEVICES), batch_linger=0)
+        codec = get_codec('ascii')
+        with open(path.join(path.dirname(path.abspath(__file__)), 'mock_data.txt')) as f:
+            body = codec.encode(f.read().strip() + '\r\n')
+        for delivery_tag, device in enumerate(DEVICES, 1):
+            deliver(consumer, delivery_tag, body, {'codec': codec.name, 'device': device})
+        self.assertEqual([len(client.payloads) for client in self.clients], [1, 1])
+        self.assertEqual(sum(len(json.loads(client.payloads[0])) for client in self.clients),
+                         len(DEVICES))
+        self.clients[0].puback_all()
+        self.assertEqual(consumer._channel.acks, [])
+        self.clients[1].puback_all()
+        self.assertEqual(consumer._channel.acks, [(len(DEVICES), True)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import sys
+import logging
+import unittest
+import urllib2
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_metrics import (Histogram, MetricsServer, PayloadLogSampler, SerialDataMetrics,
+                                 from_microseconds, to_microseconds)
+
+class HistogramTest(unittest.TestCase):
+
+    def test_should_report_bucket_upper_bound_as_percentile(self):
+        histogram = Histogram((0.001, 0.01, 0.1))
+        for value in [0.0005] * 98 + [0.05, 5]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(0.50), 0.001)
+        self.assertEqual(histogram.percentile(0.99), 0.1)
+        self.assertEqual(histogram.percentile(1.0), float('inf'))
+        self.assertEqual(Histogram().percentile(0.5), None)
+
+class SerialDataMetricsTest(unittest.TestCase):
+
+    def test_should_render_counters_gauges_and_histograms(self):
+        metrics = SerialDataMetrics('test')
+        metrics.inc('frames', 3)
+        metrics.add_gauge('backlog', lambda: 7)
+        metrics.add_gauge('port_bytes', lambda: {'/dev/pts/4': 10}, label='port')
+        metrics.observe('latency_seconds', 0.00005)
+        lines = metrics.render().splitlines()
+        self.assertIn('test_frames_total 3', lines)
+        self.assertIn('test_backlog 7', lines)
+        self.assertIn('test_port_bytes{port="/dev/pts/4"} 10', lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('test_latency_seconds_count 1', lines)
+
+    def test_should_serve_metrics_over_http(self):
+        metrics = SerialDataMetrics('test')
+        metrics.inc('frames')
+        server = MetricsServer(metrics, 0).start()
+        try:
+            url = 'http://127.0.0.1:%i/metrics.json' % server._server.server_address[1]
+            snapshot = json.load(urllib2.urlopen(url))
+        finally:
+            server.stop()
+        self.assertEqual(snapshot['counters'], {'frames': 1})
+
+    def test_should_keep_microsecond_timestamps(self):
+        self.assertAlmostEqual(from_microseconds(to_microseconds(1549635969.506939)),
+                               1549635969.506939, places=5)
+
+class PayloadLogSamplerTest(unittest.TestCase):
+
+    def test_should_log_every_nth_payload_only_at_debug(self):
+        logger = logging.getLogger('test_payload_log_sampler')
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger.addHandler(handler)
+        sampler = PayloadLogSampler(logger, 3)
+        logger.setLevel(logging.INFO)
+        sampler.log('%s', 'skipped')
+        logger.setLevel(logging.DEBUG)
+        for index in range(7):
+            sampler.log('%s', index)
+        self.assertEqual([record.getMessage() for record in records], ['0', '3', '6'])
+
+if __name__ == '__main__':
+    unittest.main()
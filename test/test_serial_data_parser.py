@@ -4,7 +4,10 @@ import sys, json
 from os import path
 sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
 
+import serial_data
 from serial_data import SerialData
+from serial_data_codec import get_codec
+from serial_data_utils import SerialDataUtils
 
 class SerialDataParserTest(unittest.TestCase):
 
@@ -13,9 +16,10 @@ class SerialDataParserTest(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        with open('mock_data.json') as f:
+        directory = path.dirname(path.abspath(__file__))
+        with open(path.join(directory, 'mock_data.json')) as f:
             cls.mock_json_object = json.load(f)
-        with open('mock_data.txt') as f:
+        with open(path.join(directory, 'mock_data.txt')) as f:
             cls.mock_string = f.read()
 
     def test_should_parse_string_to_json_object(self):
@@ -38,10 +42,73 @@ class SerialDataParserTest(unittest.TestCase):
         parser = SerialData()
         json_line = json.dumps(self.mock_json_object)
         parser.set_message(self.mock_string)
-        parser.set_message_max_size(message_max_size=740)
+        # Five lines, four commas and the brackets
+        parser.set_message_max_size(message_max_size=5 * len(self.mock_string) + 4 + 2)
         while not parser.batch_full:
             parser.set_batch()
         self.assertEqual(len(parser.batch), 5)
 
+    def test_should_carry_overflow_message_to_next_batch(self):
+        parser = SerialData()
+        parser.set_message_max_size(message_max_size=40)
+        for message in ['{"a":"%s"}' % i for i in range(5)]:
+            parser.set_message(message)
+            parser.set_batch()
+            if parser.batch_full:
+                self.assertEqual(json.loads(parser.get_batch()), [{'a': '0'}, {'a': '1'}, {'a': '2'}])
+                self.assertEqual(parser.get_batch_size(), len(parser.get_batch()))
+                parser.clear_batch()
+        self.assertEqual(json.loads(parser.get_batch()), [{'a': '3'}, {'a': '4'}])
+
+    def test_should_report_line_with_more_values_than_fields(self):
+        parser = SerialData()
+        parser.set_message('"a","b","1","2","3"\r\n')
+        self.assertEqual(parser.parse_string_to_json().message, '')
+        self.assertTrue(parser.parse_error.endswith('has 2 fields, got 3 values'))
+        parser.set_message('"a","b","1","2"\r\n')
+        self.assertEqual(json.loads(parser.parse_string_to_json().message), {'a': '1', 'b': '2'})
+        self.assertEqual(parser.parse_error, None)
+
+    @unittest.skipIf(serial_data.numpy is None, 'numpy is not installed')
+    def test_should_batch_decode_lines_after_one_with_more_values_than_fields(self):
+        bodies = []
+        for cells in (['a', 'b', '1', '2', '3'], ['a', 'b', '1', '2']):
+            parser = SerialData()
+            parser.set_message(cells)
+            bodies.append(parser.parse_csv_to_string().parse_string_to_ascii().message)
+        messages = SerialData().decode_batch(bodies)
+        self.assertEqual(messages[0], '')
+        self.assertEqual(json.loads(messages[1]), {'a': '1', 'b': '2'})
+
+    @unittest.skipIf(serial_data.numpy is None, 'numpy is not installed')
+    def test_should_batch_decode_lines_after_one_with_a_stray_quote(self):
+        ascii = get_codec('ascii')
+        bodies = [ascii.encode('"a","b","1","2\r\n'), ascii.encode('"a","b","3","4"\r\n')]
+        parser = SerialData()
+        parser.set_message('unchanged')
+        messages = parser.decode_batch(bodies)
+        self.assertEqual(json.loads(messages[1]), {'a': '3', 'b': '4'})
+        # Row by row decoding, used for codes above 255, keeps the message too
+        self.assertEqual(parser._decode_scalar_row(bodies[1]), ['a', 'b', '3', '4'])
+        self.assertEqual(parser.message, 'unchanged')
+
+    @unittest.skipIf(serial_data.numpy is None, 'numpy is not installed')
+    def test_should_batch_decode_same_as_single_decode(self):
+        utils = SerialDataUtils()
+        bodies = []
+        for cells in [utils.generate_mock_data() for _ in range(3)] + [['a"b,\n', 'c\n'] * 8]:
+            parser = SerialData()
+            parser.set_message(cells)
+            bodies.append(parser.parse_csv_to_string().parse_string_to_ascii().message)
+        parser = SerialData()
+        messages = []
+        for body in bodies:
+            parser.set_message(body)
+            messages.append(parser.parse_ascii_to_string().parse_string_to_json().message)
+        self.assertEqual(SerialData().decode_batch(bodies), messages)
+        columns = SerialData().decode_batch_columns(bodies[:3])
+        self.assertEqual(list(columns), utils.HEADINGS)
+        self.assertEqual(len(columns['Sensor1']), 3)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+from serial_data_pipeline import SerialDataPipeline
+from serial_data_spool import SerialDataSpool
+
+HEADINGS = '"Total runtime","FW ver","Dev ID","Type","inputs","state","Sensor1","Sensor2"'
+VALUES = '"2019-02-08 14:26:09.506939","V001","0","Sensor","8","Active","%s","28"'
+
+def get_line(sensor1):
+    return '%s,%s\r\n' % (HEADINGS, VALUES % sensor1)
+
+class FakeSerialPort(object):
+
+    # Yields the frames of lines, then waits until closed or raises error
+
+    def __init__(self, lines, error=None):
+        self.codec = get_codec('ascii')
+        self.last_read_time = time.time()
+        self.closed = threading.Event()
+        self._frames = [self.codec.encode(line) for line in lines]
+        self._error = error
+
+    def frames(self):
+        for frame in self._frames:
+            yield frame
+        if self._error is not None:
+            raise self._error
+        self.closed.wait()
+
+class FakeIoTClient(object):
+
+    def __init__(self, puback_time=0):
+        self.payloads = []
+        self.failing = False
+        self.puback_time = puback_time
+
+    def publish(self, topic, payload, QoS):
+        if self.failing:
+            raise IOError('Publish timed out')
+        time.sleep(self.puback_time)
+        self.payloads.append(payload)
+
+class SerialDataPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.iot_client = FakeIoTClient()
+        self.pipelines = []
+        self.threads = []
+
+    def tearDown(self):
+        for pipeline, serial_port in self.pipelines:
+            serial_port.closed.set()
+            pipeline.stop()
+        for thread in self.threads:
+            thread.join()
+        shutil.rmtree(self.directory)
+
+    def build_pipeline(self, serial_port, **kwargs):
+        pipeline = SerialDataPipeline(serial_port, SerialData(), self.iot_client, 'test/topic',
+                                      SerialDataSpool(self.directory), **kwargs)
+        pipeline.RETRY_INTERVAL = 0.01
+        pipeline.on_online()
+        self.pipelines.append((pipeline, serial_port))
+        return pipeline
+
+    def start(self, pipeline):
+        # Stage threads end with run once the pipeline stops
+        thread = threading.Thread(target=pipeline.run)
+        thread.start()
+        self.threads.append(thread)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def get_sensor1(self, payload):
+        return json.loads(payload)['Sensor1']
+
+    def test_should_skip_lines_that_fail_to_parse(self):
+        # Odd number of cells, heading and values do not pair up
+        broken = '%s,"0"\r\n' % HEADINGS
+        pipeline = self.build_pipeline(FakeSerialPort([get_line(1), broken, get_line(3)]))
+        self.start(pipeline)
+        self.wait_for(lambda: len(self.iot_client.payloads) == 2)
+        self.assertEqual([self.get_sensor1(payload) for payload in self.iot_client.payloads],
+                         ['1', '3'])
+        counters = pipeline.metrics.snapshot()['counters']
+        self.assertEqual((counters['frames_skipped'], counters['parse_errors']), (1, 1))
+
+    def test_should_stop_when_a_stage_stops(self):
+        pipeline = self.build_pipeline(FakeSerialPort([get_line(1)], IOError('Port hung up')))
+        self.assertRaises(RuntimeError, pipeline.run)
+        self.assertTrue(pipeline._stopping.is_set())
+
+    def test_should_batch_up_to_batch_count(self):
+        pipeline = self.build_pipeline(FakeSerialPort([get_line(sensor1) for sensor1 in range(4)]),
+                                       batch_messages=10240, batch_count=2)
+        self.start(pipeline)
+        self.wait_for(lambda: len(self.iot_client.payloads) == 2)
+        self.assertEqual([[message['Sensor1'] for message in json.loads(payload)]
+                          for payload in self.iot_client.payloads], [['0', '1'], ['2', '3']])
+
+    def test_should_flush_partial_batch_after_linger(self):
+        pipeline = self.build_pipeline(FakeSerialPort([get_line(1)]),
+                                       batch_messages=10240, batch_linger=0.05)
+        started = time.time()
+        self.start(pipeline)
+        self.wait_for(lambda: len(self.iot_client.payloads) == 1)
+        self.assertTrue(time.time() - started >= 0.05)
+        self.assertEqual(len(json.loads(self.iot_client.payloads[0])), 1)
+
+    def test_should_spool_while_offline_and_replay_in_order(self):
+        serial_port = FakeSerialPort([get_line(sensor1) for sensor1 in range(3)])
+        pipeline = self.build_pipeline(serial_port)
+        pipeline.on_offline()
+        self.start(pipeline)
+        self.wait_for(lambda: pipeline.spooled == 3)
+        self.assertEqual(self.iot_client.payloads, [])
+        pipeline.on_online()
+        self.wait_for(lambda: len(self.iot_client.payloads) == 3)
+        self.assertEqual([self.get_sensor1(payload) for payload in self.iot_client.payloads],
+                         ['0', '1', '2'])
+        serial_port.closed.set()
+        pipeline.stop()
+        self.threads.pop().join()
+        # Replayed payloads are checkpointed, a restart does not send them again
+        self.assertEqual(len(SerialDataSpool(self.directory)), 0)
+
+    def test_should_replay_from_the_failed_payload(self):
+        pipeline = self.build_pipeline(FakeSerialPort([get_line(sensor1) for sensor1 in range(3)]))
+        self.iot_client.failing = True
+        self.start(pipeline)
+        self.wait_for(lambda: pipeline.spooled == 3)
+        self.iot_client.failing = False
+        self.wait_for(lambda: len(self.iot_client.payloads) == 3)
+        self.assertEqual([self.get_sensor1(payload) for payload in self.iot_client.payloads],
+                         ['0', '1', '2'])
+
+    def test_should_spool_queued_payloads_when_stopped_mid_stream(self):
+        serial_port = FakeSerialPort([get_line(sensor1) for sensor1 in range(200)])
+        self.iot_client.puback_time = 0.01
+        pipeline = self.build_pipeline(serial_port, queue_size=20)
+        self.start(pipeline)
+        self.wait_for(lambda: len(self.iot_client.payloads) == 2)
+        pipeline.stop()
+        self.threads.pop().join()
+        # Every frame read is published or spooled, in order
+        spool = SerialDataSpool(self.directory)
+        spooled = [spool.read()[0] for _ in range(len(spool))]
+        frames_read = pipeline.metrics.snapshot()['counters']['frames_read']
+        self.assertTrue(len(spooled) > 0)
+        self.assertEqual([self.get_sensor1(payload) for payload in self.iot_client.payloads + spooled],
+                         [str(sensor1) for sensor1 in range(frames_read)])
+
+if __name__ == '__main__':
+    unittest.main()
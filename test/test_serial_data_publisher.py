@@ -0,0 +1,96 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_port_reader import SerialPortReader
+from serial_data_publisher import SerialDataPublisher
+from mock_serial_data_fakes import FakeChannel, FakeConnection
+
+class SerialDataPublisherHangupTest(unittest.TestCase):
+
+    # The reader opens a link to a pty, like the /dev/serial/by-id links of
+    # USB adapters, so the link can point to a new pty after a hangup
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.link = path.join(self.directory, 'ttyUSB0')
+        self.masters = []
+        self.plug_in()
+        self.serial_port = SerialPortReader()
+        self.serial_port.open(self.link)
+        self.publisher = SerialDataPublisher('amqp://test', self.serial_port)
+        self.publisher._connection = FakeConnection()
+        self.publisher._channel = FakeChannel()
+        self.publisher.start_reading()
+
+    def tearDown(self):
+        self.serial_port.stop()
+        for master in self.masters:
+            try:
+                os.close(master)
+            except OSError:
+                pass
+        shutil.rmtree(self.directory)
+
+    def plug_in(self):
+        master, slave = os.openpty()
+        if path.lexists(self.link):
+            os.remove(self.link)
+        os.symlink(os.ttyname(slave), self.link)
+        os.close(slave)
+        self.masters.append(master)
+        return master
+
+    def write(self, master, *lines):
+        # The scanner drops the partial line before the first line ending
+        data = get_codec('ascii').encode('\r\n' + ''.join(lines))
+        os.write(master, data)
+        # The pty hands the bytes over in the background
+        deadline = time.time() + 1
+        while self.serial_port.serial_port.in_waiting < len(data) and time.time() < deadline:
+            time.sleep(0.001)
+
+    def get_published(self):
+        codec = get_codec('ascii')
+        return [codec.decode(body) for body in self.publisher._channel.published]
+
+    def on_readable(self):
+        handlers = self.publisher._connection.ioloop.handlers
+        self.assertEqual(list(handlers), [self.serial_port.fileno()])
+        handlers[self.serial_port.fileno()](self.serial_port.fileno(), None)
+
+    def test_should_publish_frames_of_readable_port(self):
+        self.write(self.masters[0], '1,2\r\n', '3,4\r\n')
+        self.on_readable()
+        self.assertEqual(self.get_published(), ['1,2\r\n', '3,4\r\n'])
+        self.assertEqual(self.publisher.metrics.snapshot()['counters']['frames_read'], 2)
+
+    def test_should_stop_watching_hung_up_port_until_it_opens_again(self):
+        fd = self.serial_port.fileno()
+        os.close(self.masters[0])
+        self.on_readable()
+        connection = self.publisher._connection
+        self.assertEqual(connection.ioloop.handlers, {})
+        self.assertEqual(self.publisher.metrics.snapshot()['counters']['port_hangups'], 1)
+        self.assertTrue('ttyUSB0' in str(self.publisher.get_port_counters()))
+        # Still unplugged, tried again later
+        os.remove(self.link)
+        connection.run_timeouts()
+        self.assertEqual(connection.ioloop.handlers, {})
+        self.assertEqual(len(connection.timeouts), 1)
+        master = self.plug_in()
+        connection.run_timeouts()
+        self.assertEqual(connection.timeouts, {})
+        self.write(master, '5,6\r\n')
+        self.on_readable()
+        self.assertEqual(self.get_published(), ['5,6\r\n'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import sys
+import random
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_iot_pool import SerialDataIoTPool, get_client_ids
+from serial_data_reconnect import ReconnectBackoff
+from mock_serial_data_fakes import FakeChannel, FakeIoTClient, build_consumer
+
+class ReconnectBackoffTest(unittest.TestCase):
+
+    def test_should_double_jittered_delay_up_to_max(self):
+        backoff = ReconnectBackoff(initial_delay=0.1, max_delay=1.0, rng=random.Random(1))
+        for attempt in range(10):
+            ceiling = min(0.1 * 2 ** attempt, 1.0)
+            delay = backoff.next_delay()
+            self.assertTrue(0 <= delay <= ceiling)
+        self.assertEqual(backoff.attempts, 10)
+
+    def test_should_time_outage_until_recovered(self):
+        backoff = ReconnectBackoff()
+        self.assertEqual(backoff.on_recovered(), None)
+        backoff.on_lost()
+        lost_time = backoff.lost_time
+        backoff.next_delay()
+        backoff.on_lost()
+        self.assertEqual(backoff.lost_time, lost_time)
+        seconds, attempts = backoff.on_recovered()
+        self.assertTrue(seconds >= 0)
+        self.assertEqual(attempts, 1)
+        self.assertEqual((backoff.attempts, backoff.lost_time), (0, None))
+
+class SerialDataConsumerStartupTest(unittest.TestCase):
+
+    def build_consumer(self, iot_client):
+        consumer = build_consumer(iot_client)
+        # Callbacks of the MQTT client thread run when the test says so
+        consumer._connection.ioloop.deferred = True
+        return consumer
+
+    def test_should_consume_once_both_connections_are_ready(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client)
+        consumer._iot_ready = False
+        consumer._subscribe_topic = 'test/topic'
+        consumer.on_basic_qos_ok(None)
+        self.assertEqual(consumer._channel.consumes, 0)
+        consumer.connect_iot_client()
+        iot_client.connack(mid=0, data=0)
+        self.assertEqual(iot_client.subscriptions, ['test/topic'])
+        for callback in consumer._connection.ioloop.callbacks:
+            callback()
+        self.assertEqual(consumer._channel.consumes, 1)
+        # CONNACKs of later reconnects neither subscribe nor consume again
+        iot_client.connack(mid=0, data=0)
+        consumer.start_consuming_when_ready()
+        self.assertEqual(iot_client.subscriptions, ['test/topic'])
+        self.assertEqual(consumer._channel.consumes, 1)
+        milestones = consumer.metrics.snapshot()['gauges']['startup_seconds']
+        self.assertEqual(list(milestones), ['amqp_ready', 'iot_ready', 'consuming'])
+
+    def test_should_consume_when_iot_connected_before_channel(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client)
+        consumer._iot_ready = False
+        consumer.connect_iot_client()
+        iot_client.connack(mid=0, data=0)
+        consumer.on_basic_qos_ok(None)
+        self.assertEqual(consumer._channel.consumes, 1)
+
+    def test_should_reconnect_after_jittered_delay_and_report_recovery(self):
+        consumer = self.build_consumer(FakeIoTClient())
+        consumer.on_connection_closed(None, 320, 'CONNECTION_FORCED')
+        consumer.on_connection_open_error(None, 'Connection refused')
+        delays = [deadline for deadline, _ in consumer._connection.timeouts.values()]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(delays[0] <= 0.1 and delays[1] <= 0.2)
+        consumer._channel = FakeChannel()
+        consumer.on_basic_qos_ok(None)
+        snapshot = consumer.metrics.snapshot()
+        self.assertEqual(snapshot['counters']['reconnects'], 1)
+        self.assertEqual(snapshot['histograms']['recover_seconds']['count'], 1)
+        self.assertEqual(consumer._reconnect.attempts, 0)
+
+    def test_should_pause_consuming_while_offline_without_spool(self):
+        consumer = build_consumer(FakeIoTClient())
+        consumer.on_basic_qos_ok(None)
+        self.assertEqual(consumer._channel.consumes, 1)
+        consumer.on_iot_offline()
+        self.assertEqual(consumer._channel.cancels, ['ctag1'])
+        consumer.on_iot_online()
+        self.assertEqual(consumer._channel.consumes, 2)
+        # A channel set up while offline waits for the IoT client
+        consumer.on_channel_closed(1, 320, 'CONNECTION_FORCED')
+        consumer.on_iot_offline()
+        consumer._channel = FakeChannel()
+        consumer.on_basic_qos_ok(None)
+        self.assertEqual(consumer._channel.consumes, 0)
+        consumer.on_iot_online()
+        self.assertEqual(consumer._channel.consumes, 1)
+
+    def test_should_forward_connack_of_pool_connections(self):
+        clients = [FakeIoTClient(), FakeIoTClient(failing=True)]
+        pool = SerialDataIoTPool(clients, get_client_ids('gateway', 2))
+        connacks = []
+        pool.connectAsync(ackCallback=lambda mid, data: connacks.append((mid, data)))
+        self.assertFalse(pool.connections[1].online)
+        pool.cancel_reconnects()
+        clients[0].connack(mid=0, data=0)
+        self.assertEqual(connacks, [((0, 0), 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import time
+import unittest
+import sys, json
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_schema import (SerialDataSchemaFramer, SerialDataSchemaCache, DEFAULT_FIELD_TYPES,
+                                SCHEMA_MARKER, DATA_MARKER, encode_timestamp)
+from serial_data_utils import SerialDataUtils
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+class SerialDataSchemaTest(unittest.TestCase):
+
+    headings = SerialDataUtils().generate_mock_headings()
+    values = [cell + '\n' for cell in ['2019-02-08 14:26:09.506939', 'V001', '0', 'Sensor', '8', 'Active', '52', '28']]
+
+    def setUp(self):
+        self.time_zone = os.environ.get('TZ')
+        self.set_time_zone('UTC')
+
+    def tearDown(self):
+        self.set_time_zone(self.time_zone)
+
+    def set_time_zone(self, time_zone):
+        if time_zone is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = time_zone
+        time.tzset()
+
+    def transfer(self, parser, row):
+        writer = SerialData()
+        writer.set_message(row)
+        writer.parse_csv_to_string().parse_string_to_ascii()
+        parser.set_message(writer.message)
+        return parser.parse_ascii_to_string().parse_string_to_json().message
+
+    def test_should_parse_schema_lines_like_legacy_lines(self):
+        parser = SerialData()
+        legacy = self.transfer(parser, self.headings + self.values)
+        schema_row, data_row = SerialDataSchemaFramer().frame(self.headings, self.values)
+        self.assertEqual(self.transfer(parser, schema_row), '')
+        self.assertEqual(json.loads(self.transfer(parser, data_row)), json.loads(legacy))
+        self.assertLess(len(data_row), len(self.headings + self.values))
+
+    def test_should_drop_data_lines_with_unknown_schema(self):
+        parser = SerialData()
+        schema_row, data_row = SerialDataSchemaFramer().frame(self.headings, self.values)
+        self.assertEqual(self.transfer(parser, data_row), '')
+        self.assertEqual(parser.unknown_schema, schema_row[0][1:])
+        self.assertEqual(self.transfer(parser, schema_row), '')
+        self.assertEqual(parser.unknown_schema, None)
+
+    def test_should_resend_schema_on_interval_and_change(self):
+        framer = SerialDataSchemaFramer(resend_interval=2)
+        lengths = [len(framer.frame(self.headings, self.values)) for _ in range(5)]
+        self.assertEqual(lengths, [2, 1, 2, 1, 2])
+        self.assertEqual(len(framer.frame(self.headings[:-1], self.values[:-1])), 2)
+
+    def test_should_write_declared_fields_as_json_numbers(self):
+        parser = SerialData()
+        parser.set_field_types(DEFAULT_FIELD_TYPES)
+        message = json.loads(self.transfer(parser, self.headings + self.values))
+        self.assertEqual(message['Sensor1'], 52)
+        self.assertEqual(message['Dev ID'], 0)
+        self.assertEqual(message['Total runtime'], 1549635969507)
+        self.assertEqual(message['FW ver'], 'V001')
+
+    def test_should_keep_unparseable_typed_values_as_strings(self):
+        parser = SerialData()
+        parser.set_field_types({'Sensor1': 'int', 'Total runtime': 'timestamp'})
+        values = ['now\n'] + self.values[1:6] + ['n/a\n'] + self.values[7:]
+        message = json.loads(self.transfer(parser, self.headings + values))
+        self.assertEqual(message['Sensor1'], 'n/a')
+        self.assertEqual(message['Total runtime'], 'now')
+
+    def test_should_read_timestamps_in_local_time(self):
+        self.set_time_zone('EET-2EEST,M3.5.0/3,M10.5.0/4')
+        self.assertEqual(encode_timestamp('2019-02-08 14:26:09.506939'), str(1549635969507 - 7200000))
+        # Summer time of the same zone
+        self.assertEqual(encode_timestamp('2019-07-08 14:26:09'), str(1562595969000 - 10800000))
+
+    def test_should_drop_least_recently_used_legacy_schemas(self):
+        cache = SerialDataSchemaCache()
+        cache.MAX_LEGACY_SCHEMAS = 2
+        first = cache.get_legacy(['a', 'b'])
+        cache.get_legacy(['c', 'd'])
+        self.assertTrue(cache.get_legacy(['a', 'b']) is first)
+        cache.get_legacy(['e', 'f'])
+        self.assertEqual(list(cache._legacy_schemas), [('a', 'b'), ('e', 'f')])
+
+    def test_should_keep_timestamps_with_nan_or_inf_seconds_as_strings(self):
+        for value in ('2019-02-08 14:26:nan', '2019-02-08 14:26:inf', '2019-02-08 14:26:1e400'):
+            self.assertEqual(encode_timestamp(value), json.dumps(value))
+
+class SerialDataConsumerSchemaTest(unittest.TestCase):
+
+    headings = SerialDataSchemaTest.headings
+    values = SerialDataSchemaTest.values
+
+    def encode(self, row):
+        writer = SerialData()
+        writer.set_message(row)
+        return writer.parse_csv_to_string().parse_string_to_ascii().message
+
+    def deliver(self, consumer, delivery_tag, row):
+        deliver(consumer, delivery_tag, self.encode(row), {'codec': 'ascii'})
+
+    def test_should_requeue_lines_until_schema_arrives_after_restart(self):
+        framer = SerialDataSchemaFramer(resend_interval=3)
+        rows = [row for _ in range(4) for row in framer.frame(self.headings, self.values)]
+        # Schema, three data lines, schema resend, data line
+        self.assertEqual([row[0][0] for row in rows], [SCHEMA_MARKER] + [DATA_MARKER] * 3 +
+                                                      [SCHEMA_MARKER, DATA_MARKER])
+        # Consumer restarted after the first schema and data line
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client)
+        self.deliver(consumer, 1, rows[2])
+        self.deliver(consumer, 2, rows[3])
+        self.assertEqual(iot_client.payloads, [])
+        self.assertEqual((consumer._channel.acks, consumer._channel.nacks), ([], []))
+        self.deliver(consumer, 3, rows[4])
+        self.assertEqual(consumer._channel.nacks, [1, 2])
+        self.assertEqual(consumer._channel.acks, [(3, False)])
+        self.deliver(consumer, 4, rows[5])
+        # Broker redelivers the requeued lines
+        self.deliver(consumer, 5, rows[2])
+        self.deliver(consumer, 6, rows[3])
+        self.assertEqual(len(iot_client.payloads), 3)
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [(3, False), (4, True), (5, True), (6, True)])
+        self.assertEqual(consumer.metrics.snapshot()['counters']['schema_wait_requeues'], 2)
+
+    def test_should_hold_later_acks_and_requeue_after_wait_interval(self):
+        schema_row, data_row = SerialDataSchemaFramer().frame(self.headings, self.values)
+        iot_client = FakeIoTClient()
+        consumer = build_consumer(iot_client)
+        self.deliver(consumer, 1, data_row)
+        self.deliver(consumer, 2, self.headings + self.values)
+        iot_client.puback_all()
+        self.assertEqual(consumer._channel.acks, [])
+        consumer._connection.run_timeouts()
+        self.assertEqual(consumer._channel.nacks, [1])
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+if __name__ == '__main__':
+    unittest.main()
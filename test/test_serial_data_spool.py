@@ -0,0 +1,145 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_spool import SerialDataSpool
+from serial_data_utils import SerialDataUtils
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+class SerialDataSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.spool'))
+
+    def test_should_read_payloads_in_append_order(self):
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        spool.append('{"Dev ID":"0"}')
+        spool.append('{"Dev ID":"1"}')
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.read()[0], '{"Dev ID":"0"}')
+        self.assertEqual(spool.read()[0], '{"Dev ID":"1"}')
+        self.assertEqual(spool.read(), None)
+        self.assertEqual(len(spool), 0)
+        spool.close()
+
+    def test_should_resume_after_restart_from_checkpoint(self):
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        for number in range(5):
+            spool.append('payload %i' % number)
+        for number in range(2):
+            _, position = spool.read()
+        spool.read()
+        spool.commit(position)
+        spool.close()
+
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        self.assertEqual(len(spool), 3)
+        self.assertEqual(spool.read()[0], 'payload 2')
+        spool.append('payload 5')
+        self.assertEqual([spool.read()[0] for _ in range(3)], ['payload 3', 'payload 4', 'payload 5'])
+        spool.close()
+
+    def test_should_roll_segments_and_remove_committed_ones(self):
+        spool = SerialDataSpool(self.directory, segment_size=64)
+        for number in range(6):
+            self.assertTrue(spool.append('payload of 24 bytes %04i' % number))
+        self.assertEqual(len(self.segments()), 3)
+        for number in range(5):
+            payload, position = spool.read()
+            self.assertEqual(payload, 'payload of 24 bytes %04i' % number)
+        spool.commit(position)
+        self.assertEqual(len(self.segments()), 1)
+        spool.close()
+
+        spool = SerialDataSpool(self.directory, segment_size=64)
+        self.assertEqual(len(spool), 1)
+        self.assertEqual(spool.read()[0], 'payload of 24 bytes 0005')
+        spool.close()
+
+    def test_should_refuse_appends_when_full(self):
+        spool = SerialDataSpool(self.directory, segment_size=64, max_segments=2)
+        appended = [spool.append('payload of 24 bytes %04i' % number) for number in range(5)]
+        self.assertEqual(appended, [True, True, True, True, False])
+        spool.close()
+
+    def test_should_read_uncommitted_payloads_again_after_rewind(self):
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        for number in range(3):
+            spool.append('payload %i' % number)
+        _, position = spool.read()
+        spool.commit(position)
+        spool.read()
+        spool.read()
+        spool.rewind()
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.read()[0], 'payload 1')
+        spool.close()
+
+    def test_should_drop_torn_record_at_end(self):
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        spool.append('payload 0')
+        spool.append('payload 1')
+        spool.close()
+        segment = path.join(self.directory, self.segments()[0])
+        with open(segment, 'r+b') as f:
+            f.seek(8 + len('payload 0') + 8)
+            f.write('X')
+
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        self.assertEqual(len(spool), 1)
+        spool.append('payload 2')
+        self.assertEqual([spool.read()[0] for _ in range(2)], ['payload 0', 'payload 2'])
+        spool.close()
+
+class SerialDataConsumerSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        utils = SerialDataUtils()
+        writer = SerialData()
+        writer.set_message(utils.generate_mock_headings() + utils.generate_mock_values())
+        self.body = writer.parse_csv_to_string().parse_string_to_ascii().message
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_spool_while_offline_and_replay_once_online(self):
+        iot_client = FakeIoTClient()
+        spool = SerialDataSpool(self.directory, segment_size=4096)
+        consumer = build_consumer(iot_client, spool=spool)
+        consumer._replay.start(consumer._connection)
+        consumer.on_iot_offline()
+        deliver(consumer, 1, self.body, {'codec': 'ascii'})
+        # Spool owns the payload, the delivery is acked right away
+        self.assertEqual(iot_client.payloads, [])
+        self.assertEqual(consumer._channel.acks, [(1, True)])
+        self.assertEqual(len(spool), 1)
+        consumer.on_iot_online()
+        consumer._connection.run_timeouts()
+        self.assertEqual(len(iot_client.payloads), 1)
+        # Spooled payloads in flight keep new ones behind them
+        deliver(consumer, 2, self.body, {'codec': 'ascii'})
+        self.assertEqual(len(iot_client.payloads), 1)
+        iot_client.puback_all()
+        consumer._connection.run_timeouts()
+        iot_client.puback_all()
+        self.assertEqual(len(iot_client.payloads), 2)
+        self.assertEqual(len(spool), 0)
+        deliver(consumer, 3, self.body, {'codec': 'ascii'})
+        self.assertEqual(len(iot_client.payloads), 3)
+        spool.close()
+
+if __name__ == '__main__':
+    unittest.main()
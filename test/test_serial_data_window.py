@@ -0,0 +1,169 @@
+import unittest
+import sys
+import json
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_data_window import SerialDataWindows, FieldWindow, get_number
+from mock_serial_data_fakes import FakeIoTClient, build_consumer, deliver
+
+HEADINGS = '"Total runtime","FW ver","Dev ID","Type","inputs","state","Sensor1","Sensor2"'
+VALUES = '"2019-02-08 14:26:09.506939","V001","%s","Sensor","8","Active","%s","%s"'
+
+def get_message(sensor1, sensor2, device_id='0'):
+    return json.dumps({'Dev ID': device_id, 'state': 'Active',
+                       'Sensor1': str(sensor1), 'Sensor2': str(sensor2)})
+
+class SerialDataWindowTest(unittest.TestCase):
+
+    def test_should_keep_stats_of_field(self):
+        first = FieldWindow()
+        for value in (5, 1, 9):
+            first.add(value)
+        second = FieldWindow()
+        second.add(3)
+        first.merge(second)
+        self.assertEqual(dict(first.to_dict()),
+                         {'count': 4, 'min': 1, 'max': 9, 'mean': 4.5, 'last': 3})
+        self.assertEqual(get_number('52'), 52)
+        self.assertEqual(get_number('1.5'), 1.5)
+        self.assertEqual(get_number('nan'), None)
+        self.assertEqual(get_number('Active'), None)
+
+    def test_should_send_tumbling_window_when_next_one_starts(self):
+        windows = SerialDataWindows(10, fields=['Sensor1', 'Sensor2'])
+        for sample_time, sensor1 in ((100.5, 52), (103.0, 50), (109.9, 57)):
+            pane, records, raw = windows.add('dev0', get_message(sensor1, 28), sample_time)
+            self.assertEqual((records, raw), ([], None))
+        pane, records, raw = windows.add('dev0', get_message(40, 28), 110.0)
+        self.assertEqual(pane.start, 110.0)
+        self.assertEqual(len(records), 1)
+        key, record, released = records[0]
+        self.assertEqual(key, 'dev0')
+        self.assertEqual([released_pane.start for released_pane in released], [100.0])
+        record = json.loads(record)
+        self.assertEqual((record['window_start'], record['window_end']), (100000, 110000))
+        self.assertEqual(record['Sensor1'], {'count': 3, 'min': 50, 'max': 57,
+                                             'mean': 53.0, 'last': 57})
+        self.assertEqual(record['Sensor2']['count'], 3)
+        self.assertEqual((record['Dev ID'], record['state']), ('0', 'Active'))
+
+    def test_should_keep_devices_of_one_port_apart(self):
+        windows = SerialDataWindows(10, fields=['Sensor1'])
+        windows.add('port0', get_message(1, 0, '1'), 100, now=100)
+        windows.add('port0', get_message(2, 0, '2'), 100, now=100)
+        self.assertEqual(len(windows), 2)
+        records = windows.flush_idle(now=200)
+        self.assertEqual(sorted(json.loads(record)['Sensor1']['count'] for _, record, _ in records),
+                         [1, 1])
+        self.assertEqual(len(windows), 0)
+
+    def test_should_slide_windows_over_panes(self):
+        windows = SerialDataWindows(3, 1, fields=['Sensor1'])
+        for sample_time in range(100, 105):
+            pane, records, raw = windows.add('dev0', get_message(sample_time, 0),
+                                             sample_time + 0.5, now=sample_time + 0.5)
+        # Last value closes the window ending at 104, panes from 102 are still needed
+        self.assertEqual(len(records), 1)
+        record = json.loads(records[0][1])
+        self.assertEqual((record['window_start'], record['window_end']), (101000, 104000))
+        self.assertEqual((record['Sensor1']['min'], record['Sensor1']['max']), (101, 103))
+        self.assertEqual([released_pane.start for released_pane in records[0][2]], [101.0])
+        records = windows.flush_idle(now=1000)
+        self.assertEqual([json.loads(record)['Sensor1']['count'] for _, record, _ in records],
+                         [3, 2, 1])
+        self.assertEqual(sum(len(released) for _, _, released in records), 3)
+
+    def test_should_pass_selected_fields_through_raw(self):
+        windows = SerialDataWindows(10, fields=['Sensor1', 'Sensor2'], passthrough=['Sensor2'])
+        pane, records, raw = windows.add('dev0', get_message(52, 28), 100)
+        self.assertNotEqual(pane, None)
+        raw = json.loads(raw)
+        self.assertEqual(raw['Sensor2'], '28')
+        self.assertFalse('Sensor1' in raw)
+
+    def test_should_send_messages_without_window_fields_unchanged(self):
+        windows = SerialDataWindows(10, fields=['Sensor1'])
+        message = json.dumps({'Dev ID': '0', 'Sensor1': 'n/a'})
+        self.assertEqual(windows.add('dev0', message, 100), (None, [], message))
+        self.assertEqual(windows.add('dev0', 'not json', 100), (None, [], 'not json'))
+        self.assertRaises(ValueError, SerialDataWindows, 10, 3, ['Sensor1'])
+        self.assertRaises(ValueError, SerialDataWindows, 10, 5, [])
+
+class SerialDataConsumerWindowTest(unittest.TestCase):
+
+    def build_consumer(self, iot_client, passthrough=(), prefetch_count=1000):
+        consumer = build_consumer(iot_client, window=10, window_fields=['Sensor1', 'Sensor2'],
+                                  window_passthrough=passthrough, prefetch_count=prefetch_count)
+        consumer._window_publisher.start(consumer._connection)
+        return consumer
+
+    def deliver(self, consumer, delivery_tag, frame_time, sensor1=52):
+        codec = get_codec('ascii')
+        body = codec.encode('%s,%s\r\n' % (HEADINGS, VALUES % ('0', sensor1, 28)))
+        headers = {'codec': codec.name, 'device': 'dev0', 'frame_us': int(frame_time * 1e6)}
+        deliver(consumer, delivery_tag, body, headers)
+
+    def test_should_ack_window_messages_after_record_puback(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client)
+        self.deliver(consumer, 1, 100.0, 50)
+        self.deliver(consumer, 2, 105.0, 54)
+        self.assertEqual(iot_client.payloads, [])
+        self.deliver(consumer, 3, 111.0)
+        self.assertEqual(len(iot_client.payloads), 1)
+        record = json.loads(iot_client.payloads[0])
+        self.assertEqual(record['Sensor1']['mean'], 52.0)
+        self.assertEqual(consumer._channel.acks, [])
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [(2, True)])
+
+    def test_should_hold_raw_acks_until_window_is_uploaded(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client, passthrough=['Sensor2'])
+        self.deliver(consumer, 1, 100.0)
+        self.assertEqual(len(iot_client.payloads), 1)
+        self.assertFalse('Sensor1' in json.loads(iot_client.payloads[0]))
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [])
+        self.deliver(consumer, 2, 111.0)
+        # Window record, then the raw message of the next window
+        self.assertEqual(len(iot_client.payloads), 3)
+        self.assertEqual(json.loads(iot_client.payloads[1])['Sensor1']['count'], 1)
+        consumer.on_iot_puback(2)
+        self.assertEqual(consumer._channel.acks, [(1, True)])
+
+    def test_should_keep_window_acks_when_record_is_queued(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client)
+        self.deliver(consumer, 1, 100.0)
+        iot_client.queued = True
+        self.deliver(consumer, 2, 111.0)
+        self.assertEqual(consumer._channel.acks, [])
+        self.assertEqual(len(consumer._window_publisher._retry), 1)
+        iot_client.queued = False
+        consumer._window_publisher.on_timer()
+        self.assertEqual(len(iot_client.payloads), 1)
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [(1, True)])
+
+    def test_should_report_windows_holding_all_prefetched_messages(self):
+        iot_client = FakeIoTClient()
+        consumer = self.build_consumer(iot_client, prefetch_count=3)
+        self.deliver(consumer, 1, 100.0)
+        self.deliver(consumer, 2, 101.0)
+        self.assertFalse('window_starved' in consumer.metrics.snapshot()['counters'])
+        # RabbitMQ delivers nothing more until the window is uploaded
+        self.deliver(consumer, 3, 102.0)
+        snapshot = consumer.metrics.snapshot()
+        self.assertEqual(snapshot['counters']['window_starved'], 1)
+        self.assertEqual(snapshot['gauges']['window_held_messages'], 3)
+        self.deliver(consumer, 4, 111.0)
+        consumer.on_iot_puback(1)
+        self.assertEqual(consumer._channel.acks, [(3, True)])
+        self.assertEqual(consumer.metrics.snapshot()['gauges']['window_held_messages'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
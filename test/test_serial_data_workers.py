@@ -0,0 +1,99 @@
+import unittest
+import sys
+import json
+import time
+import Queue
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_data_workers import SerialDataWorkerPool
+
+HEADINGS = '"Dev ID","Sensor1"'
+
+class FakeTask(object):
+
+    # Result of a task whose worker died
+
+    def ready(self):
+        return False
+
+class FakePool(object):
+
+    def apply_async(self, function, args, callback=None):
+        return FakeTask()
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+class SerialDataWorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # Callbacks of the result thread run in the test thread, like in the ioloop
+        self.dispatched = Queue.Queue()
+        self.results = []
+        self.pool = SerialDataWorkerPool(2, self.dispatched.put)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def submit(self, body, codec_name='ascii'):
+        index = len(self.results)
+        self.results.append(None)
+        def callback(kind, message):
+            self.results[index] = (kind, message)
+        self.pool.submit(codec_name, body, callback)
+
+    def submit_line(self, sensor1):
+        self.submit(get_codec('ascii').encode('%s,"0","%s"\r\n' % (HEADINGS, sensor1)))
+
+    def wait(self, check=False):
+        deadline = time.time() + 10
+        while len(self.pool) and time.time() < deadline:
+            if check:
+                self.pool.check()
+            try:
+                self.dispatched.get(timeout=0.01)()
+            except Queue.Empty:
+                pass
+        self.assertEqual(len(self.pool), 0)
+
+    def test_should_release_results_in_submission_order(self):
+        for sensor1 in range(50):
+            self.submit_line(sensor1)
+        self.wait()
+        self.assertEqual([kind for kind, _ in self.results], ['json'] * 50)
+        self.assertEqual([json.loads(message)['Sensor1'] for _, message in self.results],
+                         [str(sensor1) for sensor1 in range(50)])
+        self.assertEqual(sum(stats['messages'] for stats in self.pool.get_stats().values()), 50)
+
+    def test_should_fail_tasks_that_cannot_be_pickled_and_keep_going(self):
+        self.submit_line(1)
+        self.submit(lambda: None)
+        self.submit('not ascii decimals')
+        self.submit_line(4)
+        self.wait(check=True)
+        self.assertEqual([kind for kind, _ in self.results], ['json', 'error', 'error', 'json'])
+        self.assertEqual(json.loads(self.results[3][1])['Sensor1'], '4')
+
+    def test_should_fail_tasks_without_result_after_timeout(self):
+        self.pool.close()
+        self.pool._pool = FakePool()
+        self.submit_line(1)
+        self.submit_line(2)
+        self.pool.on_result((2, 1, 0.0, 'json', '{}'))
+        self.pool.check()
+        self.assertEqual(self.results, [None, None])
+        self.pool.check(time.time() + 31)
+        self.assertEqual(self.results, [('error', 'No result after 30 seconds'), ('json', '{}')])
+        # A result that turns up after all is ignored
+        self.pool.on_result((1, 1, 0.0, 'json', '{}'))
+        self.assertEqual(self.results[0][0], 'error')
+        self.assertEqual(len(self.pool), 0)
+
+if __name__ == '__main__':
+    unittest.main()
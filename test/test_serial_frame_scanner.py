@@ -0,0 +1,41 @@
+import unittest
+import sys
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_frame_scanner import SerialFrameScanner
+
+class SerialFrameScannerTest(unittest.TestCase):
+
+    line = b'34 65 10 34 44 34 49 10 34 13 10'
+
+    def test_should_drop_partial_line_before_first_crlf(self):
+        scanner = SerialFrameScanner()
+        frames = scanner.feed(b'49 50 13 10' + self.line)
+        self.assertEqual(frames, [self.line])
+        self.assertEqual(scanner.bytes_dropped, len(b'49 50 13 10'))
+
+    def test_should_emit_frames_fed_one_byte_at_a_time(self):
+        scanner = SerialFrameScanner()
+        stream = b'13 10' + self.line + self.line
+        frames = []
+        for i in range(len(stream)):
+            frames.extend(scanner.feed(stream[i:i + 1]))
+        self.assertEqual(frames, [self.line, self.line])
+        self.assertEqual(scanner.frames_emitted, 2)
+        self.assertEqual(scanner.bytes_read, len(stream))
+
+    def test_should_not_match_crlf_inside_other_codes(self):
+        scanner = SerialFrameScanner()
+        frames = scanner.feed(b'13 10' + b'113 10 ' + self.line)
+        self.assertEqual(frames, [b'113 10 ' + self.line])
+
+    def test_should_resync_after_oversized_garbage(self):
+        scanner = SerialFrameScanner(max_frame_size=16)
+        scanner.feed(b'13 10' + b'49 ' * 10)
+        self.assertEqual(scanner.feed(b'13 10' + self.line), [self.line])
+        self.assertEqual(scanner.bytes_read, scanner.bytes_dropped + len(self.line))
+
+if __name__ == '__main__':
+    unittest.main()
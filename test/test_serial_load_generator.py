@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data import SerialData
+from serial_data_codec import get_codec
+from serial_frame_scanner import SerialFrameScanner
+from serial_load_generator import SerialLoadGenerator, SerialLoadSchedule, build_load_payloads
+
+class SerialLoadScheduleTest(unittest.TestCase):
+
+    def test_should_keep_lines_due_on_fixed_offsets(self):
+        schedule = SerialLoadSchedule(1000)
+        self.assertEqual(schedule.lines_due(2.5), 2500)
+        self.assertAlmostEqual(schedule.time_due(2500), 2.5)
+
+    def test_should_ramp_rate_linearly(self):
+        schedule = SerialLoadSchedule(0, 100, 10)
+        self.assertEqual(schedule.rate_at(5), 50)
+        self.assertEqual(schedule.lines_due(10), 500)
+        self.assertEqual(schedule.lines_due(11), 600)
+        for lines in (1, 125, 499, 500, 700):
+            self.assertAlmostEqual(schedule.lines_due(schedule.time_due(lines)), lines)
+
+    def test_should_never_be_due_after_ramp_down_to_zero(self):
+        schedule = SerialLoadSchedule(100, 0, 2)
+        self.assertAlmostEqual(schedule.time_due(75), 1)
+        self.assertEqual(schedule.time_due(100), None)
+
+class SerialLoadGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ports = [os.path.join(self.directory, name) for name in ('pts3', 'pts5')]
+        for port in self.ports:
+            open(port, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_build_same_payloads_for_same_seed(self):
+        self.assertEqual(build_load_payloads(2, 4, 10, seed=7), build_load_payloads(2, 4, 10, seed=7))
+        self.assertNotEqual(build_load_payloads(2, 4, 10, seed=7), build_load_payloads(2, 4, 10, seed=8))
+
+    def test_should_spread_devices_and_lines_over_ports(self):
+        payloads = build_load_payloads(2, 3, 2)
+        generator = SerialLoadGenerator(self.ports, payloads)
+        generator.write_lines(7)
+        generator.write_lines(4)
+        generator.close()
+        scanner = SerialFrameScanner()
+        serial_data = SerialData()
+        codec = get_codec()
+        for port, expected_lines in zip(self.ports, (6, 5)):
+            scanner.reset()
+            with open(port) as serial_port:
+                frames = scanner.feed('13 10 ' + serial_port.read())
+            self.assertEqual(len(frames), expected_lines)
+            dev_ids = set()
+            for frame in frames:
+                serial_data.set_message(frame)
+                message = serial_data.parse_wire_to_string(codec).parse_string_to_json().message
+                dev_ids.add(json.loads(message)['Dev ID'])
+            self.assertEqual(dev_ids, set(['0', '2']) if port == self.ports[0] else set(['1']))
+        self.assertEqual(generator.lines_written, 11)
+        self.assertEqual(generator.bytes_written, sum(os.path.getsize(port) for port in self.ports))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import shutil
+import serial
+import tempfile
+import unittest
+
+from os import path
+sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+
+from serial_data_codec import get_codec
+from serial_port_reader import SerialPortReader, get_device_id, parse_port_list
+
+class EmptyPort(object):
+
+    in_waiting = 0
+
+    def read(self, size=1):
+        return ''
+
+class SerialPortReaderTest(unittest.TestCase):
+
+    def test_should_make_device_id_from_port(self):
+        self.assertEqual(get_device_id('/dev/ttyUSB0'), 'ttyUSB0')
+        self.assertEqual(get_device_id('/dev/pts/4'), 'pts_4')
+        self.assertEqual(get_device_id('mcu.1'), 'mcu_1')
+
+    def test_should_parse_list_of_ports(self):
+        self.assertEqual(parse_port_list('/dev/pts/4, /dev/pts/6=mcu2,'),
+                         [('/dev/pts/4', 'pts_4'), ('/dev/pts/6', 'mcu2')])
+
+    def test_should_expand_glob_of_ports(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ('ttyUSB1', 'ttyUSB0', 'ttyS0'):
+                open(os.path.join(directory, name), 'w').close()
+            ports = parse_port_list(os.path.join(directory, 'ttyUSB*'))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([os.path.basename(port) for port, _ in ports], ['ttyUSB0', 'ttyUSB1'])
+        self.assertEqual(ports[0][1], get_device_id(ports[0][0]))
+
+    def test_should_raise_on_read_of_hung_up_port(self):
+        master, slave = os.openpty()
+        reader = SerialPortReader(get_codec('ascii'))
+        reader.open(os.ttyname(slave))
+        os.close(slave)
+        try:
+            # The scanner drops the partial line before the first line ending
+            os.write(master, get_codec('ascii').encode('\r\n1,2\r\n'))
+            time.sleep(0.05)
+            frames = reader.frames()
+            self.assertEqual(get_codec('ascii').decode(next(frames)), '1,2\r\n')
+            # A hangup fails like a port that fails to read
+            os.close(master)
+            self.assertRaises(IOError, next, frames)
+            self.assertRaises(IOError, reader.read_frames)
+        finally:
+            reader.stop()
+        # A port that is readable but returns no data is hung up as well
+        reader.serial_port = EmptyPort()
+        self.assertRaises(serial.SerialException, reader.read_pending)
+        self.assertRaises(serial.SerialException, reader.read_frames)
+
+if __name__ == '__main__':
+    unittest.main()